@@ -28,6 +28,17 @@ export const addActivity = async (req, res) => {
 
     await activity.save();
 
+    // Feed the activity into the Python profile aggregates (best effort)
+    axios
+      .post(`${PY_URL}/profiles/events`, {
+        userId: String(userId),
+        category,
+        details,
+        co2_kg: co2,
+        createdAt: activity.createdAt,
+      })
+      .catch((e) => console.error("Profile aggregate update failed:", e.message));
+
     // -----------------------------
     //   UPDATE USER STREAK + LEVEL
     // -----------------------------
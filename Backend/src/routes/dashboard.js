@@ -7,6 +7,34 @@ import axios from "axios";
 const router = express.Router();
 const PY_URL = process.env.PYTHON_SERVICE_URL || "http://localhost:5000";
 
+// New users' profiles are fed to the stored cluster model in batches
+const CLUSTER_BATCH_SIZE = 50;
+const CLUSTER_FLUSH_MS = 5000;
+let pendingProfiles = [];
+let flushTimer = null;
+
+const flushClusterUpdates = () => {
+  clearTimeout(flushTimer);
+  flushTimer = null;
+  const profiles = pendingProfiles;
+  pendingProfiles = [];
+  if (profiles.length === 0) return;
+
+  // best effort: a missed batch is picked up by the next refit
+  axios
+    .post(`${PY_URL}/model3/partial_fit`, { profiles })
+    .catch((e) => console.error("Cluster update failed:", e.message));
+};
+
+const queueClusterUpdate = (profile) => {
+  pendingProfiles.push(profile);
+  if (pendingProfiles.length >= CLUSTER_BATCH_SIZE) {
+    flushClusterUpdates();
+  } else if (!flushTimer) {
+    flushTimer = setTimeout(flushClusterUpdates, CLUSTER_FLUSH_MS);
+  }
+};
+
 // Get monthly carbon summary for user
 router.get("/:userId/monthly-carbon", async (req, res) => {
   try {
@@ -103,12 +131,18 @@ router.post("/:userId/calculate-profile", async (req, res) => {
     };
 
     // Update or create user profile
-    await UserProfile.findOneAndUpdate(
+    const previous = await UserProfile.findOneAndUpdate(
       { userId },
       profile,
-      { upsert: true, new: true }
+      { upsert: true, new: false }
     );
 
+    // Only a new user's profile updates the cluster model: resending a
+    // recalculated one would count the same user again
+    if (!previous) {
+      queueClusterUpdate(profile);
+    }
+
     res.json({ success: true, profile });
   } catch (err) {
     console.error("Calculate Profile Error:", err);
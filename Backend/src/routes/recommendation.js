@@ -10,28 +10,41 @@ router.get("/:userId/recommendation", async (req, res) => {
   try {
     const { userId } = req.params;
 
-    // 1️⃣ Fetch all profiles to run clustering
-    const profiles = await UserProfile.find().lean();
+    // 1️⃣ Fetch only this user's profile
+    const profile = await UserProfile.findOne({ userId }).lean();
 
-    if (!profiles || profiles.length === 0) {
+    if (!profile) {
       return res.status(404).json({ 
         error: "No user profiles found. Please create a profile first." 
       });
     }
 
-    // Convert MongoDB ObjectIds to strings for Python
-    const profilesWithStringIds = profiles.map(p => ({
+    const toPython = (p) => ({
       ...p,
       _id: p._id.toString(),
       userId: p.userId.toString()
-    }));
+    });
 
-    // 2️⃣ Send to Python model3 recommendation service
-    const resp = await axios.post(`${PY_URL}/model3/recommend`, { 
+    // 2️⃣ Ask Python model3 for the nearest stored cluster
+    const recommend = () => axios.post(`${PY_URL}/model3/recommend`, {
       userId: userId,
-      profiles: profilesWithStringIds 
+      profile: toPython(profile)
     });
 
+    let resp;
+    try {
+      resp = await recommend();
+    } catch (err) {
+      if (err.response?.status !== 409) throw err;
+
+      // No cluster model stored yet: fit it once from all profiles, then retry
+      const profiles = await UserProfile.find().lean();
+      await axios.post(`${PY_URL}/model3/refit`, {
+        profiles: profiles.map(toPython)
+      });
+      resp = await recommend();
+    }
+
     // 3️⃣ Return the recommendations
     return res.json(resp.data);
 
@@ -1,53 +1,233 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+import json
+import os
+import shutil
+import tempfile
 from flask_cors import CORS
-import model1
+import columnar
+import instrumentation
+import jobs
+import k_selection
 import model2
-import model3
+import profile_store
+import ranking
+import warmup
+from instrumentation import span
+from micro_batcher import MicroBatcher, MICROBATCH_ENABLED
+from prediction_cache import cache, CACHE_ENABLED
 print("=== Starting app.py ===")
 
-try:
-    print("Attempting to import predictonmodel...")
-    import predictonmodel
-    print("✓ predictonmodel imported successfully!")
-except Exception as e:
-    print(f"✗ ERROR importing predictonmodel: {e}")
-    import traceback
-    traceback.print_exc()
+# Heavy modules (pandas / sklearn / fitted models) are imported on first use
+# or by the background warm-up, never on the import path of app.py
+model1 = warmup.LazyModule("model1")
+model3 = warmup.LazyModule("model3")
+forecasting = warmup.LazyModule("forecasting")
+predictonmodel = warmup.LazyModule("predictonmodel")
+snapshots = warmup.LazyModule("snapshots")
 
+# Concurrent single-row RF predictions share one batched model call
+rf_batcher = MicroBatcher(
+    # single predictions carry their feature contributions (batches are small)
+    # unless RF_ENGINE=sklearn asks for the sklearn model
+    lambda payloads: predictonmodel.predict_carbon_emission_batch(
+        payloads, contributions=predictonmodel.RF_ENGINE == 'compiled'),
+    # the endpoint adds the "Invalid input: " prefix itself, as for unbatched errors
+    result_error=lambda result: (result["error"].removeprefix(predictonmodel.INVALID_INPUT)
+                                 if "error" in result else None)
+)
 
 app = Flask(__name__)
 CORS(app)
+warmup.start_warm_up()
+
+@app.before_request
+def start_request_timer():
+    instrumentation.begin_request()
+
+@app.after_request
+def record_request_timing(response):
+    server_timing = instrumentation.end_request(request.endpoint, request.method, response.status_code)
+    if server_timing:
+        response.headers["Server-Timing"] = server_timing
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus-style latency histograms per endpoint and per stage"""
+    return Response(instrumentation.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/health", methods=["GET"])
+def health():
+    """Liveness: the process is up and serving"""
+    return jsonify({"status": "ok"})
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness: heavy models are imported and loaded (always ready with MODEL_WARMUP=0)"""
+    return jsonify(warmup.status()), (200 if warmup.is_ready() else 503)
+
+def read_columnar():
+    """(columns, meta) of a binary columnar body (see columnar.py), or None for JSON"""
+    with span("app.parse_columnar"):
+        return columnar.read_request(request)
 
 @app.route("/model1/cluster", methods=["POST"])
 def cluster():
-    data = request.json
-    # either accept 'profiles' or read from file path
-    profiles = data.get("profiles")
-    result = model1.run_cluster(profiles)
-    return jsonify(result)
+    try:
+        body = read_columnar()
+        if body is not None:
+            # columns are the profiles; options such as k travel in the meta
+            profiles, data = body
+        else:
+            with span("app.parse_json"):
+                data = request.json
+            # either accept 'profiles' or read from file path
+            profiles = data.get("profiles")
+        k = k_selection.parse_k(data.get("k"), 2)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    response_format = columnar.response_format(request)
+    result = model1.run_cluster(profiles, k, columnar=response_format is not None)
+    if response_format:
+        return columnar.response(response_format, result.pop("profiles"), result)
+    with span("app.jsonify"):
+        return jsonify(result)
+
+@app.route("/model1/cluster/stream", methods=["POST"])
+def cluster_stream():
+    """
+    Cluster profiles in bounded memory and stream labelled rows back as NDJSON.
+
+    The request body may be NDJSON (application/x-ndjson) or CSV (text/csv),
+    with or without a Content-Length (chunked uploads); with an empty body
+    user_profiles.csv is read in chunks. The body is spooled to a temp file
+    so it can be read chunk by chunk on every pass.
+    """
+    try:
+        chunksize = int(request.args.get("chunksize", model1.CHUNK_SIZE))
+        if chunksize < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "chunksize must be a positive integer"}), 400
+    try:
+        k = k_selection.parse_k(request.args.get("k"), 2)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if k == "auto":
+        return jsonify({"error": "k=auto is not supported for streamed clustering"}), 400
+
+    # spool whatever arrives: chunked uploads carry no Content-Length
+    suffix = ".csv" if request.mimetype == "text/csv" else ".ndjson"
+    with tempfile.NamedTemporaryFile("wb", suffix=suffix, delete=False) as tmp:
+        shutil.copyfileobj(request.stream, tmp)
+        tmp_path = tmp.name
+    if os.path.getsize(tmp_path) == 0:
+        os.remove(tmp_path)
+        tmp_path = None
+        if not os.path.exists("user_profiles.csv"):
+            return jsonify({"error": "No profiles in the request body and no user_profiles.csv"}), 404
+        read_chunks = model1.csv_chunks(chunksize=chunksize)
+    elif suffix == ".csv":
+        read_chunks = model1.csv_chunks(tmp_path, chunksize)
+    else:
+        read_chunks = model1.ndjson_chunks(tmp_path, chunksize)
+
+    def generate():
+        try:
+            yield from model1.run_cluster_stream(read_chunks, k)
+        except Exception as e:
+            print(f"Error in streaming clustering: {str(e)}")
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    response = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    if tmp_path:
+        # runs even if the client goes away before the body is iterated
+        response.call_on_close(lambda: os.remove(tmp_path))
+    return response
 
 @app.route("/predict_daily_emission", methods=["POST"])
 def predict_daily_emission():
     payload = request.json
     # payload: { category: "Transport" | "Electricity" | ..., details: {...} }
+    result = cache.get("daily_emission", model2.MODEL_VERSION, payload) if CACHE_ENABLED else None
+    if result is not None:
+        return cached_response(result, hit=True)
+
     result = model2.compute_daily_emission(payload)
-    return jsonify(result)
+    if CACHE_ENABLED:
+        cache.set("daily_emission", model2.MODEL_VERSION, payload, result)
+    return cached_response(result, hit=False)
+
+def cached_response(result, hit):
+    response = jsonify(result)
+    if CACHE_ENABLED:
+        response.headers["X-Cache"] = "HIT" if hit else "MISS"
+    return response
+
+@app.route("/predict_daily_emission/batch", methods=["POST"])
+def predict_daily_emission_batch():
+    """
+    Compute daily emissions for many activities in one request.
+
+    Accepts a JSON array of activity payloads, {"activities": [...]}, or
+    newline-delimited JSON (Content-Type: application/x-ndjson).
+    """
+    try:
+        if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+            lines = request.get_data(as_text=True).splitlines()
+            activities = [json.loads(line) for line in lines if line.strip()]
+        else:
+            data = request.json
+            activities = data.get("activities") if isinstance(data, dict) else data
+
+        if not isinstance(activities, list) or not activities:
+            return jsonify({"error": "No activities provided"}), 400
+
+        results = model2.compute_daily_emissions_batch(activities)
+
+        return jsonify({
+            "results": results,
+            "count": len(results),
+            "errors": sum(1 for r in results if "error" in r)
+        })
+
+    except json.JSONDecodeError as e:
+        return jsonify({"error": f"Invalid NDJSON: {str(e)}"}), 400
+    except Exception as e:
+        print(f"Error in batch daily emission: {str(e)}")
+        return jsonify({"error": str(e)}), 500
 
 @app.route("/model3/cluster", methods=["POST"])
 def cluster_model3():
     try:
-        data = request.json
-        profiles = data.get("profiles", [])
+        try:
+            body = read_columnar()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if body is not None:
+            profiles, data = body
+        else:
+            with span("app.parse_json"):
+                data = request.json
+            profiles = data.get("profiles", [])
         
-        if not profiles:
+        if not len(profiles):
             return jsonify({"error": "No profiles provided"}), 400
+        try:
+            k = k_selection.parse_k(data.get("k"), None)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        clustered_profiles, labels = model3.run_cluster(profiles)
+        response_format = columnar.response_format(request)
+        clustered_profiles, labels = model3.run_cluster(profiles, k, columnar=response_format is not None)
+        if response_format:
+            return columnar.response(response_format, clustered_profiles, {"labels": labels})
         
-        return jsonify({
-            "profiles": clustered_profiles,
-            "labels": labels
-        })
+        with span("app.jsonify"):
+            return jsonify({
+                "profiles": clustered_profiles,
+                "labels": labels
+            })
     
     except Exception as e:
         print(f"Error in clustering: {str(e)}")
@@ -55,38 +235,447 @@ def cluster_model3():
 
 @app.route("/model3/recommend", methods=["POST"])
 def recommend_model3():
+    """
+    Recommend for a single user using the stored cluster model.
+
+    Send either the user's own profile ("profile"), or the legacy full
+    "profiles" list. A single profile is assigned to its nearest stored
+    centroid. A profiles list is assigned in one pass and the user found
+    through the id index. Either way the model must have been fitted first
+    (409 otherwise; see /model3/refit).
+    """
     try:
-        data = request.json
+        with span("app.parse_json"):
+            data = request.json
         userId = data.get("userId")
+        profile = data.get("profile")
         profiles = data.get("profiles", [])
-        
-        if not profiles:
+
+        if not profile and not profiles and userId is not None:
+            # the aggregated profile from recorded activity events
+            try:
+                profile = profile_store.store.profile(userId, data.get("month"))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            if profile is None:
+                return jsonify({"error": "No recorded activity for this user"}), 404
+
+        if not profile and not profiles:
             return jsonify({"error": "No profiles provided"}), 400
 
-        clustered_profiles, _ = model3.run_cluster(profiles)
-        
-        # Find user in results
-        user_row = None
-        for profile in clustered_profiles:
-            if str(profile.get('_id')) == str(userId) or str(profile.get('userId')) == str(userId):
-                user_row = profile
-                break
-        
-        if not user_row:
-            return jsonify({"error": "User not found in clustering results"}), 404
+        if not profile:
+            # One pass over the provided profiles: assign them all, then look
+            # the user up through the id index
+            try:
+                result = model3.assign_cluster_labels(profiles)
+            except LookupError as e:
+                return jsonify({"error": str(e)}), 409
+            row = result.index.get(str(userId))
+            if row is None:
+                return jsonify({"error": "User not found in clustering results"}), 404
+
+            cluster_name = result.label_names[row]
+            return jsonify({
+                "userId": userId,
+                "cluster": cluster_name,
+                "recommendations": model3.get_recommendations(cluster_name),
+                "model_version": result.version
+            })
+
+        if model3.get_cluster_model() is None:
+            return jsonify({"error": "Cluster model has not been fitted yet"}), 409
 
+        user_row = model3.assign_clusters([profile]).iloc[0]
         recommendations = model3.get_recommendations(user_row["cluster_label_name"])
 
         return jsonify({
             "userId": userId,
             "cluster": user_row["cluster_label_name"],
-            "recommendations": recommendations
+            "recommendations": recommendations,
+            "model_version": model3.get_cluster_model()["version"]
         })
     
     except Exception as e:
         print(f"Error in recommendation: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/model3/recommend/batch", methods=["POST"])
+def recommend_model3_batch():
+    """
+    Recommend for many users from one clustering pass.
+
+    Body: {"userIds": [...], "profiles": [...]}. Every profile is assigned
+    to the stored cluster model (409 if none has been fitted yet) and each
+    requested user is looked up by _id or userId.
+    Unknown users get an "error" entry instead of failing the whole batch.
+    """
+    try:
+        with span("app.parse_json"):
+            data = request.json
+        user_ids = data.get("userIds") or []
+        profiles = data.get("profiles", [])
+
+        if not profiles:
+            return jsonify({"error": "No profiles provided"}), 400
+        if not isinstance(user_ids, list) or not user_ids:
+            return jsonify({"error": "Expected a non-empty 'userIds' list"}), 400
+
+        try:
+            result = model3.assign_cluster_labels(profiles)
+        except LookupError as e:
+            return jsonify({"error": str(e)}), 409
+
+        with span("app.user_lookup"):
+            recommendations = {}
+            results = []
+            for user_id in user_ids:
+                row = result.index.get(str(user_id))
+                if row is None:
+                    results.append({"userId": user_id, "error": "User not found in clustering results"})
+                    continue
+                cluster_name = result.label_names[row]
+                if cluster_name not in recommendations:
+                    recommendations[cluster_name] = model3.get_recommendations(cluster_name)
+                results.append({
+                    "userId": user_id,
+                    "cluster": cluster_name,
+                    "recommendations": recommendations[cluster_name]
+                })
+
+        with span("app.jsonify"):
+            return jsonify({
+                "results": results,
+                "model_version": result.version
+            })
+
+    except Exception as e:
+        print(f"Error in batch recommendation: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/model3/refit", methods=["POST"])
+def refit_model3():
+    """
+    Refit the stored cluster model from the full profile set ("k": n or "auto" optional).
+
+    With "snapshot": name the model is fitted from that profile snapshot.
+    Without "profiles", the month's aggregated profiles from the profile
+    store are used ("month": "YYYY-MM", default current).
+    """
+    try:
+        data = request.json
+        try:
+            k = k_selection.parse_k(data.get("k"), None)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if data.get("snapshot"):
+            try:
+                model3.fit_cluster_model_from_snapshot(data["snapshot"], k)
+            except LookupError as e:
+                return jsonify({"error": str(e)}), 404
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 409
+            return jsonify(model3.cluster_model_info())
+
+        profiles = data.get("profiles", [])
+        if not profiles:
+            try:
+                profiles = profile_store.store.profile_frame(data.get("month"))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+        if len(profiles) == 0:
+            return jsonify({"error": "No profiles provided"}), 400
+
+        model3.fit_cluster_model(profiles, k)
+        return jsonify(model3.cluster_model_info())
+
+    except Exception as e:
+        print(f"Error refitting cluster model: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/model3/partial_fit", methods=["POST"])
+def partial_fit_model3():
+    """Incrementally update the stored cluster model with new profiles"""
+    try:
+        data = request.json
+        profiles = data.get("profiles", [])
+        if data.get("profile"):
+            profiles = profiles + [data["profile"]]
+
+        if not profiles:
+            return jsonify({"error": "No profiles provided"}), 400
+
+        model3.partial_fit_cluster_model(profiles)
+        return jsonify(model3.cluster_model_info())
+
+    except Exception as e:
+        print(f"Error updating cluster model: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/model3/model", methods=["GET"])
+def model3_info():
+    """Describe the stored cluster model"""
+    info = model3.cluster_model_info()
+    if info is None:
+        return jsonify({"error": "Cluster model has not been fitted yet"}), 404
+    return jsonify(info)
+
+@app.route("/snapshots", methods=["GET"])
+def list_snapshots():
+    return jsonify({"snapshots": snapshots.list_snapshots()})
+
+@app.route("/snapshots/<name>", methods=["POST"])
+def create_snapshot(name):
+    """
+    Store a named columnar profile snapshot (ids + feature columns).
+
+    The body is a CSV file (Content-Type: text/csv), {"profiles": [...]},
+    or {"month": "YYYY-MM"} to snapshot the profile store's aggregates.
+    """
+    try:
+        if request.mimetype == "text/csv":
+            with tempfile.NamedTemporaryFile("wb", suffix=".csv", delete=False) as tmp:
+                shutil.copyfileobj(request.stream, tmp)
+            try:
+                meta = snapshots.create_snapshot_from_csv(name, tmp.name)
+            finally:
+                os.remove(tmp.name)
+            return jsonify(meta), 201
+
+        data = request.get_json(silent=True) or {}
+        if data.get("profiles"):
+            profiles = data["profiles"]
+        else:
+            profiles = profile_store.store.profile_frame(data.get("month"))
+        if len(profiles) == 0:
+            return jsonify({"error": "No profiles provided"}), 400
+        return jsonify(snapshots.create_snapshot(name, profiles)), 201
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error creating snapshot: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/snapshots/<name>", methods=["GET"])
+def snapshot_info(name):
+    try:
+        info = snapshots.snapshot_info(name)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if info is None:
+        return jsonify({"error": "Unknown snapshot"}), 404
+    return jsonify(info)
+
+@app.route("/snapshots/<name>", methods=["DELETE"])
+def delete_snapshot(name):
+    try:
+        deleted = snapshots.delete_snapshot(name)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not deleted:
+        return jsonify({"error": "Unknown snapshot"}), 404
+    return jsonify({"success": True})
+
+@app.route("/snapshots/<name>/cluster", methods=["POST"])
+def cluster_snapshot(name):
+    """
+    Cluster a stored snapshot with model1 instead of POSTing the dataset.
+
+    Body (optional): {"k": 2 | "auto", "store_labels": true}. Returns the
+    cluster summary; per-row labels are written back into the snapshot as
+    a "cluster_label" column.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        k = k_selection.parse_k(data.get("k"), 2)
+        result = model1.cluster_snapshot(name, k, store_labels=data.get("store_labels", True))
+        with span("app.jsonify"):
+            return jsonify(result)
+
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error clustering snapshot: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/profiles/events", methods=["POST"])
+def record_activity_events():
+    """
+    Feed activity events into the per-user, per-month profile aggregates.
+
+    Accepts one event, a JSON array, {"events": [...]}, or NDJSON. An event
+    is a /predict_daily_emission payload plus "userId" and optionally
+    "createdAt" and "co2_kg".
+    """
+    try:
+        if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+            lines = request.get_data(as_text=True).splitlines()
+            events = [json.loads(line) for line in lines if line.strip()]
+        else:
+            data = request.json
+            if isinstance(data, dict):
+                events = data.get("events", [data])
+            else:
+                events = data
+
+        if not isinstance(events, list) or not events:
+            return jsonify({"error": "No events provided"}), 400
+
+        errors = profile_store.store.record(events)
+        return jsonify({
+            "recorded": len(events) - len(errors),
+            "errors": errors
+        })
+
+    except json.JSONDecodeError as e:
+        return jsonify({"error": f"Invalid NDJSON: {str(e)}"}), 400
+    except Exception as e:
+        print(f"Error recording activity events: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/profiles/<user_id>", methods=["GET"])
+def get_profile(user_id):
+    """A user's aggregated profile for ?month=YYYY-MM (default current)"""
+    try:
+        profile = profile_store.store.profile(user_id, request.args.get("month"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if profile is None:
+        return jsonify({"error": "No recorded activity for this user"}), 404
+    return jsonify(profile)
+
+@app.route("/profiles/<user_id>/predict", methods=["GET"])
+def predict_from_profile(user_id):
+    """Next month's RF prediction from the user's aggregated profile for ?month="""
+    try:
+        profile = profile_store.store.profile(user_id, request.args.get("month"))
+        if profile is None:
+            return jsonify({"error": "No recorded activity for this user"}), 404
+
+        result = predictonmodel.predict_carbon_emission(profile)
+        result["profile"] = profile
+        return jsonify(result)
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error predicting from profile: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/profiles", methods=["GET"])
+def profile_store_stats():
+    return jsonify(profile_store.store.stats())
+
+@app.route("/forecast/daily", methods=["POST"])
+def forecast_daily():
+    """
+    Daily emission forecasts for every user in the activity history
+    
+    Expected JSON payload:
+    {
+        "events": [ {"userId": "...", "createdAt": "2025-01-31T10:00:00Z", "co2_kg": 4.2}, ... ],
+        "horizon": 7,
+        "as_of": "2025-01-31"
+    }
+    
+    Binary columnar bodies (userId, createdAt or date, co2_kg columns;
+    horizon / as_of in the meta) are accepted too, and with a columnar
+    Accept type the forecast comes back as userId, date, forecast_kg columns.
+    For the whole user base, submit a "forecast_daily" job instead.
+    """
+    try:
+        body = read_columnar()
+        if body is not None:
+            columns, data = body
+            dates = columns.get("createdAt", columns.get("date"))
+            if "userId" not in columns or "co2_kg" not in columns or dates is None:
+                return jsonify({"error": "Columns userId, createdAt (or date) and co2_kg are required"}), 400
+            user_ids, emissions = columns["userId"], columns["co2_kg"]
+        else:
+            data = request.json
+            events = data.get("events") if isinstance(data, dict) else None
+            if not isinstance(events, list) or not events:
+                return jsonify({"error": "No events provided"}), 400
+            events = [e for e in events if isinstance(e, dict)]
+            user_ids = [e.get("userId") for e in events]
+            dates = [e.get("createdAt", e.get("date")) for e in events]
+            emissions = [e.get("co2_kg") for e in events]
+        
+        result = forecasting.forecast_daily(user_ids, dates, emissions, data.get("horizon", 7), data.get("as_of"))
+        
+        response_format = columnar.response_format(request)
+        if response_format:
+            return columnar.response(response_format, forecasting.forecast_columns(result), {"as_of": str(result.as_of)})
+        with span("app.jsonify"):
+            return jsonify({
+                "as_of": str(result.as_of),
+                "dates": result.dates.astype(str).tolist(),
+                "users": forecasting.forecast_records(result)
+            })
+    
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error forecasting daily emissions: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/rankings", methods=["GET"])
+def ranking_stats():
+    """Built ranking indexes; with ?emission=<kg> the rank that total would have"""
+    try:
+        if request.args.get("emission") is not None:
+            return jsonify(ranking.rankings.position(float(request.args["emission"]), request.args.get("period")))
+        return jsonify(ranking.rankings.stats())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route("/rankings/top", methods=["GET"])
+def ranking_top():
+    """
+    Leaderboard by emission for ?period=YYYY-MM (default current month) or "all"
+    
+    ?n=10 entries, ?order=lowest (default, greenest first) or highest.
+    """
+    try:
+        order = request.args.get("order", "lowest")
+        if order not in ("lowest", "highest"):
+            return jsonify({"error": "order must be 'lowest' or 'highest'"}), 400
+        n = min(int(request.args.get("n", 10)), 1000)
+        return jsonify(ranking.rankings.top(n, request.args.get("period"), order == "highest"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route("/rankings/<user_id>", methods=["GET"])
+def user_ranking(user_id):
+    """A user's emission rank and percentile for ?period=YYYY-MM (default current month) or all"""
+    try:
+        result = ranking.rankings.user_rank(user_id, request.args.get("period"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if result is None:
+        return jsonify({"error": "No recorded activity for this user"}), 404
+    return jsonify(result)
+
+@app.route("/rankings/<user_id>/cluster", methods=["GET"])
+def user_cluster_ranking(user_id):
+    """A user's emission rank among the users of their model3 cluster for ?month="""
+    try:
+        result = ranking.rankings.cluster_rank(user_id, request.args.get("month"))
+        if result is None:
+            return jsonify({"error": "No recorded activity for this user"}), 404
+        return jsonify(result)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error ranking user within cluster: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 # NEW ENDPOINT: Random Forest Carbon Prediction
 @app.route("/predict_carbon_emission", methods=["POST"])
 def predict_carbon_emission():
@@ -102,6 +691,10 @@ def predict_carbon_emission():
         "avg_items_purchased": 6,
         "last_month_emission": 200
     }
+    
+    "feature_contributions" splits the prediction per feature for this
+    user: contribution_bias_kgCO2 plus the contributions is the prediction
+    (left out when RF_ENGINE=sklearn).
     """
     try:
         data = request.json
@@ -122,10 +715,22 @@ def predict_carbon_emission():
                 "error": f"Missing required fields: {', '.join(missing_fields)}"
             }), 400
         
+        # Identical inputs under the same model version give identical results
+        key = [float(data[field]) for field in required_fields]
+        version = predictonmodel.get_current().version
+        result = cache.get("carbon_emission", version, key) if CACHE_ENABLED else None
+        if result is not None:
+            return cached_response(result, hit=True)
+        
         # Call prediction model
-        result = predictonmodel.predict_carbon_emission(data)
+        if MICROBATCH_ENABLED:
+            result = rf_batcher.submit(data)
+        else:
+            result = predictonmodel.predict_carbon_emission(data)
+        if CACHE_ENABLED:
+            cache.set("carbon_emission", result["model_version"], key, result)
         
-        return jsonify(result)
+        return cached_response(result, hit=False)
     
     except ValueError as e:
         return jsonify({"error": f"Invalid input: {str(e)}"}), 400
@@ -133,23 +738,205 @@ def predict_carbon_emission():
         print(f"Error in carbon prediction: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/predict_carbon_emission/batch", methods=["POST"])
+def predict_carbon_emission_batch():
+    """
+    Predict next month's carbon emission for many users in one call
+    
+    Expected JSON payload:
+    {
+        "profiles": [ { ...same fields as /predict_carbon_emission... }, ... ]
+    }
+    
+    Results are returned in input order; invalid rows carry an "error".
+    With "contributions": true each result also has per-user
+    "feature_contributions": the kg each feature adds to (or takes from)
+    "contribution_bias_kgCO2" in this prediction.
+    
+    Also accepts and returns binary columns (Content-Type / Accept
+    application/x-npz or application/vnd.apache.arrow.stream): one column
+    per feature in, predicted_emission_kgCO2, breakdown_<category>,
+    comparison_to_last_month and valid out, without recommendations.
+    Contribution columns are added with "contributions": true (in the
+    request meta, or next to "profiles").
+    """
+    try:
+        response_format = columnar.response_format(request)
+        body = read_columnar()
+        if body is not None:
+            columns, options = body[0], body[1] if isinstance(body[1], dict) else {}
+        else:
+            data = request.json
+            profiles = data.get("profiles") if isinstance(data, dict) else data
+            
+            if not isinstance(profiles, list) or not profiles:
+                return jsonify({"error": "No profiles provided"}), 400
+            if response_format:
+                # ids ride along so the columnar rows can be matched back to users
+                columns = columnar.records_to_columns(
+                    profiles, predictonmodel.FEATURES, text_names=("_id", "userId"))
+                options = data if isinstance(data, dict) else {}
+        
+        if response_format or body is not None:
+            results, meta = predictonmodel.predict_carbon_emission_columns(
+                columns, contributions=bool(options.get("contributions")))
+            if response_format:
+                return columnar.response(response_format, results, meta)
+            # columnar request, JSON response
+            return jsonify({
+                "columns": columnar.columns_to_json(results),
+                **meta
+            })
+        
+        results = predictonmodel.predict_carbon_emission_batch(
+            profiles, contributions=isinstance(data, dict) and bool(data.get("contributions")))
+        
+        return jsonify({
+            "results": results,
+            "count": len(results),
+            "errors": sum(1 for r in results if "error" in r)
+        })
+    
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error in batch carbon prediction: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/predict_carbon_emission/batcher", methods=["GET"])
+def carbon_emission_batcher_stats():
+    """Batch counts and sizes of the /predict_carbon_emission micro-batcher"""
+    return jsonify(dict(rf_batcher.stats(), enabled=MICROBATCH_ENABLED))
+
+@app.route("/predict_carbon_emission/scenarios", methods=["POST"])
+def predict_carbon_emission_scenarios():
+    """
+    Rank what-if reductions of one profile by predicted savings
+    
+    Expected JSON payload:
+    {
+        "profile": { ...same fields as /predict_carbon_emission... },
+        "levers": {
+            "avg_daily_travel_km": [0, 10, 20, 30],
+            "avg_nonveg_meals": {"absolute": [0, 2, 4]}
+        },
+        "top": 10
+    }
+    
+    Plain lists are percent reductions. Every combination is one scenario.
+    """
+    try:
+        data = request.json
+        if not isinstance(data, dict) or not isinstance(data.get("profile"), dict):
+            return jsonify({"error": "No profile provided"}), 400
+        
+        result = predictonmodel.simulate_scenarios(data["profile"], data.get("levers"), int(data.get("top", 10)))
+        return jsonify(result)
+    
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error in scenario simulation: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 # Optional: Retrain model endpoint (for admin use)
 @app.route("/retrain_model", methods=["POST"])
 def retrain():
     """
-    Retrain the Random Forest model
+    Retrain the Random Forest model in the background
     (Use this when you want to update the model with new patterns)
+    
+    Optional JSON payload:
+    {
+        "history": ["exports/history-2025.csv", "profile_store"],
+        "n_jobs": 4
+    }
+    
+    With "history" (or RF_TRAINING_HISTORY set) the forest is trained
+    out-of-core on those files; otherwise on synthetic data. n_jobs is
+    capped at TRAINING_N_JOBS.
+    Returns 202 with a job id; poll /jobs/<job_id> for progress.
     """
+    return submit_job("retrain_rf", request.get_json(silent=True) or {})
+
+def submit_job(job_type, params):
     try:
-        predictonmodel.retrain_model()
+        job = jobs.submit(job_type, params)
         return jsonify({
             "success": True,
-            "message": "Model retrained successfully"
-        })
+            "job_id": job["id"],
+            "status": job["status"],
+            "status_url": f"/jobs/{job['id']}"
+        }), 202
+    except jobs.JobQueueFull as e:
+        return jsonify({"error": str(e)}), 429
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"Error retraining model: {str()}")
+        print(f"Error submitting {job_type} job: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    """
+    Submit a background job
+    
+    Expected JSON payload:
+    {
+        "type": "retrain_rf" | "refit_model1" | "refit_model3" | "forecast_daily",
+        "params": { "profiles": [...], "k": 3 | "auto" }
+    }
+    """
+    data = request.get_json(silent=True) or {}
+    return submit_job(data.get("type"), data.get("params") or {})
+
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    return jsonify({
+        "jobs": jobs.list_jobs(),
+        "active": jobs.active_jobs(),
+        "max_concurrent": jobs.MAX_TRAINING_JOBS,
+        "max_queued": jobs.MAX_QUEUED_JOBS
+    })
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """Hit/miss counters and size of the prediction cache"""
+    return jsonify(cache.stats())
+
+@app.route("/cache", methods=["DELETE"])
+def clear_cache():
+    """Drop cached predictions (optionally ?namespace=daily_emission|carbon_emission)"""
+    cache.clear(request.args.get("namespace"))
+    return jsonify({"success": True})
+
+@app.route("/model/versions", methods=["GET"])
+def model_versions():
+    """List published Random Forest versions and the one in use"""
+    registry = predictonmodel.registry
+    return jsonify({
+        "current": registry.current_version(),
+        "loaded": predictonmodel.handle.version,
+        "versions": [registry.metadata(v) for v in registry.versions()]
+    })
+
+@app.route("/model/activate", methods=["POST"])
+def activate_model_version():
+    """Point every worker at an existing version (e.g. to roll back)"""
+    try:
+        version = int(request.json.get("version"))
+        predictonmodel.registry.activate(version)
+        return jsonify({"success": True, "current": version})
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid version: {str(e)}"}), 400
+
 if __name__ == "__main__":
     print("\n=== Registered Routes ===")
     for rule in app.url_map.iter_rules():
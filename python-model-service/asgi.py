@@ -0,0 +1,397 @@
+"""
+ASGI serving mode for the model service.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+    # or, with preloaded shared models:
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:application
+
+Endpoints are still the Flask views in app.py; this module decides where
+each request runs. Cheap endpoints (health, metrics, daily emission, cache
+and job status...) run directly on the event loop. CPU-heavy ones run in a
+bounded thread pool per lane (clustering, RF prediction, everything else),
+so a slow KMeans fit never holds up a daily-emission call. Each lane has a
+concurrency limit, a bounded wait queue (429 + Retry-After when full) and a
+request timeout (504; the worker thread finishes its work in the background).
+A request keeps one worker thread and its lane slot until the whole body,
+streamed responses included, has been produced. Request bodies larger
+than ASGI_SPOOL_BODY_BYTES are spooled to a temporary file rather than
+held in memory.
+Long training runs go through the jobs process pool as before.
+"""
+import asyncio
+import concurrent.futures
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
+from app import app as flask_app
+
+# endpoint -> lane; endpoints not listed use the "default" lane
+INLINE = 'inline'
+ENDPOINT_LANES = {
+    'health': INLINE,
+    'ready': INLINE,
+    'metrics': INLINE,
+    'predict_daily_emission': INLINE,
+    'cache_stats': INLINE,
+    'clear_cache': INLINE,
+    'list_jobs': INLINE,
+    'job_status': INLINE,
+    'get_profile': INLINE,
+    'profile_store_stats': INLINE,
+    'carbon_emission_batcher_stats': INLINE,
+
+    # ranking reads may (re)build the index from the profile store
+    'ranking_stats': 'default',
+    'ranking_top': 'default',
+    'user_ranking': 'default',
+
+    'cluster': 'cluster',
+    'cluster_stream': 'cluster',
+    'cluster_model3': 'cluster',
+    'recommend_model3': 'cluster',
+    'recommend_model3_batch': 'cluster',
+    'refit_model3': 'cluster',
+    'partial_fit_model3': 'cluster',
+    'create_snapshot': 'cluster',
+    'cluster_snapshot': 'cluster',
+    'user_cluster_ranking': 'cluster',
+
+    'predict_carbon_emission': 'predict',
+    'predict_carbon_emission_batch': 'predict',
+    'predict_carbon_emission_scenarios': 'predict',
+    'predict_daily_emission_batch': 'predict',
+    'predict_from_profile': 'predict',
+    'forecast_daily': 'predict'
+}
+
+
+def _lane_setting(lane, key, default):
+    return float(os.environ.get(f'ASGI_{lane.upper()}_{key}', default))
+
+
+# lane -> (concurrent requests, requests allowed to wait, timeout seconds)
+LANES = {
+    lane: (
+        int(_lane_setting(lane, 'CONCURRENCY', concurrency)),
+        int(_lane_setting(lane, 'QUEUE', queue)),
+        _lane_setting(lane, 'TIMEOUT', timeout)
+    )
+    for lane, (concurrency, queue, timeout) in {
+        'cluster': (2, 8, 120),
+        'predict': (4, 64, 10),
+        'default': (4, 32, 30)
+    }.items()
+}
+
+# Largest request body accepted (bytes)
+MAX_BODY_BYTES = int(os.environ.get('ASGI_MAX_BODY_BYTES', str(256 * 1024 * 1024)))
+
+# Request bodies above this size are spooled to a temporary file (bytes)
+SPOOL_BODY_BYTES = int(os.environ.get('ASGI_SPOOL_BODY_BYTES', str(1024 * 1024)))
+
+# Response chunks a worker may produce ahead of the client before it waits
+STREAM_BUFFER_CHUNKS = 8
+
+
+class Lane:
+    """A bounded thread pool with an admission limit"""
+
+    def __init__(self, name, concurrency, queue, timeout):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'asgi-{name}')
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def try_admit(self):
+        """Reserve a slot (running or waiting); False when the lane is full"""
+        if self.admitted >= self.concurrency + self.queue:
+            self.rejected += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.admitted -= 1
+
+    def stats(self):
+        return {
+            'concurrency': self.concurrency,
+            'queue': self.queue,
+            'timeout_seconds': self.timeout,
+            'in_flight': min(self.admitted, self.concurrency),
+            'waiting': max(0, self.admitted - self.concurrency),
+            'rejected': self.rejected,
+            'timed_out': self.timed_out
+        }
+
+
+_lanes = {name: Lane(name, *settings) for name, settings in LANES.items()}
+_url_adapter = flask_app.url_map.bind('localhost')
+
+
+def route(method, path):
+    """(Flask endpoint, lane) for a request"""
+    try:
+        endpoint, _ = _url_adapter.match(path, method=method)
+    except Exception:
+        # 404 / 405 / redirects: let Flask answer on the loop
+        return None, INLINE
+    return endpoint, ENDPOINT_LANES.get(endpoint, 'default')
+
+
+def lane_stats():
+    return {name: lane.stats() for name, lane in _lanes.items()}
+
+
+# ---------------------------------------------------------------------------
+# WSGI bridge
+# ---------------------------------------------------------------------------
+
+def _environ(scope, body, size):
+    headers = [(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope['headers']]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(size),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in headers:
+        key = name.upper().replace('-', '_')
+        if key == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif key != 'CONTENT_LENGTH':
+            key = f'HTTP_{key}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def _call_flask(environ):
+    """Run the Flask app up to the first body chunk; returns (status, headers, first chunk, iterator)"""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    result = flask_app(environ, start_response)
+    iterator = iter(result)
+    first = next(iterator, b'')
+    return started['status'], started['headers'], first, (iterator, result)
+
+
+def _next_chunk(body):
+    iterator, result = body
+    chunk = next(iterator, None)
+    if chunk is None and hasattr(result, 'close'):
+        result.close()
+    return chunk
+
+
+class _Abandoned(Exception):
+    """The response is no longer wanted (timeout, disconnect or send error)"""
+
+
+def _serve_in_worker(environ, loop, queue, abandoned):
+    """
+    Run a request to completion on this worker thread.
+
+    Puts (status, headers, first chunk), then every further chunk, then
+    None on the loop's queue; an exception instead if the app fails. The
+    Flask request context of a streamed response is pushed and popped on
+    this thread, and the caller's lane slot is held until this returns.
+    """
+    def emit(item):
+        if abandoned.is_set():
+            raise _Abandoned()
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except concurrent.futures.TimeoutError:
+                if abandoned.is_set():
+                    future.cancel()
+                    raise _Abandoned()
+
+    result = None
+    try:
+        status, headers, first, (iterator, result) = _call_flask(environ)
+        emit((status, headers, first))
+        chunk = first
+        while chunk is not None:
+            if abandoned.is_set():
+                raise _Abandoned()
+            chunk = next(iterator, None)
+            emit(chunk)
+    except _Abandoned:
+        pass
+    except Exception as e:
+        if not abandoned.is_set():
+            try:
+                emit(e)
+            except _Abandoned:
+                pass
+    finally:
+        if result is not None and hasattr(result, 'close'):
+            result.close()
+
+
+async def _send_json(send, status, payload, extra_headers=()):
+    body = json.dumps(payload).encode('utf-8')
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    headers.extend(extra_headers)
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _read_body(receive):
+    """(file, size) of the request body, kept in memory up to SPOOL_BODY_BYTES; None on disconnect"""
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_BODY_BYTES)
+    size = 0
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > MAX_BODY_BYTES:
+                raise ValueError('Request body too large')
+            body.write(chunk)
+            if not message.get('more_body'):
+                body.seek(0)
+                return body, size
+    except BaseException:
+        body.close()
+        raise
+
+
+# ---------------------------------------------------------------------------
+# ASGI application
+# ---------------------------------------------------------------------------
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            for lane in _lanes.values():
+                lane.executor.shutdown(wait=False, cancel_futures=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    if scope['path'] == '/asgi/lanes':
+        return await _send_json(send, 200, lane_stats())
+
+    try:
+        received = await _read_body(receive)
+    except ValueError as e:
+        return await _send_json(send, 413, {'error': str(e)})
+    if received is None:
+        return
+    body, size = received
+    environ = _environ(scope, body, size)
+    endpoint, lane_name = route(scope['method'], scope['path'])
+
+    if lane_name == INLINE:
+        try:
+            status, headers, first, rest = _call_flask(environ)
+            return await _respond(send, status, headers, first, rest)
+        finally:
+            body.close()
+
+    lane = _lanes[lane_name]
+    labels = {'endpoint': endpoint, 'method': scope['method']}
+    if not lane.try_admit():
+        body.close()
+        instrumentation.observe('http_request_duration_seconds', dict(labels, status='429'), 0.0)
+        return await _send_json(
+            send, 429, {'error': f'Too many {lane_name} requests in progress; retry shortly'},
+            [(b'retry-after', b'1')]
+        )
+
+    def finished(_):
+        body.close()
+        lane.release()
+
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    queue = asyncio.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+    abandoned = threading.Event()
+    future = loop.run_in_executor(lane.executor, _serve_in_worker, environ, loop, queue, abandoned)
+    # the slot (and the spooled body) is held until the work itself
+    # finishes, even after a timeout
+    future.add_done_callback(finished)
+    try:
+        try:
+            item = await asyncio.wait_for(queue.get(), lane.timeout)
+        except asyncio.TimeoutError:
+            lane.timed_out += 1
+            instrumentation.observe('http_request_duration_seconds', dict(labels, status='504'), time.perf_counter() - start)
+            return await _send_json(send, 504, {'error': f'Request timed out after {lane.timeout:g}s'})
+        if isinstance(item, Exception):
+            raise item
+        status, headers, first = item
+        await _start(send, status, headers)
+        chunk = first
+        while chunk is not None:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await queue.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        # stops a worker whose response is no longer being sent
+        abandoned.set()
+
+
+async def _start(send, status, headers):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+    })
+
+
+async def _respond(send, status, headers, first, rest):
+    """Send a response produced on the loop (inline endpoints)"""
+    await _start(send, status, headers)
+    chunk = first
+    while chunk is not None:
+        if chunk:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        chunk = _next_chunk(rest)
+    await send({'type': 'http.response.body', 'body': b''})
@@ -0,0 +1,146 @@
+"""
+Compiled forest vs sklearn: equivalence check and latency benchmark.
+
+Also times predict_contributions() (per-row feature contributions from the
+same walk) against the engine predict_matrix would use for that many rows
+(compiled up to COMPILED_MAX_ROWS, sklearn above) and checks that
+bias + contributions adds up to the prediction.
+
+Run from python-model-service/:
+
+    python -m benchmarks.bench_forest [--repeats 200] [--json results.json]
+
+Exits non-zero if the compiled forest disagrees with the sklearn path.
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+import predictonmodel
+from fast_forest import compile_forest
+
+BATCH_SIZES = [1, 16, 256, 2048, 16384]
+
+
+def sample_rows(n, seed=0):
+    """Rows drawn from (and a little beyond) the training data ranges"""
+    df = predictonmodel.create_sample_training_data()
+    X = df[predictonmodel.FEATURES].to_numpy()
+    rng = np.random.default_rng(seed)
+    lo, hi = X.min(axis=0), X.max(axis=0)
+    span = hi - lo
+    return rng.uniform(lo - 0.1 * span, hi + 0.1 * span, size=(n, X.shape[1]))
+
+
+def threshold_rows(forest, n, seed=0):
+    """Rows with one feature set exactly on (and one float past) a split threshold"""
+    rng = np.random.default_rng(seed)
+    base = sample_rows(n, seed)
+    split_nodes = np.flatnonzero(forest.children[0::2] != np.arange(forest.n_nodes))
+    nodes = rng.choice(split_nodes, n)
+    rows = np.arange(n)
+    on = base.copy()
+    on[rows, forest.feature[nodes]] = forest.threshold[nodes]
+    past = base.copy()
+    past[rows, forest.feature[nodes]] = np.nextafter(forest.threshold[nodes], np.inf)
+    return np.vstack([on, past])
+
+
+def check_equivalence(model, scaler, forest):
+    X = np.vstack([sample_rows(20000, seed=1), threshold_rows(forest, 5000, seed=2)])
+    expected = model.predict(scaler.transform(X))
+    actual = forest.predict(X)
+    max_diff = float(np.abs(expected - actual).max())
+    return {'rows': len(X), 'max_abs_diff': max_diff, 'equivalent': max_diff < 1e-9}
+
+
+def check_contributions(forest):
+    X = sample_rows(20000, seed=3)
+    predictions, contributions = forest.predict_contributions(X)
+    prediction_diff = float(np.abs(predictions - forest.predict(X)).max())
+    sum_diff = float(np.abs(forest.bias + contributions.sum(axis=1) - predictions).max())
+    return {
+        'rows': len(X),
+        'max_prediction_diff': prediction_diff,
+        'max_sum_diff': sum_diff,
+        'consistent': prediction_diff < 1e-9 and sum_diff < 1e-9
+    }
+
+
+def time_call(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def benchmark(model, scaler, forest, repeats):
+    results = []
+    for size in BATCH_SIZES:
+        X = sample_rows(size, seed=size)
+        n = max(3, repeats // max(1, size // 16))
+        sklearn_s = time_call(lambda: model.predict(scaler.transform(X)), n)
+        compiled_s = time_call(lambda: forest.predict(X), n)
+        contributions_s = time_call(lambda: forest.predict_contributions(X), n)
+        served = 'compiled' if size <= predictonmodel.COMPILED_MAX_ROWS else 'sklearn'
+        served_s = compiled_s if served == 'compiled' else sklearn_s
+        results.append({
+            'rows': size,
+            'sklearn_ms': round(sklearn_s * 1e3, 4),
+            'compiled_ms': round(compiled_s * 1e3, 4),
+            'speedup': round(sklearn_s / compiled_s, 2),
+            'served_by': served,
+            'contributions_ms': round(contributions_s * 1e3, 4),
+            'contributions_overhead': round(contributions_s / served_s, 2)
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeats', type=int, default=200)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args(argv)
+
+    current = predictonmodel.get_current()
+    model, scaler = current.artifacts['model'], current.artifacts['scaler']
+
+    start = time.perf_counter()
+    forest = compile_forest(model, scaler)
+    compile_ms = (time.perf_counter() - start) * 1e3
+
+    equivalence = check_equivalence(model, scaler, forest)
+    contributions = check_contributions(forest)
+    latency = benchmark(model, scaler, forest, args.repeats)
+
+    print(f"model version {current.version}: {forest.n_trees} trees, "
+          f"{forest.n_nodes} nodes, depth {forest.max_depth}, compiled in {compile_ms:.0f} ms")
+    print(f"equivalence: {equivalence['rows']} rows, max |diff| = {equivalence['max_abs_diff']:.3g}")
+    print(f"contributions: {contributions['rows']} rows, max |bias + sum - prediction| = "
+          f"{contributions['max_sum_diff']:.3g}")
+    print(f"{'rows':>7} {'sklearn ms':>12} {'compiled ms':>12} {'speedup':>8} {'served by':>10} "
+          f"{'contrib ms':>12} {'overhead':>9}")
+    for row in latency:
+        print(f"{row['rows']:>7} {row['sklearn_ms']:>12.3f} {row['compiled_ms']:>12.3f} {row['speedup']:>7.2f}x"
+              f" {row['served_by']:>10} {row['contributions_ms']:>12.3f} {row['contributions_overhead']:>8.2f}x")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'model_version': current.version,
+                'compile_ms': round(compile_ms, 2),
+                'equivalence': equivalence,
+                'contributions': contributions,
+                'latency': latency
+            }, f, indent=2)
+
+    return 0 if equivalence['equivalent'] and contributions['consistent'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""
+Benchmark suite for the model service.
+
+Run from python-model-service/:
+
+    python -m benchmarks.run_benchmarks [--sizes 1000,10000,100000]
+        [--json results.json] [--compare baseline.json --tolerance 1.25]
+
+Covers model1/model3 clustering, model2 daily emissions and the RF
+forecaster at each profile count (single-row vs batch), cold vs warm
+start, and Flask test-client throughput. Results are written as JSON;
+with --compare, any benchmark slower than baseline * tolerance is
+reported and the run exits non-zero.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+# Keep benchmark runs away from the service's real registry and cluster model
+_WORKDIR = tempfile.mkdtemp(prefix='model-bench-')
+os.environ.setdefault('MODEL_REGISTRY_DIR', os.path.join(_WORKDIR, 'registry'))
+os.environ.setdefault('MODEL3_CLUSTER_PATH', os.path.join(_WORKDIR, 'model3_cluster.pkl'))
+os.environ.setdefault('FEATURE_PIPELINE_PATH', os.path.join(_WORKDIR, 'feature_pipeline.pkl'))
+os.environ.setdefault('AUTO_K_CACHE_DIR', os.path.join(_WORKDIR, 'k_selection_cache'))
+os.environ.setdefault('PROFILE_STORE_DIR', os.path.join(_WORKDIR, 'profile_store'))
+os.environ.setdefault('SNAPSHOT_DIR', os.path.join(_WORKDIR, 'snapshots'))
+os.environ.setdefault('MODEL_WARMUP', '0')
+os.environ.setdefault('PREDICTION_CACHE', '0')
+
+import numpy as np
+import sklearn
+
+import model1
+import model2
+import model3
+import predictonmodel
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+SINGLE_ROW_CALLS = 200
+THROUGHPUT_REQUESTS = 500
+
+
+# ---------------------------------------------------------------------------
+# Synthetic data
+# ---------------------------------------------------------------------------
+
+def synthetic_profiles(n, seed=42):
+    """Profiles shaped like the Mongo UserProfile documents the Node side sends"""
+    df = predictonmodel.create_sample_training_data(n_samples=n, seed=seed)
+    df = df[predictonmodel.FEATURES]
+    df.insert(0, '_id', [f'p{i:08d}' for i in range(n)])
+    df.insert(1, 'userId', [f'u{i:08d}' for i in range(n)])
+    return df.to_dict(orient='records')
+
+
+def synthetic_activities(n, seed=42):
+    """Mixed-category payloads for model2.compute_daily_emission"""
+    rng = np.random.default_rng(seed)
+    categories = list(model2.BATCH_CATEGORY_CODES)
+    modes = list(model2.TRANSPORT_EMISSION)
+    sources = list(model2.GRID_EMISSION_KG_PER_KWH)
+    fuels = list(model2.COOKING_EMISSION_PER_DAY)
+    activities = []
+    for category in rng.choice(categories, n):
+        details = {
+            'Transport': lambda: {'distance_travelled_km': float(rng.uniform(1, 50)), 'transport_mode': str(rng.choice(modes))},
+            'Electricity': lambda: {'electricity_bill': float(rng.uniform(300, 2500)), 'electricity_source': str(rng.choice(sources))},
+            'Cooking': lambda: {'cooking_fuel_type': str(rng.choice(fuels))},
+            'Waste': lambda: {'daily_waste_generated_kg': float(rng.uniform(0.1, 5))},
+            'Shopping': lambda: {'purchase_amount': float(rng.uniform(100, 5000))},
+            'Water': lambda: {'liters': float(rng.uniform(50, 500))}
+        }[category]()
+        activities.append({'category': str(category), 'details': details})
+    return activities
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+def repeats_for(n):
+    """Repeat small cases to smooth out noise; the largest ones run once"""
+    return 3 if n <= 10000 else 1
+
+
+def timed(fn, repeats=1):
+    """Best wall time of `repeats` calls"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def result(name, size, seconds, rows=None):
+    rows = size if rows is None else rows
+    return {
+        'name': name,
+        'size': size,
+        'seconds': round(seconds, 6),
+        'rows_per_second': round(rows / seconds, 1) if seconds > 0 else None
+    }
+
+
+# ---------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------
+
+def bench_clustering(sizes):
+    out = []
+    for n in sizes:
+        profiles = synthetic_profiles(n)
+        r = repeats_for(n)
+        out.append(result('model1.run_cluster', n, timed(lambda: model1.run_cluster(profiles), r)))
+        out.append(result('model3.run_cluster', n, timed(lambda: model3.run_cluster(profiles), r)))
+        out.append(result('model3.fit_cluster_model', n, timed(lambda: model3.fit_cluster_model(profiles), r)))
+
+        one = profiles[:1]
+        seconds = timed(lambda: [model3.assign_clusters(one) for _ in range(SINGLE_ROW_CALLS)])
+        out.append(result('model3.assign_clusters[single]', n, seconds / SINGLE_ROW_CALLS, rows=1))
+    return out
+
+
+def bench_daily_emission(sizes):
+    out = []
+    for n in sizes:
+        activities = synthetic_activities(n)
+        r = repeats_for(n)
+        out.append(result('model2.compute_daily_emission[loop]', n,
+                          timed(lambda: [model2.compute_daily_emission(a) for a in activities], r)))
+        out.append(result('model2.compute_daily_emissions_batch', n,
+                          timed(lambda: model2.compute_daily_emissions_batch(activities), r)))
+    return out
+
+
+def bench_forecaster(sizes):
+    out = []
+    predictonmodel.get_current()
+    for n in sizes:
+        profiles = synthetic_profiles(n)
+        calls = min(n, SINGLE_ROW_CALLS)
+        seconds = timed(lambda: [predictonmodel.predict_carbon_emission(p) for p in profiles[:calls]])
+        out.append(result('predictonmodel.predict_carbon_emission[single]', n, seconds / calls, rows=1))
+        out.append(result('predictonmodel.predict_carbon_emission_batch', n,
+                          timed(lambda: predictonmodel.predict_carbon_emission_batch(profiles), repeats_for(n))))
+    return out
+
+
+def bench_startup():
+    """Cold start: fresh interpreter importing app and making a first prediction"""
+    script = (
+        "import time; t = time.perf_counter(); import app; t_import = time.perf_counter() - t; "
+        "import predictonmodel; t = time.perf_counter(); predictonmodel.get_current(); "
+        "t_load = time.perf_counter() - t; print(t_import, t_load)"
+    )
+    env = dict(os.environ, MODEL_WARMUP='0')
+    proc = subprocess.run([sys.executable, '-W', 'ignore', '-c', script], env=env,
+                          capture_output=True, text=True, check=True)
+    t_import, t_load = map(float, proc.stdout.strip().splitlines()[-1].split())
+
+    payload = synthetic_profiles(1)[0]
+    warm = timed(lambda: predictonmodel.predict_carbon_emission(payload), repeats=20)
+    return [
+        result('startup.import_app[cold]', 1, t_import, rows=1),
+        result('startup.load_model[cold]', 1, t_load, rows=1),
+        result('predictonmodel.predict_carbon_emission[warm]', 1, warm, rows=1)
+    ]
+
+
+def bench_http():
+    """Requests per second through the Flask test client"""
+    import app
+    client = app.app.test_client()
+    profile = {k: v for k, v in synthetic_profiles(1)[0].items() if k in predictonmodel.FEATURES}
+    activities = synthetic_activities(1000)
+    profiles = synthetic_profiles(1000)
+
+    cases = [
+        ('http./predict_daily_emission', '/predict_daily_emission', lambda i: activities[i % len(activities)]),
+        ('http./predict_carbon_emission', '/predict_carbon_emission', lambda i: profile),
+    ]
+    out = []
+    for name, url, payload in cases:
+        seconds = timed(lambda: [client.post(url, json=payload(i)) for i in range(THROUGHPUT_REQUESTS)])
+        out.append(result(name, THROUGHPUT_REQUESTS, seconds))
+
+    out.append(result('http./predict_daily_emission/batch', len(activities),
+                      timed(lambda: client.post('/predict_daily_emission/batch', json=activities))))
+    out.append(result('http./predict_carbon_emission/batch', len(profiles),
+                      timed(lambda: client.post('/predict_carbon_emission/batch', json={'profiles': profiles}))))
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Entry point
+# ---------------------------------------------------------------------------
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = {(r['name'], r['size']): r for r in json.load(f)['results']}
+    regressions = []
+    for r in results:
+        base = baseline.get((r['name'], r['size']))
+        if base and r['seconds'] > base['seconds'] * tolerance:
+            regressions.append({**r, 'baseline_seconds': base['seconds'],
+                                'ratio': round(r['seconds'] / base['seconds'], 2)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Model service benchmarks')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma-separated profile counts')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='baseline results JSON to check against')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='allowed slowdown factor versus the baseline')
+    args = parser.parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+
+    results = []
+    for bench in (bench_startup, lambda: bench_forecaster(sizes), lambda: bench_daily_emission(sizes),
+                  lambda: bench_clustering(sizes), bench_http):
+        for r in bench():
+            print(f"{r['name']:<50} {r['size']:>8} {r['seconds'] * 1e3:>12.3f} ms")
+            results.append(r)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'sklearn': sklearn.__version__,
+            'cpu_count': os.cpu_count(),
+            'sizes': sizes,
+            'model_version': predictonmodel.get_current().version
+        },
+        'results': results
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r['name']} [{r['size']}]: {r['seconds']:.4f}s vs {r['baseline_seconds']:.4f}s ({r['ratio']}x)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+Binary columnar request/response bodies for the bulk endpoints.
+
+A body is a set of equal-length 1-D columns plus a small JSON "meta"
+object (request options such as k, or response extras such as cluster
+labels). Two encodings are understood:
+
+    application/x-npz                    NumPy .npz archive, one .npy per
+                                         column; meta in a "__meta__" entry
+    application/vnd.apache.arrow.stream  Arrow IPC stream; meta in the
+                                         schema metadata (needs pyarrow)
+
+Numeric columns decode straight into contiguous NumPy arrays, with no
+per-row Python objects. The request format comes from Content-Type and
+the response format from Accept. When Accept names no supported type,
+the response uses the request's format.
+"""
+import io
+import json
+import zipfile
+
+import numpy as np
+from flask import Response
+
+NPZ = 'application/x-npz'
+ARROW = 'application/vnd.apache.arrow.stream'
+JSON = 'application/json'
+
+META_KEY = '__meta__'
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise ValueError(f"{ARROW} bodies need pyarrow")
+    return pyarrow
+
+
+def _column(values):
+    values = np.asarray(values)
+    if values.dtype == object:
+        # ids and label names: fixed-width unicode, loadable without pickle
+        values = np.array(['' if v is None else str(v) for v in values], dtype=str)
+    return values
+
+
+def _plain(value):
+    # NumPy scalars (also as dict keys, e.g. cluster ids) -> Python values for json
+    if isinstance(value, dict):
+        return {_plain(k): _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _check_lengths(columns):
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError("All columns must have the same length")
+
+
+def decode(body, mimetype):
+    """(columns, meta) from a binary body; raises ValueError if it is malformed"""
+    if mimetype == NPZ:
+        try:
+            if not body.startswith(b'PK'):
+                raise ValueError("not an .npz (zip) archive")
+            with np.load(io.BytesIO(body), allow_pickle=False) as archive:
+                columns = {name: archive[name] for name in archive.files if name != META_KEY}
+                meta = json.loads(str(archive[META_KEY])) if META_KEY in archive.files else {}
+        except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            raise ValueError(f"Invalid {NPZ} body: {e}")
+    elif mimetype == ARROW:
+        pa = _pyarrow()
+        try:
+            table = pa.ipc.open_stream(body).read_all()
+        except pa.ArrowInvalid as e:
+            raise ValueError(f"Invalid {ARROW} body: {e}")
+        columns = {name: table.column(name).to_numpy() for name in table.column_names}
+        raw = (table.schema.metadata or {}).get(META_KEY.encode())
+        meta = json.loads(raw) if raw else {}
+    else:
+        raise ValueError(f"Unsupported columnar type: {mimetype}")
+
+    if any(values.ndim != 1 for values in columns.values()):
+        raise ValueError("Columns must be one-dimensional")
+    _check_lengths(columns)
+    return columns, meta
+
+
+def encode(columns, meta, mimetype):
+    """Bytes of columns ({name: 1-D array}) plus a JSON-friendly meta dict"""
+    columns = {name: _column(values) for name, values in columns.items()}
+    _check_lengths(columns)
+    if mimetype == NPZ:
+        buffer = io.BytesIO()
+        np.savez(buffer, **columns, **{META_KEY: np.array(json.dumps(_plain(meta or {})))})
+        return buffer.getvalue()
+    if mimetype == ARROW:
+        pa = _pyarrow()
+        table = pa.table(columns, metadata={META_KEY: json.dumps(_plain(meta or {}))})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    raise ValueError(f"Unsupported columnar type: {mimetype}")
+
+
+# ---------------------------------------------------------------------------
+# Flask helpers
+# ---------------------------------------------------------------------------
+
+def request_format(request):
+    """The columnar type of the request body, or None for JSON"""
+    return request.mimetype if request.mimetype in (NPZ, ARROW) else None
+
+
+def response_format(request):
+    """The columnar type to answer with, or None for JSON"""
+    accepted = [value for value, _ in request.accept_mimetypes]
+    if any(mimetype in accepted for mimetype in (JSON, NPZ, ARROW)):
+        best = request.accept_mimetypes.best_match([JSON, NPZ, ARROW])
+        return best if best != JSON else None
+    # no preference (missing Accept or */*): answer in the request's format
+    return request_format(request)
+
+
+def read_request(request):
+    """(columns, meta) of a columnar request, or None when the body is JSON"""
+    mimetype = request_format(request)
+    if mimetype is None:
+        return None
+    return decode(request.get_data(cache=False), mimetype)
+
+
+def records_to_columns(records, names, text_names=()):
+    """
+    Float columns for names from a list of dicts (missing or bad values -> NaN),
+    plus a string column for each of text_names that some record has
+    (e.g. ids; missing -> None)
+    """
+    def number(record, name):
+        try:
+            return float(record[name])
+        except (KeyError, TypeError, ValueError):
+            return np.nan
+
+    def text(record, name):
+        value = record.get(name) if isinstance(record, dict) else None
+        return None if value is None else str(value)
+
+    columns = {name: np.fromiter((number(r, name) for r in records), dtype=np.float64, count=len(records))
+               for name in names}
+    for name in text_names:
+        if any(isinstance(r, dict) and name in r for r in records):
+            columns[name] = np.array([text(r, name) for r in records], dtype=object)
+    return columns
+
+
+def columns_to_json(columns):
+    """{name: list} for a JSON response (NaN -> null)"""
+    out = {}
+    for name, values in columns.items():
+        values = np.asarray(values)
+        if values.dtype.kind == 'f':
+            out[name] = np.where(np.isnan(values), None, values.astype(object)).tolist()
+        else:
+            out[name] = values.tolist()
+    return out
+
+
+def response(mimetype, columns, meta=None):
+    return Response(encode(columns, meta, mimetype), mimetype=mimetype)
+
@@ -0,0 +1,188 @@
+import numpy as np
+
+# Rows walked through the forest at once; keeps the (rows x trees) working set in cache
+CHUNK_ROWS = 512
+
+
+class CompiledForest:
+    """
+    A fitted RandomForestRegressor flattened into plain NumPy node arrays.
+
+    All trees share one set of arrays: feature, threshold, value and
+    children, where children[2 * node] is the right child and
+    children[2 * node + 1] the left one, so a step is a single gather
+    indexed by the comparison result. roots holds each tree's first node.
+    Leaves point to themselves, so every row walks every tree for exactly
+    max_depth steps with no branching in Python.
+
+    When compiled with a StandardScaler its transform is folded into the
+    thresholds and predict() takes raw (unscaled) rows.
+
+    delta is aligned with children: delta[2 * node + went_left] is the
+    child's value minus the node's (0 on a leaf's self-loop). Summed per
+    split feature along a row's path it decomposes each tree's prediction
+    into its root value plus one contribution per feature, so
+    predict_contributions() gets them from the same walk as predict().
+
+    Instances only hold arrays, so a joblib dump of one can be loaded with
+    mmap_mode='r' and shared read-only between worker processes.
+    """
+
+    def __init__(self, feature, threshold, children, value, roots, max_depth, n_features, delta=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.n_features = int(n_features)
+        self.delta = _edge_deltas(children, value) if delta is None else delta
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'delta' not in state:
+            # forests pickled before delta existed
+            self.delta = _edge_deltas(self.children, self.value)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    def _apply_chunk(self, X, contributions=None):
+        n = len(X)
+        flat = X.ravel()
+        row_offset = (np.arange(n) * self.n_features)[:, None]
+        node = np.broadcast_to(self.roots, (n, self.n_trees)).copy()
+        for _ in range(self.max_depth):
+            cell = row_offset + self.feature[node]
+            edge = 2 * node + (flat[cell] <= self.threshold[node])
+            if contributions is not None:
+                # cell is also the (row, split feature) slot the step's delta belongs to
+                contributions += np.bincount(cell.ravel(), weights=self.delta[edge].ravel(),
+                                             minlength=contributions.size).reshape(contributions.shape)
+            node = self.children[edge]
+        return node
+
+    def apply(self, X):
+        """Leaf node index reached by every row in every tree, shape (n_rows, n_trees)"""
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        if len(X) <= CHUNK_ROWS:
+            return self._apply_chunk(X)
+        return np.concatenate([
+            self._apply_chunk(X[start:start + CHUNK_ROWS])
+            for start in range(0, len(X), CHUNK_ROWS)
+        ])
+
+    def predict(self, X):
+        """Mean leaf value over all trees, like RandomForestRegressor.predict"""
+        return self.value[self.apply(X)].mean(axis=1)
+
+    @property
+    def bias(self):
+        """Mean root value: the prediction before any split, shared by every row"""
+        return float(self.value[self.roots].mean())
+
+    def predict_contributions(self, X):
+        """
+        (predictions, contributions) where contributions has shape
+        (n_rows, n_features) and bias + contributions.sum(axis=1) equals the
+        prediction: how far each feature's splits moved this row's
+        prediction from the bias, averaged over the trees.
+        """
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        predictions = np.empty(len(X))
+        contributions = np.zeros((len(X), self.n_features))
+        for start in range(0, len(X), CHUNK_ROWS):
+            stop = start + CHUNK_ROWS
+            leaves = self._apply_chunk(X[start:stop], contributions[start:stop])
+            predictions[start:stop] = self.value[leaves].mean(axis=1)
+        contributions /= self.n_trees
+        return predictions, contributions
+
+
+def _edge_deltas(children, value):
+    """value[child] - value[parent] for every entry of children"""
+    return value[children] - np.repeat(value, 2)
+
+
+def _fold_thresholds(threshold, mean, scale):
+    """
+    Map scaled-space split thresholds to raw feature space.
+
+    sklearn compares float32(scaler.transform(x)) <= t, so the raw threshold
+    is the largest float64 x for which that holds. t * scale + mean is
+    within a few float32 ulps of it; bisect from there to the exact value.
+    """
+    def passes(x):
+        return ((x - mean) / scale).astype(np.float32) <= threshold
+
+    approx = threshold * scale + mean
+    delta = (np.abs(approx) + np.abs(scale)) * 1e-5
+    lo = approx - delta
+    hi = approx + delta
+    while not passes(lo).all():
+        lo = np.where(passes(lo), lo, lo - delta)
+        delta *= 2
+    while passes(hi).any():
+        hi = np.where(passes(hi), hi + delta, hi)
+        delta *= 2
+
+    for _ in range(200):
+        mid = lo + (hi - lo) / 2
+        if np.array_equal(mid, lo) or np.array_equal(mid, hi):
+            break
+        ok = passes(mid)
+        lo = np.where(ok, mid, lo)
+        hi = np.where(ok, hi, mid)
+
+    # lo and hi may still be a float apart where mid rounded onto an endpoint
+    step = np.nextafter(lo, np.inf)
+    return np.where((step < hi) & passes(step), step, lo)
+
+
+def compile_forest(model, scaler=None):
+    """Flatten a fitted RandomForestRegressor (and optional StandardScaler) into a CompiledForest"""
+    features, thresholds, children, values, roots = [], [], [], [], []
+    offset = 0
+    max_depth = 0
+
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        n = tree.node_count
+        node_ids = np.arange(n)
+        is_leaf = tree.children_left == -1
+
+        feature = np.where(is_leaf, 0, tree.feature)
+        threshold = np.where(is_leaf, 0.0, tree.threshold)
+        if scaler is not None:
+            split = ~is_leaf
+            threshold[split] = _fold_thresholds(
+                threshold[split], scaler.mean_[feature[split]], scaler.scale_[feature[split]]
+            )
+
+        pair = np.empty(2 * n, dtype=np.int64)
+        pair[0::2] = np.where(is_leaf, node_ids, tree.children_right) + offset
+        pair[1::2] = np.where(is_leaf, node_ids, tree.children_left) + offset
+
+        features.append(feature)
+        thresholds.append(threshold)
+        children.append(pair)
+        values.append(tree.value[:, 0, 0])
+        roots.append(offset)
+
+        offset += n
+        max_depth = max(max_depth, tree.max_depth)
+
+    return CompiledForest(
+        feature=np.concatenate(features).astype(np.int32),
+        threshold=np.concatenate(thresholds).astype(np.float64),
+        children=np.concatenate(children).astype(np.int32),
+        value=np.concatenate(values).astype(np.float64),
+        roots=np.array(roots, dtype=np.int32),
+        max_depth=max_depth,
+        n_features=model.n_features_in_
+    )
@@ -0,0 +1,152 @@
+import hashlib
+import os
+import threading
+
+import joblib
+import numpy as np
+import pandas as pd
+
+FEATURES = [
+    "avg_transport_emission_kgCO2",
+    "avg_electricity_kwh",
+    "avg_lpg_kg",
+    "avg_nonveg_meals",
+    "avg_waste_generated_kg",
+    "avg_purchases_per_day",
+    "avg_renewable_usage"
+]
+
+# Where the fitted pipeline is stored
+PIPELINE_PATH = os.environ.get('FEATURE_PIPELINE_PATH', 'feature_pipeline.pkl')
+
+# feature -> (raw profile field, multiplier, divisor), used when a profile
+# does not supply the feature itself
+DERIVATIONS = {
+    "avg_transport_emission_kgCO2": ("avg_daily_travel_km", 0.21, 1.0),
+    "avg_purchases_per_day": ("avg_items_purchased", 1.0, 30.0)
+}
+
+# Value for a feature a profile neither supplies nor can derive. Features
+# listed here are re-learned by fit() as the median of supplied values;
+# waste defaults to the midpoint of the 0.4-1.5 kg range it used to be
+# sampled from at random.
+DEFAULT_FILL = {
+    "avg_waste_generated_kg": 0.95
+}
+
+
+class FeaturePipeline:
+    """
+    Columnar transformer from raw profiles to the clustering feature matrix.
+
+    A batch is read once into a (rows x raw fields) float matrix with NaN
+    for anything missing; each feature is then the supplied column, else
+    its derivation, else the fill value, computed with a few whole-matrix
+    gathers and np.where calls. Identical inputs always give identical
+    features, and fingerprint identifies the fitted parameters so results
+    computed from the features can be memoized.
+    """
+
+    def __init__(self, fill_values=None):
+        fill_values = dict(DEFAULT_FILL, **(fill_values or {}))
+        self.fill_values = np.array([float(fill_values.get(f, 0.0)) for f in FEATURES])
+        self.n_fitted = 0
+
+        self.raw_columns = list(dict.fromkeys(
+            FEATURES + [source for source, _, _ in DERIVATIONS.values()]
+        ))
+        # features without a derivation read the all-NaN column at the end
+        missing = len(self.raw_columns)
+        self._source = np.array([
+            self.raw_columns.index(DERIVATIONS[f][0]) if f in DERIVATIONS else missing
+            for f in FEATURES
+        ])
+        self._multiplier = np.array([DERIVATIONS[f][1] if f in DERIVATIONS else 1.0 for f in FEATURES])
+        self._divisor = np.array([DERIVATIONS[f][2] if f in DERIVATIONS else 1.0 for f in FEATURES])
+
+    @property
+    def fingerprint(self):
+        digest = hashlib.sha1()
+        digest.update(','.join(FEATURES).encode('utf-8'))
+        digest.update(repr(sorted(DERIVATIONS.items())).encode('utf-8'))
+        digest.update(self.fill_values.tobytes())
+        return digest.hexdigest()[:16]
+
+    def raw_matrix(self, data):
+        """Raw profile fields as floats (NaN where missing), plus a trailing all-NaN column"""
+        if not isinstance(data, pd.DataFrame):
+            data = pd.DataFrame(data)
+        raw = np.full((len(data), len(self.raw_columns) + 1), np.nan)
+        present = [i for i, col in enumerate(self.raw_columns) if col in data.columns]
+        if present and len(data):
+            raw[:, present] = data[[self.raw_columns[i] for i in present]].to_numpy(
+                dtype=float, na_value=np.nan
+            )
+        return raw
+
+    def _combine(self, raw):
+        supplied = raw[:, :len(FEATURES)]
+        derived = raw[:, self._source] * self._multiplier / self._divisor
+        return np.where(np.isnan(supplied), derived, supplied)
+
+    def transform(self, data):
+        """Feature matrix (n_rows x len(FEATURES)) for a DataFrame or list of profile dicts"""
+        X = self._combine(self.raw_matrix(data))
+        return np.where(np.isnan(X), self.fill_values, X)
+
+    def fit(self, data):
+        """Learn the fill values in DEFAULT_FILL from the profiles that supply them"""
+        X = self._combine(self.raw_matrix(data))
+        for name in DEFAULT_FILL:
+            idx = FEATURES.index(name)
+            observed = X[:, idx][~np.isnan(X[:, idx])]
+            self.fill_values[idx] = float(np.median(observed)) if len(observed) else DEFAULT_FILL[name]
+        self.n_fitted = len(X)
+        return self
+
+
+def add_features(df, pipeline=None):
+    """Write the feature columns into df; returns (df, feature matrix)"""
+    X = (pipeline or get_pipeline()).transform(df)
+    df[FEATURES] = X
+    return df, X
+
+
+# ---------------------------------------------------------------------------
+# Persisted pipeline
+# ---------------------------------------------------------------------------
+
+_pipeline = None
+_pipeline_mtime = None
+_lock = threading.Lock()
+
+
+def save_pipeline(pipeline, path=None):
+    """Write the pipeline atomically (write to a temp file, then rename)"""
+    path = path or PIPELINE_PATH
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(pipeline, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def get_pipeline():
+    """The stored pipeline (reloaded if another process saved a newer one), or an unfitted default"""
+    global _pipeline, _pipeline_mtime
+    mtime = os.path.getmtime(PIPELINE_PATH) if os.path.exists(PIPELINE_PATH) else None
+    if _pipeline is None or mtime != _pipeline_mtime:
+        with _lock:
+            if _pipeline is None or mtime != _pipeline_mtime:
+                _pipeline = joblib.load(PIPELINE_PATH) if mtime is not None else FeaturePipeline()
+                _pipeline_mtime = mtime
+    return _pipeline
+
+
+def fit_pipeline(data):
+    """Fit a new pipeline on the full profile set, persist it and make it current"""
+    global _pipeline, _pipeline_mtime
+    pipeline = FeaturePipeline().fit(data)
+    with _lock:
+        save_pipeline(pipeline)
+        _pipeline = pipeline
+        _pipeline_mtime = os.path.getmtime(PIPELINE_PATH)
+    return pipeline
@@ -0,0 +1,204 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span
+
+# Days of history used per user (at least 30; whole weeks keep weekdays balanced)
+FORECAST_HISTORY_DAYS = 56
+
+# Longest forecast horizon (days)
+FORECAST_MAX_HORIZON = 90
+
+# Weight of the 7-day vs the 30-day mean in the forecast level
+LEVEL_WEIGHT_7 = 0.5
+
+# Per-day damping of the trend (1.0 = straight line)
+TREND_DAMPING = 0.9
+
+# Pseudo-observations pulling a weekday's effect towards 0 when it was seen only a few times
+SEASONAL_SHRINK = 2.0
+
+Forecast = namedtuple('Forecast', ['user_ids', 'dates', 'forecast', 'features', 'as_of'])
+
+
+def to_days(values):
+    """datetime64[D] for ISO strings / datetimes, or epoch milliseconds if numeric"""
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        stamps = values if values.dt.tz is None else values.dt.tz_convert(None)
+        return stamps.to_numpy().astype('datetime64[D]')
+    if pd.api.types.is_numeric_dtype(values):
+        stamps = pd.to_datetime(values, unit='ms', utc=True)
+    else:
+        # JSON may mix ISO strings and epoch ms
+        millis = pd.to_numeric(values, errors='coerce')
+        is_millis = millis.notna()
+        stamps = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns, UTC]')
+        if is_millis.any():
+            stamps[is_millis] = pd.to_datetime(millis[is_millis], unit='ms', utc=True)
+        if not is_millis.all():
+            stamps[~is_millis] = pd.to_datetime(values[~is_millis], utc=True, format='ISO8601')
+    if stamps.isna().any():
+        raise ValueError("Every activity needs a date")
+    return stamps.dt.tz_convert(None).to_numpy().astype('datetime64[D]')
+
+
+def daily_matrix(codes, days, emissions, n_users, as_of, window):
+    """
+    Sum emissions into a dense (n_users x window) matrix, last column = as_of.
+
+    Also returns the first observed column per user: days before a user's
+    first activity are unknown, not zero-emission days.
+    """
+    back = (as_of - days).astype(np.int64)
+    keep = (back >= 0) & (back < window) & np.isfinite(emissions)
+    col = window - 1 - back[keep]
+    totals = np.bincount(codes[keep] * window + col, weights=emissions[keep],
+                         minlength=n_users * window).reshape(n_users, window)
+
+    first_day = np.full(n_users, np.iinfo(np.int64).max)
+    np.minimum.at(first_day, codes, (days - as_of).astype(np.int64))
+    first_col = np.clip(first_day + window - 1, 0, None)
+    return totals, first_col
+
+
+def _masked_slope(y, observed):
+    """Least-squares slope per row over the observed columns (0 with fewer than 2 points)"""
+    t = np.arange(y.shape[1], dtype=np.float64)
+    n = observed.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t_mean = (observed * t).sum(axis=1) / n
+        y_mean = (observed * y).sum(axis=1) / n
+        dt = (t - t_mean[:, None]) * observed
+        denominator = (dt * dt).sum(axis=1)
+        slope = (dt * (y - y_mean[:, None])).sum(axis=1) / denominator
+    return np.where(denominator > 0, slope, 0.0)
+
+
+def forecast_daily(user_ids, dates, emissions, horizon=7, as_of=None, window=FORECAST_HISTORY_DAYS):
+    """
+    Forecast daily emission for every user at once.
+
+    Args:
+        user_ids, dates, emissions: one entry per activity (e.g. each
+            model2.compute_daily_emission result with its user and date);
+            dates as ISO strings, datetimes or epoch ms
+        horizon: days forecast after as_of
+        as_of: last day of history (default: the latest date seen)
+
+    Per user, over the last `window` days (from the first activity on):
+    the 7- and 30-day mean, a least-squares trend over 30 days and
+    additive weekday effects (shrunk towards 0 for rarely seen weekdays).
+    The forecast for day h is the level (both means moved to as_of along
+    the trend) plus the damped trend and that weekday's effect, floored at
+    0. Every step is a whole-population array operation; there is no
+    per-user loop. Returns a Forecast.
+    """
+    horizon = int(horizon)
+    if not 1 <= horizon <= FORECAST_MAX_HORIZON:
+        raise ValueError(f"horizon must be between 1 and {FORECAST_MAX_HORIZON}")
+    window = max(30, int(window))
+
+    with span("forecast.prepare"):
+        codes, uniques = pd.factorize(pd.Series(user_ids).astype(str))
+        days = to_days(dates)
+        emissions = np.asarray(emissions, dtype=np.float64)
+        if not len(days):
+            raise ValueError("No activity history provided")
+        as_of = days.max() if as_of is None else np.datetime64(str(as_of)[:10], 'D')
+
+        # users with no activity up to as_of have nothing to forecast from
+        present = np.zeros(len(uniques), dtype=bool)
+        present[codes[days <= as_of]] = True
+        remap = np.cumsum(present) - 1
+        rows = present[codes]
+        codes, days, emissions = remap[codes[rows]], days[rows], emissions[rows]
+        uniques = np.asarray(uniques)[present]
+        n_users = len(uniques)
+        if n_users == 0:
+            raise ValueError(f"No activity on or before {as_of}")
+
+    with span("forecast.daily_matrix"):
+        totals, first_col = daily_matrix(codes, days, emissions, n_users, as_of, window)
+        observed = np.arange(window)[None, :] >= first_col[:, None]
+
+    with span("forecast.features"):
+        obs_7, obs_30 = observed[:, -7:], observed[:, -30:]
+        mean_7 = (totals[:, -7:] * obs_7).sum(axis=1) / obs_7.sum(axis=1)
+        mean_30 = (totals[:, -30:] * obs_30).sum(axis=1) / obs_30.sum(axis=1)
+        trend = _masked_slope(totals[:, -30:], obs_30)
+
+        # weekday (Mon=0) of every history column, as a one-hot (window x 7) matrix
+        column_days = as_of - np.arange(window - 1, -1, -1)
+        weekdays = (column_days.astype(np.int64) + 3) % 7
+        one_hot = np.eye(7)[weekdays]
+        weekday_sum = (totals * observed) @ one_hot
+        weekday_n = observed @ one_hot
+        overall = (totals * observed).sum(axis=1) / observed.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weekday_mean = weekday_sum / weekday_n
+        seasonal = np.nan_to_num((weekday_mean - overall[:, None]) * (weekday_n / (weekday_n + SEASONAL_SHRINK)))
+
+    with span("forecast.predict"):
+        # mean_7 is centred 3 days before as_of, mean_30 14.5 days before
+        level = (LEVEL_WEIGHT_7 * (mean_7 + 3 * trend)
+                 + (1 - LEVEL_WEIGHT_7) * (mean_30 + 14.5 * trend))
+        damping = np.cumsum(TREND_DAMPING ** np.arange(1, horizon + 1))
+        forecast_days = as_of + np.arange(1, horizon + 1)
+        forecast_weekdays = (forecast_days.astype(np.int64) + 3) % 7
+        forecast = level[:, None] + trend[:, None] * damping[None, :] + seasonal[:, forecast_weekdays]
+        forecast = np.maximum(forecast, 0.0)
+
+    features = {
+        'mean_7': mean_7,
+        'mean_30': mean_30,
+        'trend': trend,
+        'observed_days': observed.sum(axis=1),
+        'weekday_effect': seasonal
+    }
+    return Forecast(uniques, forecast_days, forecast, features, as_of)
+
+
+def forecast_columns(result):
+    """A Forecast in long form: {userId, date, forecast_kg}, one row per user and day"""
+    n_users, horizon = result.forecast.shape
+    return {
+        'userId': np.repeat(result.user_ids.astype(str), horizon),
+        'date': np.tile(result.dates.astype(str), n_users),
+        'forecast_kg': result.forecast.ravel().round(3)
+    }
+
+
+def forecast_records(result):
+    """A Forecast as one JSON-friendly dict per user"""
+    forecast = result.forecast.round(3).tolist()
+    features = {name: values.round(4).tolist() for name, values in result.features.items()
+                if name != 'weekday_effect'}
+    weekday_effect = result.features['weekday_effect'].round(4).tolist()
+    return [
+        {
+            'userId': str(user_id),
+            'forecast_kg': forecast[i],
+            **{name: values[i] for name, values in features.items()},
+            'weekday_effect': weekday_effect[i]
+        }
+        for i, user_id in enumerate(result.user_ids)
+    ]
+
+
+def forecast_csv(paths, horizon=7, as_of=None):
+    """forecast_daily over activity CSV exports with userId, createdAt (or date) and co2_kg columns"""
+    frames = []
+    for path in [paths] if isinstance(paths, str) else paths:
+        header = list(pd.read_csv(path, nrows=0).columns)
+        date_column = 'createdAt' if 'createdAt' in header else 'date'
+        missing = [col for col in ('userId', date_column, 'co2_kg') if col not in header]
+        if missing:
+            raise ValueError(f"{path} is missing column(s): {', '.join(missing)}")
+        frame = pd.read_csv(path, usecols=['userId', date_column, 'co2_kg'], dtype={'userId': str})
+        frame['date'] = to_days(frame.pop(date_column))
+        frames.append(frame)
+    history = pd.concat(frames, ignore_index=True)
+    return forecast_daily(history['userId'], history['date'], history['co2_kg'], horizon, as_of)
@@ -0,0 +1,17 @@
+# Gunicorn settings for serving the model service with shared models:
+#
+#     gunicorn -c gunicorn.conf.py app:app
+#
+# Models are loaded once in the master before workers are forked
+# (preload_app + PRELOAD_MODELS, see warmup.preload), so every worker shares
+# one physical copy and new workers start without loading anything.
+import multiprocessing
+import os
+
+os.environ.setdefault("PRELOAD_MODELS", "1")
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+preload_app = True
+timeout = 120
@@ -0,0 +1,245 @@
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import StandardScaler
+
+import predictonmodel
+from predictonmodel import FEATURES, RF_PARAMS
+
+# Comma-separated history sources retrain_rf jobs train on by default (empty = synthetic data)
+TRAINING_HISTORY = [s for s in os.environ.get('RF_TRAINING_HISTORY', '').split(',') if s]
+
+# Rows parsed from a history file at a time
+HISTORY_CHUNK_ROWS = int(os.environ.get('HISTORY_CHUNK_ROWS', '100000'))
+
+# Most rows one worker trains its trees on (bounds per-worker memory)
+HISTORY_SHARD_ROWS = int(os.environ.get('HISTORY_SHARD_ROWS', '250000'))
+
+# Where the parsed feature rows are spilled during training (default: system temp dir)
+HISTORY_SPILL_DIR = os.environ.get('HISTORY_SPILL_DIR')
+
+# Rows held out (uniformly sampled) to score the trained forest
+VALIDATION_FRACTION = 0.02
+VALIDATION_ROWS = 20000
+
+# Target column names accepted in history files, in order of preference
+TARGET_COLUMNS = ['next_month_emission', 'predicted_emission']
+
+# History source that reads month pairs straight from the profile store
+PROFILE_STORE_SOURCE = 'profile_store'
+
+_WIDTH = len(FEATURES) + 1
+
+
+# ---------------------------------------------------------------------------
+# Reading history
+# ---------------------------------------------------------------------------
+
+def _parquet_file(path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError(f"Reading Parquet history ({path}) needs pyarrow")
+    return pq.ParquetFile(path)
+
+
+def _target_column(columns, path):
+    missing = [field for field in FEATURES if field not in columns]
+    if missing:
+        raise ValueError(f"{path} is missing column(s): {', '.join(missing)}")
+    for column in TARGET_COLUMNS:
+        if column in columns:
+            return column
+    raise ValueError(f"{path} has no target column (one of {', '.join(TARGET_COLUMNS)})")
+
+
+def _file_chunks(path, chunksize):
+    """DataFrames of FEATURES + target read from a CSV or Parquet file, chunksize rows at a time"""
+    if path.endswith('.parquet'):
+        parquet = _parquet_file(path)
+        target = _target_column(parquet.schema_arrow.names, path)
+        for batch in parquet.iter_batches(batch_size=chunksize, columns=FEATURES + [target]):
+            yield batch.to_pandas().rename(columns={target: 'target'})
+    else:
+        target = _target_column(list(pd.read_csv(path, nrows=0).columns), path)
+        for chunk in pd.read_csv(path, usecols=FEATURES + [target], chunksize=chunksize):
+            yield chunk.rename(columns={target: 'target'})
+
+
+def _profile_store_chunks():
+    """One DataFrame per month: the month's profiles with the next month's emission as target"""
+    import profile_store
+
+    store = profile_store.store
+    months = store.months()
+    for month, following in zip(months, months[1:]):
+        if profile_store.previous_month(following) != month:
+            continue
+        df = store.profile_frame(month)
+        user_ids, fields = store.profile_columns(following)
+        target = pd.Series(fields['month_emission'], index=user_ids)
+        df['target'] = df['userId'].map(target)
+        yield df[FEATURES + ['target']]
+
+
+def history_chunks(sources, chunksize=HISTORY_CHUNK_ROWS):
+    """(rows x len(FEATURES)+1) float matrices, target last, over every source in order"""
+    for source in sources:
+        if source == PROFILE_STORE_SOURCE:
+            chunks = _profile_store_chunks()
+        elif not os.path.exists(source):
+            raise ValueError(f"History file not found: {source}")
+        else:
+            chunks = _file_chunks(source, chunksize)
+        for chunk in chunks:
+            yield chunk.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+
+
+# ---------------------------------------------------------------------------
+# Training
+# ---------------------------------------------------------------------------
+
+def _spill(sources, spill_path, seed, progress=None):
+    """
+    Parse every source once: append valid rows to a raw float64 file, fit
+    the scaler incrementally and keep a uniform sample of held-out rows.
+    Returns (rows spilled, rows dropped, scaler, validation matrix).
+    """
+    rng = np.random.default_rng(seed)
+    scaler = StandardScaler()
+    rows = dropped = 0
+    held_out = np.empty((0, _WIDTH))
+    held_keys = np.empty(0)
+
+    with open(spill_path, 'wb') as f:
+        for block in history_chunks(sources):
+            valid = np.isfinite(block).all(axis=1)
+            dropped += int((~valid).sum())
+            block = block[valid]
+            if not len(block):
+                continue
+
+            # reservoir by random key: the VALIDATION_ROWS smallest keys are a uniform sample
+            hold = rng.random(len(block)) < VALIDATION_FRACTION
+            held_out = np.concatenate([held_out, block[hold]])
+            held_keys = np.concatenate([held_keys, rng.random(int(hold.sum()))])
+            if len(held_out) > VALIDATION_ROWS:
+                keep = np.argpartition(held_keys, VALIDATION_ROWS)[:VALIDATION_ROWS]
+                held_out, held_keys = held_out[keep], held_keys[keep]
+
+            train = np.ascontiguousarray(block[~hold])
+            if len(train):
+                scaler.partial_fit(train[:, :-1])
+                f.write(train.tobytes())
+                rows += len(train)
+            if progress:
+                progress(0.0, f"read {rows + len(held_out)} rows")
+    return rows, dropped, scaler, held_out
+
+
+def _fit_shard(spill_path, n_rows, shard, n_shards, n_trees, scaler, seed):
+    """Grow n_trees on every n_shards-th spilled row starting at shard; runs in a pool worker"""
+    data = np.memmap(spill_path, dtype=np.float64, mode='r', shape=(n_rows, _WIDTH))
+    view = data[shard::n_shards]
+    if len(view) > HISTORY_SHARD_ROWS:
+        # more history than one shard may hold: train on a uniform subsample
+        picks = np.sort(np.random.default_rng(seed + shard).choice(len(view), HISTORY_SHARD_ROWS, replace=False))
+        block = np.asarray(view[picks])
+    else:
+        block = np.array(view)
+    del data
+
+    params = dict(RF_PARAMS, n_estimators=n_trees, random_state=seed + shard, n_jobs=1)
+    return RandomForestRegressor(**params).fit(scaler.transform(block[:, :-1]), block[:, -1])
+
+
+def _merge(forests):
+    """One forest holding every tree of the per-shard forests"""
+    forest = forests[0]
+    for other in forests[1:]:
+        forest.estimators_ += other.estimators_
+    forest.set_params(n_estimators=len(forest.estimators_), n_jobs=RF_PARAMS['n_jobs'])
+    return forest
+
+
+def train_from_history(sources, n_jobs=None, progress=None, n_estimators=None, seed=None):
+    """
+    Train the Random Forest on exported history and publish it as a new version
+
+    Args:
+        sources: CSV / Parquet paths (FEATURES plus a next_month_emission or
+            predicted_emission target column) and/or "profile_store" for
+            consecutive months of the activity profile store
+        n_jobs: worker processes training shards in parallel
+        progress: optional callback(fraction, message)
+
+    The history is parsed once, in HISTORY_CHUNK_ROWS chunks, into a raw
+    float64 spill file. Training is split into shards of every n-th row
+    (so each shard spans the whole history) of at most HISTORY_SHARD_ROWS
+    rows; each worker memory-maps the spill file, copies out only its
+    shard and grows its share of the trees. The per-shard trees are merged
+    into one forest. Peak memory is one chunk in this process and one shard
+    per worker, whatever the size of the history.
+    """
+    sources = [sources] if isinstance(sources, str) else list(sources)
+    if not sources:
+        raise ValueError("No history sources given")
+    n_jobs = max(1, n_jobs or 1)
+    n_estimators = n_estimators or RF_PARAMS['n_estimators']
+    seed = RF_PARAMS['random_state'] if seed is None else seed
+
+    spill_dir = tempfile.mkdtemp(prefix='rf-history-', dir=HISTORY_SPILL_DIR)
+    try:
+        spill_path = os.path.join(spill_dir, 'rows.f64')
+        n_rows, dropped, scaler, held_out = _spill(sources, spill_path, seed, progress)
+        if n_rows < 2:
+            raise ValueError(f"Not enough valid history rows to train on ({n_rows})")
+
+        # enough shards to respect the row bound, but never more shards than trees
+        n_shards = min(max(1, math.ceil(n_rows / HISTORY_SHARD_ROWS)), n_estimators)
+        trees = [n_estimators // n_shards + (1 if s < n_estimators % n_shards else 0) for s in range(n_shards)]
+        print(f"Training Random Forest on {n_rows} history rows in {n_shards} shard(s)...")
+
+        args = [(spill_path, n_rows, s, n_shards, trees[s], scaler, seed) for s in range(n_shards)]
+        forests = [None] * n_shards
+        if n_jobs > 1 and n_shards > 1:
+            # spawn, not fork: the caller may be a threaded web process
+            with ProcessPoolExecutor(max_workers=min(n_jobs, n_shards),
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                futures = {executor.submit(_fit_shard, *a): a[2] for a in args}
+                for done, future in enumerate(as_completed(futures), 1):
+                    forests[futures[future]] = future.result()
+                    if progress:
+                        progress(done / n_shards, f"{done}/{n_shards} shards")
+        else:
+            for s, a in enumerate(args):
+                forests[s] = _fit_shard(*a)
+                if progress:
+                    progress((s + 1) / n_shards, f"{s + 1}/{n_shards} shards")
+        model = _merge(forests)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    score = None
+    if len(held_out) >= 2:
+        score = round(float(model.score(scaler.transform(held_out[:, :-1]), held_out[:, -1])), 4)
+
+    metadata = {
+        'source': 'history',
+        'sources': [os.path.abspath(s) if s != PROFILE_STORE_SOURCE else s for s in sources],
+        'rows': n_rows,
+        'dropped_rows': dropped,
+        'validation_rows': len(held_out),
+        'shards': n_shards,
+        'score': score
+    }
+    predictonmodel.publish_model(model, scaler, metadata)
+    print(f"Model trained on history! Held-out score: {score}")
+    return model, scaler, metadata
@@ -0,0 +1,163 @@
+import cProfile
+import itertools
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds (seconds)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Profile one request in every N with cProfile (0 = off)
+PROFILE_EVERY_N = int(os.environ.get('PROFILE_EVERY_N', '0'))
+
+# Where sampled .prof files are written
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus style"""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.total += 1
+        self.sum += seconds
+
+
+_histograms = {}
+_lock = threading.Lock()
+_request = threading.local()
+_request_counter = itertools.count(1)
+
+
+def observe(metric, labels, seconds):
+    """Record one observation for metric{labels}"""
+    key = (metric, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+
+@contextmanager
+def span(stage):
+    """
+    Time a stage of work, e.g. `with span("model3.kmeans_fit"): ...`
+
+    Recorded into the model_stage_seconds histogram and, inside a request,
+    into that request's Server-Timing header.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        observe('model_stage_seconds', {'stage': stage}, seconds)
+        stages = getattr(_request, 'stages', None)
+        if stages is not None:
+            stages.append((stage, seconds))
+
+
+# ---------------------------------------------------------------------------
+# Request hooks
+# ---------------------------------------------------------------------------
+
+def begin_request():
+    """Start timing a request; returns a cProfile.Profile if this request is sampled"""
+    _request.stages = []
+    _request.start = time.perf_counter()
+    _request.profiler = None
+    if PROFILE_EVERY_N > 0 and next(_request_counter) % PROFILE_EVERY_N == 0:
+        _request.profiler = cProfile.Profile()
+        _request.profiler.enable()
+    return _request.profiler
+
+
+def end_request(endpoint, method, status):
+    """Finish timing a request; returns a Server-Timing header value"""
+    start = getattr(_request, 'start', None)
+    if start is None:
+        return None
+    seconds = time.perf_counter() - start
+
+    profiler = getattr(_request, 'profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        _dump_profile(profiler, endpoint)
+
+    labels = {'endpoint': endpoint or 'unknown', 'method': method, 'status': str(status)}
+    observe('http_request_duration_seconds', labels, seconds)
+
+    stages = _request.stages
+    _request.stages = None
+    _request.start = None
+    _request.profiler = None
+
+    timings = [f'{_token(stage)};dur={s * 1e3:.3f}' for stage, s in stages]
+    timings.append(f'total;dur={seconds * 1e3:.3f}')
+    return ', '.join(timings)
+
+
+def _token(name):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+
+
+def _dump_profile(profiler, endpoint):
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = f"{_token(endpoint or 'unknown')}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{time.monotonic_ns()}.prof"
+        profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+    except OSError as e:
+        print(f"Could not write profile: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Exposition
+# ---------------------------------------------------------------------------
+
+_HELP = {
+    'http_request_duration_seconds': 'Request latency by endpoint',
+    'model_stage_seconds': 'Latency of instrumented processing stages'
+}
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    body = ','.join(f'{k}="{str(v)}"' for k, v in items)
+    return '{' + body + '}'
+
+
+def render_prometheus():
+    """All histograms in the Prometheus text exposition format"""
+    with _lock:
+        snapshot = {
+            key: (list(h.counts), h.total, h.sum) for key, h in _histograms.items()
+        }
+
+    lines = []
+    for metric in sorted({metric for metric, _ in snapshot}):
+        lines.append(f'# HELP {metric} {_HELP.get(metric, metric)}')
+        lines.append(f'# TYPE {metric} histogram')
+        for (name, labels), (counts, total, total_sum) in sorted(snapshot.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{metric}_bucket{_format_labels(labels, [("le", "+Inf")])} {total}')
+            lines.append(f'{metric}_sum{_format_labels(labels)} {total_sum:.6f}')
+            lines.append(f'{metric}_count{_format_labels(labels)} {total}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,219 @@
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+# Training jobs that may run at the same time (one process each)
+MAX_TRAINING_JOBS = int(os.environ.get('MAX_TRAINING_JOBS', '1'))
+
+# Jobs allowed to wait or run before new submissions are rejected
+MAX_QUEUED_JOBS = int(os.environ.get('MAX_QUEUED_JOBS', '4'))
+
+# Cores a single training job may use (RandomForest n_jobs)
+TRAINING_N_JOBS = int(os.environ.get('TRAINING_N_JOBS', '2'))
+
+# Finished jobs kept for status lookups
+MAX_FINISHED_JOBS = 100
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+# ---------------------------------------------------------------------------
+# Job functions (run inside the worker process)
+# ---------------------------------------------------------------------------
+
+_progress_queue = None
+_current_job = None
+
+
+def _init_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def report_progress(progress, message=None):
+    """Send progress (0..1) for the job running in this worker process"""
+    if _progress_queue is not None and _current_job is not None:
+        _progress_queue.put((_current_job, 'running', progress, message))
+
+
+def _retrain_rf(params):
+    import history_training
+    import predictonmodel
+    # callers may ask for fewer cores, never more than TRAINING_N_JOBS (or "all", -1)
+    n_jobs = min(max(1, int(params.get('n_jobs', TRAINING_N_JOBS))), TRAINING_N_JOBS)
+    history = params.get('history', history_training.TRAINING_HISTORY)
+    if history:
+        _, _, metadata = history_training.train_from_history(history, n_jobs=n_jobs, progress=report_progress)
+        return {'model_version': predictonmodel.handle.version, 'training': metadata}
+    predictonmodel.train_model(n_jobs=n_jobs, progress=report_progress)
+    return {'model_version': predictonmodel.handle.version}
+
+
+def _refit_model1(params):
+    import k_selection
+    import model1
+    k = k_selection.parse_k(params.get('k'), 2)
+    report_progress(0.0, 'clustering profiles')
+    result = model1.run_cluster(params.get('profiles'), k)
+    return {key: result[key] for key in ('cluster_summary', 'labels', 'k_selection') if key in result}
+
+
+def _refit_model3(params):
+    import k_selection
+    import model3
+    k = k_selection.parse_k(params.get('k'), None)
+    report_progress(0.0, 'fitting cluster model')
+    model3.fit_cluster_model(params['profiles'], k)
+    return model3.cluster_model_info()
+
+
+def _forecast_daily(params):
+    import forecasting
+    import snapshots
+    if not params.get('history'):
+        raise ValueError("forecast_daily needs 'history': activity CSV path(s)")
+    report_progress(0.0, 'forecasting')
+    result = forecasting.forecast_csv(params['history'], params.get('horizon', 7), params.get('as_of'))
+    columns = forecasting.forecast_columns(result)
+    meta = {
+        'kind': 'daily_forecast',
+        'as_of': str(result.as_of),
+        'horizon': len(result.dates),
+        'users': len(result.user_ids)
+    }
+    return snapshots.write_snapshot(params.get('snapshot', 'daily_forecast'), columns, len(columns['userId']), meta)
+
+
+JOB_TYPES = {
+    'retrain_rf': _retrain_rf,
+    'refit_model1': _refit_model1,
+    'refit_model3': _refit_model3,
+    'forecast_daily': _forecast_daily
+}
+
+
+def _run_job(job_id, job_type, params):
+    global _current_job
+    _current_job = job_id
+    try:
+        report_progress(0.0, 'started')
+        return JOB_TYPES[job_type](params)
+    finally:
+        _current_job = None
+
+
+# ---------------------------------------------------------------------------
+# Job table (lives in the web process)
+# ---------------------------------------------------------------------------
+
+_jobs = OrderedDict()
+_lock = threading.Lock()
+_executor = None
+_progress = None
+
+
+def _get_executor():
+    global _executor, _progress
+    with _lock:
+        if _executor is None:
+            # spawn, not fork: the web process runs threads
+            ctx = multiprocessing.get_context('spawn')
+            _progress = ctx.Queue()
+            _executor = ProcessPoolExecutor(
+                max_workers=MAX_TRAINING_JOBS,
+                mp_context=ctx,
+                initializer=_init_worker,
+                initargs=(_progress,)
+            )
+            threading.Thread(target=_listen_progress, name='job-progress', daemon=True).start()
+        return _executor
+
+
+def _listen_progress():
+    while True:
+        job_id, status, progress, message = _progress.get()
+        with _lock:
+            job = _jobs.get(job_id)
+            if job is None or job['status'] in ('succeeded', 'failed'):
+                continue
+            if job['status'] == 'queued':
+                job['started_at'] = time.time()
+            job['status'] = status
+            job['progress'] = round(progress, 3)
+            if message:
+                job['message'] = message
+
+
+def _on_done(job_id, future):
+    with _lock:
+        job = _jobs[job_id]
+        job['finished_at'] = time.time()
+        try:
+            job['result'] = future.result()
+            job['status'] = 'succeeded'
+            job['progress'] = 1.0
+        except Exception as e:
+            job['status'] = 'failed'
+            job['error'] = str(e)
+            print(f"Job {job_id} ({job['type']}) failed: {e}")
+            traceback.print_exception(e)
+        _trim_finished()
+
+
+def _trim_finished():
+    finished = [jid for jid, job in _jobs.items() if job['status'] in ('succeeded', 'failed')]
+    for jid in finished[:-MAX_FINISHED_JOBS]:
+        del _jobs[jid]
+
+
+def active_jobs():
+    return sum(1 for job in _jobs.values() if job['status'] in ('queued', 'running'))
+
+
+def submit(job_type, params=None):
+    """Queue a job; returns its status record. Raises JobQueueFull or ValueError"""
+    if job_type not in JOB_TYPES:
+        raise ValueError(f"Unknown job type: {job_type}")
+
+    executor = _get_executor()
+    with _lock:
+        if active_jobs() >= MAX_QUEUED_JOBS:
+            raise JobQueueFull(f"{MAX_QUEUED_JOBS} jobs already queued or running")
+
+        job_id = uuid.uuid4().hex
+        _jobs[job_id] = {
+            'id': job_id,
+            'type': job_type,
+            'status': 'queued',
+            'progress': 0.0,
+            'message': None,
+            'submitted_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None
+        }
+        # summary without params: profile payloads can be large
+        job = dict(_jobs[job_id])
+
+    future = executor.submit(_run_job, job_id, job_type, params or {})
+    future.add_done_callback(lambda f: _on_done(job_id, f))
+    return job
+
+
+def get(job_id):
+    with _lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+
+def list_jobs():
+    with _lock:
+        return [dict(job) for job in reversed(_jobs.values())]
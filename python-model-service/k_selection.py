@@ -0,0 +1,214 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Largest k tried by the automatic search (the smallest is 2)
+AUTO_K_MAX = int(os.environ.get('AUTO_K_MAX', '8'))
+
+# Rows sampled from the population for the search
+AUTO_K_SAMPLE = int(os.environ.get('AUTO_K_SAMPLE', '5000'))
+
+# Processes that fit candidate k values in parallel (1 = fit inline)
+AUTO_K_WORKERS = int(os.environ.get('AUTO_K_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# Directory holding chosen k + centroids per dataset fingerprint (shared by workers)
+AUTO_K_CACHE_DIR = os.environ.get('AUTO_K_CACHE_DIR', 'k_selection_cache')
+
+# Chosen k kept in each process
+_MEMORY_ENTRIES = 64
+
+# Rows the silhouette score is computed on (it is quadratic in rows)
+_SILHOUETTE_ROWS = 2000
+
+KChoice = namedtuple('KChoice', ['k', 'centers', 'scores', 'fingerprint', 'cached'])
+
+
+def dataset_fingerprint(X, scope):
+    """
+    Fingerprint of a feature population that only changes when it changes materially.
+
+    Built from the row count on a quarter-power-of-two scale and the 10th,
+    50th and 90th percentile of every feature rounded to two significant
+    digits, so adding a handful of profiles keeps the same fingerprint.
+    """
+    X = np.asarray(X, dtype=float)
+    size_bucket = int(round(np.log2(max(len(X), 1)) * 4))
+    quantiles = np.percentile(X, [10, 50, 90], axis=0) if len(X) else np.zeros((3, X.shape[1]))
+    summary = ','.join(f'{v:.2g}' for v in quantiles.ravel())
+    body = f'{scope}|{X.shape[1]}|{size_bucket}|{summary}'
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()[:16]
+
+
+def _fit_candidate(X, k, random_state):
+    """Fit one k on the (scaled) sample; runs in a pool worker"""
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import silhouette_score
+
+    kmeans = KMeans(n_clusters=k, random_state=random_state, n_init=3).fit(X)
+    if len(np.unique(kmeans.labels_)) > 1:
+        silhouette = float(silhouette_score(
+            X, kmeans.labels_, sample_size=min(len(X), _SILHOUETTE_ROWS), random_state=random_state
+        ))
+    else:
+        silhouette = -1.0
+    return k, float(kmeans.inertia_), silhouette, kmeans.cluster_centers_
+
+
+# ---------------------------------------------------------------------------
+# Process pool
+# ---------------------------------------------------------------------------
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, not fork: the web process runs threads
+            _executor = ProcessPoolExecutor(
+                max_workers=AUTO_K_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _executor
+
+
+def _search(X, k_values, random_state):
+    if AUTO_K_WORKERS > 1 and len(k_values) > 1:
+        executor = _get_executor()
+        futures = [executor.submit(_fit_candidate, X, k, random_state) for k in k_values]
+        return [future.result() for future in futures]
+    return [_fit_candidate(X, k, random_state) for k in k_values]
+
+
+# ---------------------------------------------------------------------------
+# Cache
+# ---------------------------------------------------------------------------
+
+_memory = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+def _cache_path(fingerprint):
+    return os.path.join(AUTO_K_CACHE_DIR, f'{fingerprint}.joblib')
+
+
+def _cache_get(fingerprint):
+    import joblib
+
+    with _memory_lock:
+        entry = _memory.get(fingerprint)
+        if entry is not None:
+            _memory.move_to_end(fingerprint)
+            return entry
+
+    try:
+        entry = joblib.load(_cache_path(fingerprint))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Could not read k selection cache: {e}")
+        return None
+    _cache_remember(fingerprint, entry)
+    return entry
+
+
+def _cache_remember(fingerprint, entry):
+    with _memory_lock:
+        _memory[fingerprint] = entry
+        _memory.move_to_end(fingerprint)
+        while len(_memory) > _MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+
+
+def _cache_set(fingerprint, entry):
+    import joblib
+
+    _cache_remember(fingerprint, entry)
+    try:
+        os.makedirs(AUTO_K_CACHE_DIR, exist_ok=True)
+        tmp_path = f'{_cache_path(fingerprint)}.{os.getpid()}.tmp'
+        joblib.dump(entry, tmp_path)
+        os.replace(tmp_path, _cache_path(fingerprint))
+    except OSError as e:
+        print(f"Could not write k selection cache: {e}")
+
+
+def clear_cache():
+    with _memory_lock:
+        _memory.clear()
+    if os.path.isdir(AUTO_K_CACHE_DIR):
+        for name in os.listdir(AUTO_K_CACHE_DIR):
+            if name.endswith('.joblib'):
+                os.remove(os.path.join(AUTO_K_CACHE_DIR, name))
+
+
+# ---------------------------------------------------------------------------
+# Public API
+# ---------------------------------------------------------------------------
+
+def choose_k(X, scope, k_max=None, random_state=42):
+    """
+    Pick k for clustering the raw feature matrix X by silhouette score.
+
+    Candidates 2..k_max are fitted on a standardized subsample, in parallel
+    across a process pool. The winning k and its centroids (in raw feature
+    space, for use as KMeans init) are cached under the dataset fingerprint,
+    so the search only reruns when the population changes materially.
+    Returns a KChoice.
+    """
+    from sklearn.preprocessing import StandardScaler
+
+    X = np.asarray(X, dtype=float)
+    fingerprint = dataset_fingerprint(X, scope)
+    entry = _cache_get(fingerprint)
+    if entry is not None:
+        return KChoice(entry['k'], entry['centers'], entry['scores'], fingerprint, True)
+
+    if len(X) > AUTO_K_SAMPLE:
+        rows = np.random.default_rng(random_state).choice(len(X), AUTO_K_SAMPLE, replace=False)
+        sample = X[np.sort(rows)]
+    else:
+        sample = X
+
+    k_max = min(k_max or AUTO_K_MAX, len(np.unique(sample, axis=0)) - 1)
+    if k_max < 2:
+        raise ValueError("Need at least 3 distinct profiles to choose k")
+
+    scaler = StandardScaler().fit(sample)
+    results = _search(scaler.transform(sample), list(range(2, k_max + 1)), random_state)
+
+    k, _, _, centers = max(results, key=lambda r: (r[2], -r[0]))
+    scores = [{'k': kk, 'inertia': round(inertia, 4), 'silhouette': round(silhouette, 4)}
+              for kk, inertia, silhouette, _ in sorted(results, key=lambda r: r[0])]
+    entry = {'k': k, 'centers': scaler.inverse_transform(centers), 'scores': scores}
+    _cache_set(fingerprint, entry)
+    return KChoice(k, entry['centers'], scores, fingerprint, False)
+
+
+def describe(choice):
+    """JSON-friendly summary of a KChoice"""
+    return {
+        'k': choice.k,
+        'fingerprint': choice.fingerprint,
+        'cached': choice.cached,
+        'scores': choice.scores
+    }
+
+
+def parse_k(value, default):
+    """A request's k: a positive int, "auto", or default when absent. Raises ValueError"""
+    if value is None:
+        return default
+    if value == 'auto':
+        return value
+    k = int(value)
+    if k < 1:
+        raise ValueError("k must be a positive integer or \"auto\"")
+    return k
@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+
+from instrumentation import span
+
+# Coalesce concurrent single-row RF predictions into one batched call
+MICROBATCH_ENABLED = os.environ.get('RF_MICROBATCH', '1') != '0'
+
+# Most requests predicted in one batch
+MICROBATCH_MAX_SIZE = int(os.environ.get('RF_MICROBATCH_MAX_SIZE', '64'))
+
+# Longest a batch waits for more requests to arrive (milliseconds)
+MICROBATCH_MAX_WAIT_MS = float(os.environ.get('RF_MICROBATCH_MAX_WAIT_MS', '2'))
+
+
+class _Pending:
+    __slots__ = ('payload', 'done', 'result', 'error')
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent calls of a one-payload function into calls of its
+    batch version.
+
+    batch_fn takes a list of payloads and returns one result per payload, in
+    order. Request threads queue their payload; one of them at a time
+    becomes the leader, takes up to max_batch queued payloads, calls
+    batch_fn and hands every waiting thread its own result. Requests that
+    arrive while a batch is running form the next one.
+
+    The wait is adaptive: a leader only lingers (up to max_wait_ms) for more
+    requests when the previous batch had company, so a lone request under
+    light traffic is never delayed.
+    """
+
+    def __init__(self, batch_fn, max_batch=MICROBATCH_MAX_SIZE, max_wait_ms=MICROBATCH_MAX_WAIT_MS,
+                 result_error=None):
+        self.batch_fn = batch_fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        # result -> error message (or None) for per-row failures reported inside results
+        self.result_error = result_error
+        self._queue = []
+        self._running = False
+        self._last_size = 1
+        self._cond = threading.Condition()
+        self._stats = {'requests': 0, 'batches': 0, 'max_batch_size': 0, 'errors': 0}
+
+    def submit(self, payload):
+        """Result of batch_fn for one payload; raises what batch_fn raised (or ValueError for a row error)"""
+        item = _Pending(payload)
+        with self._cond:
+            self._queue.append(item)
+            self._cond.notify_all()
+
+        while True:
+            with self._cond:
+                while not item.done and self._running:
+                    self._cond.wait()
+                if item.done:
+                    break
+                self._running = True
+            try:
+                self._lead()
+            finally:
+                with self._cond:
+                    self._running = False
+                    self._cond.notify_all()
+
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _lead(self):
+        with self._cond:
+            if self._last_size > 1 and self.max_wait > 0:
+                with span("rf.microbatch_wait"):
+                    deadline = time.perf_counter() + self.max_wait
+                    while len(self._queue) < self.max_batch:
+                        remaining = deadline - time.perf_counter()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+            batch = self._queue[:self.max_batch]
+            del self._queue[:self.max_batch]
+
+        try:
+            results = self.batch_fn([item.payload for item in batch])
+            for item, result in zip(batch, results):
+                message = self.result_error(result) if self.result_error else None
+                if message is not None:
+                    item.error = ValueError(message)
+                else:
+                    item.result = result
+        except Exception as e:
+            for item in batch:
+                item.error = e
+
+        with self._cond:
+            for item in batch:
+                item.done = True
+            self._last_size = len(batch)
+            self._stats['requests'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['max_batch_size'] = max(self._stats['max_batch_size'], len(batch))
+            self._stats['errors'] += sum(1 for item in batch if item.error is not None)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats, queued=len(self._queue), max_batch=self.max_batch,
+                         max_wait_ms=self.max_wait * 1000.0)
+        stats['avg_batch_size'] = round(stats['requests'] / stats['batches'], 2) if stats['batches'] else 0.0
+        return stats
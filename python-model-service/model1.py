@@ -1,60 +1,201 @@
+import json
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from instrumentation import span
+from features import FEATURES, add_features, get_pipeline
+import k_selection
+import snapshots
 
-def run_cluster(profiles=None):
-    # profiles can be a list of dicts or None. If None, try read user_profiles.csv.
-    if profiles is None:
-        df = pd.read_csv("user_profiles.csv")
+# rows per chunk when streaming profiles
+CHUNK_SIZE = 10000
+
+
+def prepare_features(df, pipeline=None):
+    # derive and fill the feature columns with the shared pipeline
+    df, _ = add_features(df, pipeline)
+    return df
+
+
+def label_cluster(row):
+    if row["avg_transport_emission_kgCO2"] < 1 and row["avg_electricity_kwh"] < 4:
+        return "Low-Impact / Eco-conscious"
+    elif row["avg_transport_emission_kgCO2"] < 2.5:
+        return "Moderate Lifestyle"
     else:
-        df = pd.DataFrame(profiles)
-    # ensure expected columns exist
-    df["avg_transport_emission_kgCO2"] = df.get("avg_transport_emission_kgCO2",
-        df.get("avg_daily_travel_km", 0) * 0.21)
-    df["avg_waste_generated_kg"] = df.get("avg_waste_generated_kg", np.random.uniform(0.4, 1.5, len(df)))
-    df["avg_purchases_per_day"] = df.get("avg_purchases_per_day", df.get("avg_items_purchased", 0) / 30.0)
-
-    features = [
-        "avg_transport_emission_kgCO2",
-        "avg_electricity_kwh",
-        "avg_lpg_kg",
-        "avg_nonveg_meals",
-        "avg_waste_generated_kg",
-        "avg_purchases_per_day",
-        "avg_renewable_usage"
-    ]
-    # fill missing columns
-    for col in features:
-        if col not in df.columns:
-            df[col] = 0
-
-    X = df[features].fillna(0)
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
+        return "High-Impact / Energy Intensive"
+
+
+def _fit_clusters(X, k):
+    """Standardize X and fit KMeans; returns (cluster ids, KChoice or None)"""
+    with span("model1.scale"):
+        scaler = StandardScaler()
+        X_scaled = scaler.fit_transform(X)
+
+    choice = None
+    if k == "auto":
+        with span("model1.choose_k"):
+            choice = k_selection.choose_k(X, scope=f"model1:{get_pipeline().fingerprint}")
+
+    with span("model1.kmeans_fit"):
+        if choice is None:
+            kmeans = KMeans(n_clusters=k, random_state=42).fit(X_scaled)
+        else:
+            # start from the search's centroids: one init is enough
+            init = scaler.transform(choice.centers)
+            kmeans = KMeans(n_clusters=choice.k, init=init, n_init=1, random_state=42).fit(X_scaled)
+    return kmeans.labels_, choice
+
 
-    # choose k=2 as before; for production you can compute elbow
-    k = 2
-    kmeans = KMeans(n_clusters=k, random_state=42).fit(X_scaled)
-    df["cluster_label"] = kmeans.labels_
+def _summarize(X, cluster_ids):
+    """Per-cluster feature means and sizes, and a label for every cluster"""
+    counts = np.bincount(cluster_ids)
+    sums = np.zeros((len(counts), len(FEATURES)))
+    np.add.at(sums, cluster_ids, X)
 
-    cluster_summary = df.groupby("cluster_label")[features].mean().round(2)
-    cluster_summary["users_in_cluster"] = df["cluster_label"].value_counts().sort_index().values
+    cluster_summary = pd.DataFrame(sums / np.maximum(counts, 1)[:, None], columns=FEATURES).round(2)
+    cluster_summary["users_in_cluster"] = counts
+    cluster_summary.index.name = "cluster_label"
+    cluster_summary = cluster_summary[counts > 0]
 
     labels = {}
     for idx, row in cluster_summary.iterrows():
-        if row["avg_transport_emission_kgCO2"] < 1 and row["avg_electricity_kwh"] < 4:
-            labels[idx] = "Low-Impact / Eco-conscious"
-        elif row["avg_transport_emission_kgCO2"] < 2.5:
-            labels[idx] = "Moderate Lifestyle"
+        labels[int(idx)] = label_cluster(row)
+    return cluster_summary, labels
+
+
+def run_cluster(profiles=None, k=2, columnar=False):
+    # profiles can be a list of dicts, a dict of columns or None. If None, use the snapshot of user_profiles.csv.
+    # k="auto" picks k by silhouette score (see k_selection.choose_k)
+    # columnar=True returns "profiles" as {column: array} instead of per-row dicts
+    with span("model1.build_dataframe"):
+        if profiles is None:
+            # parsed once into a columnar snapshot, not on every call
+            df = snapshots.csv_frame(snapshots.csv_snapshot())
         else:
-            labels[idx] = "High-Impact / Energy Intensive"
+            df = pd.DataFrame(profiles)
+        df, X = add_features(df)
+
+    cluster_ids, choice = _fit_clusters(X, k)
+    df["cluster_label"] = cluster_ids
 
-    df["cluster_label_name"] = df["cluster_label"].map(labels)
+    with span("model1.label"):
+        cluster_summary, labels = _summarize(X, cluster_ids)
+        df["cluster_label_name"] = df["cluster_label"].map(labels)
 
     # return JSON-friendly results
-    return {
+    with span("model1.to_records"):
+        result = {
+            "cluster_summary": cluster_summary.reset_index().to_dict(orient="records"),
+            "profiles": ({col: df[col].to_numpy() for col in df.columns} if columnar
+                         else df.to_dict(orient="records")),
+            "labels": labels
+        }
+    if choice is not None:
+        result["k_selection"] = k_selection.describe(choice)
+    return result
+
+
+def cluster_snapshot(name, k=2, store_labels=True):
+    """
+    Cluster a named profile snapshot straight from its memory-mapped feature columns.
+
+    Per-row results are not returned; with store_labels they are saved
+    into the snapshot as a "cluster_label" column instead.
+    """
+    with span("model1.read_snapshot"):
+        X = snapshots.feature_matrix(name)
+    if len(X) == 0:
+        raise ValueError(f"Snapshot {name} is empty")
+
+    cluster_ids, choice = _fit_clusters(X, k)
+    with span("model1.label"):
+        cluster_summary, labels = _summarize(X, cluster_ids)
+    if store_labels:
+        snapshots.write_columns(name, {"cluster_label": cluster_ids.astype(np.int32)})
+
+    result = {
+        "snapshot": name,
+        "rows": len(X),
         "cluster_summary": cluster_summary.reset_index().to_dict(orient="records"),
-        "profiles": df.to_dict(orient="records"),
         "labels": labels
     }
+    if choice is not None:
+        result["k_selection"] = k_selection.describe(choice)
+    return result
+
+
+def csv_chunks(path="user_profiles.csv", chunksize=CHUNK_SIZE):
+    """Chunk reader for a profiles CSV file"""
+    return lambda: pd.read_csv(path, chunksize=chunksize, dtype={"_id": str, "userId": str})
+
+
+def ndjson_chunks(path, chunksize=CHUNK_SIZE):
+    """Chunk reader for a newline-delimited JSON profiles file"""
+    return lambda: pd.read_json(path, lines=True, chunksize=chunksize, dtype=False, convert_dates=False)
+
+
+def _feature_chunks(read_chunks, pipeline):
+    # one pipeline for every pass, so each pass sees the same features
+    for chunk in read_chunks():
+        yield add_features(chunk, pipeline)
+
+
+def run_cluster_stream(read_chunks, k=2):
+    """
+    Cluster profiles chunk by chunk and yield NDJSON lines.
+
+    read_chunks is a callable returning a fresh iterator of DataFrame chunks
+    (see csv_chunks / ndjson_chunks); it is read three times: to fit the
+    scaler, to fit a MiniBatchKMeans, and to label rows. Peak memory is
+    bounded by the chunk size. Labelled profiles are yielded one JSON line
+    per row, followed by a final line with the cluster summary and labels.
+    """
+    pipeline = get_pipeline()
+    scaler = StandardScaler()
+    for _, X in _feature_chunks(read_chunks, pipeline):
+        scaler.partial_fit(X)
+
+    kmeans = MiniBatchKMeans(n_clusters=k, random_state=42)
+    # partial_fit needs at least k rows in a batch: a batch is fitted only once
+    # the next one is complete, so a short tail can still be merged into it
+    seen = np.empty((0, len(FEATURES)))
+    pending = None
+    for _, X in _feature_chunks(read_chunks, pipeline):
+        seen = np.vstack([seen, scaler.transform(X)])
+        if len(seen) >= k:
+            if pending is not None:
+                kmeans.partial_fit(pending)
+            pending, seen = seen, seen[:0]
+    if len(seen):
+        pending = seen if pending is None else np.vstack([pending, seen])
+    if pending is not None and len(pending) >= k:
+        kmeans.partial_fit(pending)
+    if not hasattr(kmeans, "cluster_centers_"):
+        raise ValueError(f"Need at least {k} profiles to cluster")
+
+    centroids = pd.DataFrame(scaler.inverse_transform(kmeans.cluster_centers_), columns=FEATURES)
+    labels = {idx: label_cluster(row) for idx, row in centroids.iterrows()}
+
+    sums = np.zeros((k, len(FEATURES)))
+    counts = np.zeros(k, dtype=int)
+    for df, X in _feature_chunks(read_chunks, pipeline):
+        cluster_ids = kmeans.predict(scaler.transform(X))
+        np.add.at(sums, cluster_ids, X)
+        counts += np.bincount(cluster_ids, minlength=k)
+
+        df["cluster_label"] = cluster_ids
+        df["cluster_label_name"] = df["cluster_label"].map(labels)
+        if len(df):
+            yield df.to_json(orient="records", lines=True).rstrip("\n") + "\n"
+
+    summary = pd.DataFrame(sums / np.maximum(counts, 1)[:, None], columns=FEATURES).round(2)
+    summary["users_in_cluster"] = counts
+    summary.index.name = "cluster_label"
+    summary = summary[counts > 0]
+
+    yield json.dumps({
+        "cluster_summary": summary.reset_index().to_dict(orient="records"),
+        "labels": labels
+    }, default=lambda v: v.item()) + "\n"
@@ -1,6 +1,4 @@
-import pandas as pd
 import numpy as np
-from datetime import datetime
 
 TRANSPORT_EMISSION = {
     "Car": 0.21,
@@ -23,6 +21,8 @@ COOKING_EMISSION_PER_DAY = {
 WASTE_EMISSION_PER_KG = 1.8
 FIXED_COST = 150
 COST_PER_KWH = 8
+# Bump whenever a factor above changes so cached results are invalidated
+MODEL_VERSION = 1
 
 def compute_daily_emission(payload):
     # payload example:
@@ -70,3 +70,103 @@ def compute_daily_emission(payload):
         "category": cat,
         "total_emission_kgCO2": round(total, 3)
     }
+
+
+BATCH_CATEGORY_CODES = {
+    "Transport": 0,
+    "Electricity": 1,
+    "Cooking": 2,
+    "Waste": 3,
+    "Shopping": 4,
+    "Water": 5
+}
+
+
+def _lookup(table, keys, default):
+    """Vectorized dict lookup: map an array of keys to their table values"""
+    uniq, inverse = np.unique(np.asarray(keys, dtype=str), return_inverse=True)
+    values = np.array([table.get(k, default) for k in uniq], dtype=float)
+    return values[inverse]
+
+
+def _column(details, idx, key, default, cast, errors):
+    """Gather one detail field for the rows in idx as a float array"""
+    raw = [details[i].get(key, default) for i in idx]
+    try:
+        return np.fromiter((cast(v) for v in raw), dtype=float, count=len(raw))
+    except (TypeError, ValueError):
+        out = np.zeros(len(raw))
+        for j, v in enumerate(raw):
+            try:
+                out[j] = cast(v)
+            except (TypeError, ValueError) as e:
+                errors[idx[j]] = str(e)
+        return out
+
+
+def compute_daily_emissions_batch(payloads):
+    """
+    Compute daily emissions for many activities at once.
+
+    Takes a list of payloads shaped like compute_daily_emission's and returns
+    results in the same order. Each category is computed for all of its rows
+    with NumPy column operations; rows that fail to parse get an "error".
+    """
+    n = len(payloads)
+    payloads = [p if isinstance(p, dict) else {} for p in payloads]
+    categories = [p.get("category") for p in payloads]
+    details = [p.get("details") or {} for p in payloads]
+    codes = np.fromiter(
+        (BATCH_CATEGORY_CODES.get(c, -1) if isinstance(c, str) else -1 for c in categories),
+        dtype=np.int8, count=n
+    )
+    totals = np.zeros(n)
+    errors = {}
+    for i, d in enumerate(details):
+        if not isinstance(d, dict):
+            errors[i] = "details must be an object"
+            details[i] = {}
+
+    idx = np.flatnonzero(codes == 0)  # Transport
+    if idx.size:
+        dist = _column(details, idx, "distance_travelled_km", 0, float, errors)
+        modes = [details[i].get("transport_mode", "Car") for i in idx]
+        totals[idx] = dist * _lookup(TRANSPORT_EMISSION, modes, 0)
+
+    idx = np.flatnonzero(codes == 1)  # Electricity
+    if idx.size:
+        bill = _column(details, idx, "electricity_bill", 0, float, errors)
+        days = _column(details, idx, "days_in_month", 30, int, errors)
+        for i in idx[days == 0]:
+            errors[i] = "division by zero"
+        variable = np.maximum(0, bill - FIXED_COST)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            kwh_per_day = (variable / COST_PER_KWH) / days
+        sources = [details[i].get("electricity_source", "State Grid") for i in idx]
+        totals[idx] = kwh_per_day * _lookup(GRID_EMISSION_KG_PER_KWH, sources, 0.82)
+
+    idx = np.flatnonzero(codes == 2)  # Cooking
+    if idx.size:
+        fuels = [details[i].get("cooking_fuel_type", "LPG") for i in idx]
+        totals[idx] = _lookup(COOKING_EMISSION_PER_DAY, fuels, 0)
+
+    idx = np.flatnonzero(codes == 3)  # Waste
+    if idx.size:
+        totals[idx] = _column(details, idx, "daily_waste_generated_kg", 0, float, errors) * WASTE_EMISSION_PER_KG
+
+    idx = np.flatnonzero(codes == 4)  # Shopping
+    if idx.size:
+        # crude mapping: 1 kg CO2 per ₹500 spent (example)
+        totals[idx] = _column(details, idx, "purchase_amount", 0, float, errors) / 500.0
+
+    idx = np.flatnonzero(codes == 5)  # Water
+    if idx.size:
+        totals[idx] = _column(details, idx, "liters", 0, float, errors) * 0.0005
+
+    results = [
+        {"category": cat, "total_emission_kgCO2": total}
+        for cat, total in zip(categories, totals.round(3).tolist())
+    ]
+    for i, message in errors.items():
+        results[i] = {"index": int(i), "category": categories[i], "error": message}
+    return results
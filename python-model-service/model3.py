@@ -2,10 +2,33 @@ from flask import Flask, request, jsonify
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from datetime import datetime, timezone
+import threading
+import copy
+import fcntl
+import joblib
+import os
+from collections import namedtuple
+from contextlib import contextmanager
+from instrumentation import span
+import features
+from features import FEATURES
+import k_selection
+import snapshots
 
 app = Flask(__name__)
 
+# Persisted cluster model (scaler + centroids + label map)
+CLUSTER_MODEL_PATH = os.environ.get('MODEL3_CLUSTER_PATH', 'model3_cluster.pkl')
+
+# Per-row cluster assignments as arrays, plus an id -> row position index
+ClusterLabels = namedtuple('ClusterLabels', ['cluster_ids', 'label_names', 'index', 'labels', 'version'])
+
+# Global variables
+cluster_model = None
+_cluster_lock = threading.RLock()
+
 def get_recommendations(label_name):
     suggestions = {
         "Low-Impact / Eco-conscious": [
@@ -27,64 +50,351 @@ def get_recommendations(label_name):
     return suggestions.get(label_name, ["Recommendation unavailable."])
 
 
-def run_cluster(profiles):
+def label_cluster(row):
+    """Map a cluster's mean feature values to a human readable label"""
+    if row["avg_transport_emission_kgCO2"] < 1 and row["avg_electricity_kwh"] < 4:
+        return "Low-Impact / Eco-conscious"
+    elif row["avg_transport_emission_kgCO2"] < 2.5:
+        return "Moderate Lifestyle"
+    else:
+        return "High-Impact / Energy Intensive"
+
+
+def prepare_features(profiles, pipeline=None):
+    """Build the model3 feature frame from a list of profile dicts"""
     df = pd.DataFrame(profiles)
     
     # Convert MongoDB _id to string for matching
     if '_id' in df.columns:
         df['_id'] = df['_id'].astype(str)
     
-    # Calculate derived fields with safe defaults
-    df["avg_transport_emission_kgCO2"] = df.get("avg_daily_travel_km", pd.Series([0]*len(df))) * 0.21
-    df["avg_waste_generated_kg"] = np.random.uniform(0.4, 1.5, len(df))
-    df["avg_purchases_per_day"] = df.get("avg_items_purchased", pd.Series([0]*len(df))) / 30.0
-    df["avg_renewable_usage"] = 0  # Default to 0 if not provided
-
-    features = [
-        "avg_transport_emission_kgCO2",
-        "avg_electricity_kwh",
-        "avg_lpg_kg",
-        "avg_nonveg_meals",
-        "avg_waste_generated_kg",
-        "avg_purchases_per_day",
-        "avg_renewable_usage"
-    ]
-
-    # Ensure all features exist
-    for col in features:
+    # Derived fields and defaults come from the shared feature pipeline
+    df, _ = features.add_features(df, pipeline)
+    return df
+
+
+def build_id_index(df):
+    """
+    Map every row's _id and userId (as strings) to its row position.
+
+    Where a key appears more than once the first row wins, as with a
+    front-to-back scan comparing both fields.
+    """
+    index = {}
+    for col in ('_id', 'userId'):
         if col not in df.columns:
-            df[col] = 0
-
-    X = df[features].fillna(0)
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
-
-    # Use 2 or 3 clusters depending on data size
-    n_clusters = min(3, len(df))
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42).fit(X_scaled)
-    df["cluster_label"] = kmeans.labels_
-
-    cluster_summary = df.groupby("cluster_label")[features].mean().round(2)
-    cluster_summary["users_in_cluster"] = df["cluster_label"].value_counts().sort_index().values
-
-    # Assign labels based on cluster characteristics
-    labels = {}
-    for idx, row in cluster_summary.iterrows():
-        if row["avg_transport_emission_kgCO2"] < 1 and row["avg_electricity_kwh"] < 4:
-            labels[idx] = "Low-Impact / Eco-conscious"
-        elif row["avg_transport_emission_kgCO2"] < 2.5:
-            labels[idx] = "Moderate Lifestyle"
+            continue
+        keys = df[col].dropna().astype(str)
+        keys = keys[~keys.duplicated()]
+        for key, pos in zip(keys.tolist(), keys.index.tolist()):
+            if index.get(key, pos) >= pos:
+                index[key] = pos
+    return index
+
+
+def _n_clusters(X, k, scope, pipeline=None):
+    """Resolve k (None = 2 or 3 depending on data size, "auto" = search); returns (k, KChoice or None)"""
+    if k == "auto":
+        with span("model3.choose_k"):
+            pipeline = pipeline or features.get_pipeline()
+            choice = k_selection.choose_k(X, scope=f"{scope}:{pipeline.fingerprint}")
+        return choice.k, choice
+    if k is None:
+        return min(3, len(X)), None
+    return min(k, len(X)), None
+
+
+def _cluster_frame(profiles, k=None):
+    """Fit a fresh clustering on profiles; returns the labelled frame, the label map and any KChoice"""
+    with span("model3.build_dataframe"):
+        df = prepare_features(profiles)
+
+    with span("model3.scale"):
+        X = df[FEATURES]
+        scaler = StandardScaler()
+        X_scaled = scaler.fit_transform(X)
+
+    # Use 2 or 3 clusters depending on data size, unless k is given
+    n_clusters, choice = _n_clusters(X.to_numpy(dtype=float), k, "model3")
+    with span("model3.kmeans_fit"):
+        if choice is None:
+            kmeans = KMeans(n_clusters=n_clusters, random_state=42).fit(X_scaled)
         else:
-            labels[idx] = "High-Impact / Energy Intensive"
+            init = scaler.transform(pd.DataFrame(choice.centers, columns=FEATURES))
+            kmeans = KMeans(n_clusters=n_clusters, init=init, n_init=1, random_state=42).fit(X_scaled)
+        df["cluster_label"] = kmeans.labels_
+
+    with span("model3.label"):
+        cluster_summary = df.groupby("cluster_label")[FEATURES].mean().round(2)
+        cluster_summary["users_in_cluster"] = df["cluster_label"].value_counts().sort_index().values
+
+        # Assign labels based on cluster characteristics
+        labels = {}
+        for idx, row in cluster_summary.iterrows():
+            labels[idx] = label_cluster(row)
+
+        df["cluster_label_name"] = df["cluster_label"].map(labels)
+
+    return df, labels, choice
 
-    df["cluster_label_name"] = df["cluster_label"].map(labels)
+
+def run_cluster(profiles, k=None, columnar=False):
+    df, labels, _ = _cluster_frame(profiles, k)
+    
+    if columnar:
+        return {col: df[col].to_numpy() for col in df.columns}, labels
     
     # Convert to list of dicts for JSON response
-    result = df.to_dict('records')
+    with span("model3.to_records"):
+        result = df.to_dict('records')
     
     return result, labels
 
 
+def cluster_labels(profiles, k=None):
+    """Like run_cluster, but returns ClusterLabels arrays instead of per-row dicts"""
+    df, labels, _ = _cluster_frame(profiles, k)
+    with span("model3.index"):
+        index = build_id_index(df)
+    return ClusterLabels(
+        cluster_ids=df["cluster_label"].to_numpy(),
+        label_names=df["cluster_label_name"].to_numpy(),
+        index=index,
+        labels=labels,
+        version=None
+    )
+
+
+# ---------------------------------------------------------------------------
+# Persisted cluster model
+#
+# Recommending a single user only needs that user's profile and a
+# nearest-centroid lookup against a stored model. The model is refitted
+# explicitly (fit_cluster_model) or updated incrementally (partial_fit_cluster_model).
+# ---------------------------------------------------------------------------
+
+def _label_centroids(scaler, kmeans):
+    """Label every centroid from its position in the original feature space"""
+    centroids = pd.DataFrame(
+        scaler.inverse_transform(kmeans.cluster_centers_), columns=FEATURES
+    )
+    return {int(idx): label_cluster(row) for idx, row in centroids.iterrows()}
+
+
+def _feature_matrix(profiles, pipeline=None):
+    df = prepare_features(profiles, pipeline)
+    return df, df[FEATURES].to_numpy(dtype=float)
+
+
+def save_cluster_model(state, path=None):
+    """Write the cluster model atomically (write to a temp file, then rename)"""
+    path = path or CLUSTER_MODEL_PATH
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_cluster_model(path=None):
+    """Load the stored cluster model, or None if it has not been fitted yet"""
+    global cluster_model
+    path = path or CLUSTER_MODEL_PATH
+
+    try:
+        state = joblib.load(path)
+    except FileNotFoundError:
+        return None
+    cluster_model = state
+    return state
+
+
+def get_cluster_model():
+    """Return the in-process cluster model, reloading it if another process saved a newer version"""
+    try:
+        mtime = os.path.getmtime(CLUSTER_MODEL_PATH)
+    except FileNotFoundError:
+        return cluster_model
+
+    if cluster_model is None or cluster_model.get("mtime") != mtime:
+        with _cluster_lock:
+            if cluster_model is None or cluster_model.get("mtime") != mtime:
+                # None if the file was removed since its mtime was read
+                state = load_cluster_model()
+                if state is not None:
+                    state["mtime"] = mtime
+    return cluster_model
+
+
+@contextmanager
+def _write_lock():
+    """
+    Serialize cluster model updates across threads and worker processes.
+
+    Held from reading the stored model to storing the new one, so an update
+    always starts from the latest stored version.
+    """
+    with _cluster_lock, open(f"{CLUSTER_MODEL_PATH}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _store(scaler, kmeans, n_samples, pipeline, k_choice=None):
+    """Store a new version of the cluster model (call under _write_lock)"""
+    global cluster_model
+    # the version follows the stored model, which another worker may have written
+    previous = get_cluster_model() or {}
+    state = {
+        "version": previous.get("version", 0) + 1,
+        "fitted_at": datetime.now(timezone.utc).isoformat(),
+        "n_samples": n_samples,
+        "pipeline": pipeline,
+        "scaler": scaler,
+        "kmeans": kmeans,
+        "labels": _label_centroids(scaler, kmeans),
+        "k_selection": k_selection.describe(k_choice) if k_choice else previous.get("k_selection"),
+    }
+    save_cluster_model(state)
+    state["mtime"] = os.path.getmtime(CLUSTER_MODEL_PATH)
+    cluster_model = state
+    return state
+
+
+def fit_cluster_model(profiles, k=None):
+    """
+    Refit the feature pipeline and the stored cluster model from scratch on the full profile set.
+
+    k defaults to 2 or 3 depending on data size; k="auto" searches for it.
+    """
+    df = pd.DataFrame(profiles)
+    if len(df) == 0:
+        raise ValueError("No profiles provided")
+    pipeline = features.fit_pipeline(df)
+    _, X = _feature_matrix(df, pipeline)
+    return _fit_matrix(X, pipeline, k)
+
+
+def fit_cluster_model_from_snapshot(name, k=None):
+    """Refit the stored cluster model from a profile snapshot's feature columns"""
+    info = snapshots.snapshot_info(name)
+    if info is None:
+        raise LookupError(f"Unknown snapshot: {name}")
+    pipeline = features.get_pipeline()
+    if info.get("feature_pipeline") != pipeline.fingerprint:
+        raise ValueError(f"Snapshot {name} was taken with a different feature pipeline; re-create it")
+    return _fit_matrix(snapshots.feature_matrix(name), pipeline, k)
+
+
+def _fit_matrix(X, pipeline, k=None):
+    if len(X) == 0:
+        raise ValueError("No profiles provided")
+
+    n_clusters, choice = _n_clusters(X, k, "model3.stored", pipeline)
+    with _write_lock(), span("model3.kmeans_fit"):
+        scaler = StandardScaler().fit(X)
+        if choice is None:
+            kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3)
+        else:
+            init = scaler.transform(choice.centers)
+            kmeans = MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init=1, random_state=42)
+        kmeans.fit(scaler.transform(X))
+        return _store(scaler, kmeans, len(X), pipeline, choice)
+
+
+def partial_fit_cluster_model(profiles):
+    """
+    Update the stored cluster model with newly arrived profiles
+
+    The scaler stays as fitted: the centroids live in its scaled space, so
+    moving it would shift every assignment. The centroids are updated on a
+    copy that replaces the live model only once it is stored; a full refit
+    (fit_cluster_model) is what re-fits the scaler.
+    """
+    with _write_lock():
+        # the latest stored model, whichever worker wrote it
+        state = get_cluster_model()
+        if state is not None:
+            pipeline = state.get("pipeline") or features.get_pipeline()
+            _, X = _feature_matrix(profiles, pipeline)
+            if len(X) == 0:
+                raise ValueError("No profiles provided")
+            scaler = state["scaler"]
+            # assign_clusters reads the live state without the lock
+            kmeans = copy.deepcopy(state["kmeans"])
+            kmeans.partial_fit(scaler.transform(X))
+            return _store(scaler, kmeans, state["n_samples"] + len(X), pipeline)
+
+    return fit_cluster_model(profiles)
+
+
+def assign_clusters(profiles):
+    """Assign profiles to the nearest stored centroid without refitting"""
+    state = get_cluster_model()
+    if state is None:
+        raise LookupError("Cluster model has not been fitted yet")
+
+    with span("model3.build_dataframe"):
+        df, X = _feature_matrix(profiles, state.get("pipeline"))
+    with span("model3.assign"):
+        cluster_ids = state["kmeans"].predict(state["scaler"].transform(X))
+    df["cluster_label"] = cluster_ids
+    df["cluster_label_name"] = [state["labels"][int(c)] for c in cluster_ids]
+    return df
+
+
+def assign_cluster_labels(profiles, fit_if_missing=False):
+    """
+    Assign profiles to the stored centroids and return ClusterLabels arrays.
+
+    Callers pick rows out through the id index, so no per-row dicts are
+    built. With fit_if_missing the stored model is first fitted from these
+    profiles if there is none yet, reusing the same feature matrix.
+    """
+    state = get_cluster_model()
+    if state is None and not fit_if_missing:
+        raise LookupError("Cluster model has not been fitted yet")
+
+    with span("model3.build_dataframe"):
+        df = pd.DataFrame(profiles)
+        pipeline = state.get("pipeline") if state else features.fit_pipeline(df)
+        df, X = _feature_matrix(df, pipeline)
+
+    if state is None:
+        state = _fit_matrix(X, pipeline)
+
+    with span("model3.assign"):
+        cluster_ids = state["kmeans"].predict(state["scaler"].transform(X))
+        names = np.array([state["labels"][i] for i in range(len(state["labels"]))], dtype=object)
+    with span("model3.index"):
+        index = build_id_index(df)
+
+    return ClusterLabels(
+        cluster_ids=cluster_ids,
+        label_names=names[cluster_ids],
+        index=index,
+        labels=state["labels"],
+        version=state["version"]
+    )
+
+
+def cluster_model_info():
+    """Describe the stored cluster model (without the fitted estimators)"""
+    state = get_cluster_model()
+    if state is None:
+        return None
+
+    return {
+        "version": state["version"],
+        "fitted_at": state["fitted_at"],
+        "n_samples": state["n_samples"],
+        "n_clusters": int(state["kmeans"].n_clusters),
+        "labels": state["labels"],
+        "feature_pipeline": state["pipeline"].fingerprint if state.get("pipeline") else None,
+        "k_selection": state.get("k_selection"),
+    }
+
+
 @app.route("/model3/cluster", methods=["POST"])
 def cluster():
     try:
@@ -116,23 +426,20 @@ def recommend():
         if not profiles:
             return jsonify({"error": "No profiles provided"}), 400
 
-        clustered_profiles, _ = run_cluster(profiles)
+        result = cluster_labels(profiles)
         
         # Find user in results
-        user_row = None
-        for profile in clustered_profiles:
-            if str(profile.get('_id')) == str(userId) or str(profile.get('userId')) == str(userId):
-                user_row = profile
-                break
+        row = result.index.get(str(userId))
         
-        if not user_row:
+        if row is None:
             return jsonify({"error": "User not found in clustering results"}), 404
 
-        recommendations = get_recommendations(user_row["cluster_label_name"])
+        cluster_name = result.label_names[row]
+        recommendations = get_recommendations(cluster_name)
 
         return jsonify({
             "userId": userId,
-            "cluster": user_row["cluster_label_name"],
+            "cluster": cluster_name,
             "recommendations": recommendations
         })
     
@@ -0,0 +1,200 @@
+import json
+import os
+import shutil
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import joblib
+
+# Root directory for versioned model artifacts
+REGISTRY_DIR = os.environ.get('MODEL_REGISTRY_DIR', 'model_registry')
+
+# Versions kept on disk when a new one is published (at least 2: a worker may
+# still be loading the previous one)
+KEEP_VERSIONS = max(2, int(os.environ.get('MODEL_REGISTRY_KEEP', '5')))
+
+# How often (seconds) a handle checks whether another process published a new version
+REFRESH_SECONDS = float(os.environ.get('MODEL_REFRESH_SECONDS', '2'))
+
+POINTER_FILE = 'CURRENT'
+META_FILE = 'meta.json'
+
+LoadedModel = namedtuple('LoadedModel', ['version', 'artifacts', 'meta'])
+
+
+class ModelRegistry:
+    """
+    Versioned model artifacts on disk.
+
+    Layout:
+        <root>/<name>/v000001/<artifact>.joblib + meta.json
+        <root>/<name>/CURRENT  -> "1"
+
+    A version directory is written under a temporary name and renamed into
+    place, then CURRENT is replaced atomically, so readers only ever see
+    complete versions.
+    """
+
+    def __init__(self, name, root=None, mmap_artifacts=()):
+        self.name = name
+        self.root = os.path.join(root or REGISTRY_DIR, name)
+        # artifacts whose NumPy arrays are memory-mapped read-only on load
+        self.mmap_artifacts = set(mmap_artifacts)
+        self._lock = threading.Lock()
+
+    def _version_dir(self, version):
+        return os.path.join(self.root, f'v{version:06d}')
+
+    @property
+    def pointer_path(self):
+        return os.path.join(self.root, POINTER_FILE)
+
+    def versions(self):
+        """All published versions, oldest first"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            int(entry[1:]) for entry in os.listdir(self.root)
+            if entry.startswith('v') and entry[1:].isdigit()
+        )
+
+    def current_version(self):
+        """The version CURRENT points at, or None if nothing is published"""
+        try:
+            with open(self.pointer_path) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def publish(self, artifacts, metadata=None):
+        """Write artifacts as a new version and make it current; returns the version"""
+        os.makedirs(self.root, exist_ok=True)
+
+        with self._lock:
+            tmp_dir = os.path.join(self.root, f'.tmp-{os.getpid()}-{threading.get_ident()}')
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+
+            meta = dict(metadata or {})
+            meta.update(
+                name=self.name,
+                artifacts=sorted(artifacts),
+                created_at=datetime.now(timezone.utc).isoformat()
+            )
+            for key, obj in artifacts.items():
+                joblib.dump(obj, os.path.join(tmp_dir, f'{key}.joblib'))
+
+            # claim the next free version number; rename fails if another
+            # process got there first, in which case try the next one
+            version = (self.versions() or [0])[-1] + 1
+            while True:
+                meta['version'] = version
+                with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+                    json.dump(meta, f, indent=2)
+                try:
+                    os.rename(tmp_dir, self._version_dir(version))
+                    break
+                except OSError:
+                    if not os.path.isdir(self._version_dir(version)):
+                        raise
+                    version += 1
+
+            self._set_current(version)
+            return version
+
+    def _set_current(self, version):
+        tmp_pointer = f'{self.pointer_path}.{os.getpid()}.tmp'
+        with open(tmp_pointer, 'w') as f:
+            f.write(str(version))
+        os.replace(tmp_pointer, self.pointer_path)
+
+    def activate(self, version):
+        """Point CURRENT at an existing version (e.g. to roll back)"""
+        if not os.path.isdir(self._version_dir(version)):
+            raise ValueError(f'Unknown {self.name} version: {version}')
+        self._set_current(version)
+
+    def metadata(self, version):
+        """Read a version's meta.json"""
+        with open(os.path.join(self._version_dir(version), META_FILE)) as f:
+            return json.load(f)
+
+    def load(self, version=None):
+        """Load a version (default: current) as a LoadedModel"""
+        version = version or self.current_version()
+        if version is None:
+            return None
+
+        version_dir = self._version_dir(version)
+        meta = self.metadata(version)
+        artifacts = {
+            key: joblib.load(
+                os.path.join(version_dir, f'{key}.joblib'),
+                mmap_mode='r' if key in self.mmap_artifacts else None
+            )
+            for key in meta['artifacts']
+        }
+        return LoadedModel(version, artifacts, meta)
+
+    def prune(self, keep=None):
+        """Delete all but the newest `keep` versions (default KEEP_VERSIONS; never the current one)"""
+        keep = KEEP_VERSIONS if keep is None else max(1, keep)
+        current = self.current_version()
+        for version in self.versions()[:-keep]:
+            if version != current:
+                shutil.rmtree(self._version_dir(version), ignore_errors=True)
+
+
+class ModelHandle:
+    """
+    In-process handle to the current version of a registry model.
+
+    get() returns an immutable LoadedModel snapshot, so callers always use
+    artifacts from one version together. Swapping to a new version is a
+    single reference assignment. New versions published by other processes
+    are noticed by polling CURRENT and loaded in a background thread while
+    requests keep using the previous snapshot.
+    """
+
+    def __init__(self, registry, refresh_seconds=None):
+        self.registry = registry
+        self.refresh_seconds = REFRESH_SECONDS if refresh_seconds is None else refresh_seconds
+        self._current = None
+        self._last_check = 0.0
+        self._loading = threading.Lock()
+
+    def get(self):
+        """Current snapshot, or None if nothing has been published or loaded"""
+        current = self._current
+        if current is None:
+            return self.refresh()
+
+        now = time.monotonic()
+        if now - self._last_check >= self.refresh_seconds:
+            self._last_check = now
+            latest = self.registry.current_version()
+            if latest is not None and latest != current.version and not self._loading.locked():
+                threading.Thread(target=self.refresh, daemon=True).start()
+        return current
+
+    def refresh(self):
+        """Load the registry's current version synchronously if it changed"""
+        with self._loading:
+            latest = self.registry.current_version()
+            if latest is not None and (self._current is None or self._current.version != latest):
+                self._current = self.registry.load(latest)
+                print(f"Loaded {self.registry.name} model version {latest}")
+            self._last_check = time.monotonic()
+            return self._current
+
+    def set(self, loaded):
+        """Swap in a snapshot that was just published by this process"""
+        self._current = loaded
+        self._last_check = time.monotonic()
+
+    @property
+    def version(self):
+        current = self._current
+        return current.version if current else None
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Entries kept in each process
+CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', '10000'))
+
+# Seconds an entry stays valid
+CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', '300'))
+
+# Optional sqlite file shared by all workers on the host (unset = in-process only)
+CACHE_SQLITE = os.environ.get('PREDICTION_CACHE_SQLITE')
+
+CACHE_ENABLED = os.environ.get('PREDICTION_CACHE', '1') != '0'
+
+# Run sqlite housekeeping (expire + trim) once every this many writes
+_SQLITE_SWEEP_EVERY = 500
+
+
+def canonical_key(namespace, version, payload):
+    """Stable key for a payload: same JSON content -> same key, whatever the key order"""
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    digest = hashlib.sha1(body.encode('utf-8')).hexdigest()
+    return f'{namespace}:{version}:{digest}'
+
+
+class PredictionCache:
+    """
+    Bounded LRU + TTL cache for deterministic prediction results.
+
+    Keys combine a namespace (endpoint), the model version and the
+    canonicalized payload, so a new model version never serves stale
+    results; when a newer version shows up for a namespace, that
+    namespace's old entries are dropped. With sqlite_path set, misses fall
+    through to a sqlite table shared by every worker on the host.
+    """
+
+    def __init__(self, max_entries=CACHE_SIZE, ttl_seconds=CACHE_TTL, sqlite_path=CACHE_SQLITE):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.sqlite_path = sqlite_path
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self._stats = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0, 'invalidations': 0}
+
+    # -- sqlite backend --------------------------------------------------
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.sqlite_path, timeout=1.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS prediction_cache '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._local.conn = conn
+        return conn
+
+    def _shared_get(self, key, now):
+        try:
+            row = self._db().execute(
+                'SELECT value FROM prediction_cache WHERE key = ? AND expires_at > ?', (key, now)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Prediction cache sqlite read failed: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def _shared_set(self, key, value, expires_at):
+        try:
+            db = self._db()
+            db.execute(
+                'INSERT OR REPLACE INTO prediction_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), expires_at)
+            )
+            self._writes += 1
+            if self._writes % _SQLITE_SWEEP_EVERY == 0:
+                db.execute('DELETE FROM prediction_cache WHERE expires_at <= ?', (time.time(),))
+                db.execute(
+                    'DELETE FROM prediction_cache WHERE key IN (SELECT key FROM prediction_cache '
+                    'ORDER BY expires_at DESC LIMIT -1 OFFSET ?)', (self.max_entries,)
+                )
+        except sqlite3.Error as e:
+            print(f"Prediction cache sqlite write failed: {e}")
+
+    # -- public API ------------------------------------------------------
+
+    def _check_version(self, namespace, version):
+        # a newer model version makes every older entry in the namespace unreachable
+        if self._versions.get(namespace) != version:
+            if namespace in self._versions:
+                prefix = f'{namespace}:'
+                for key in [k for k in self._entries if k.startswith(prefix)]:
+                    del self._entries[key]
+                self._stats['invalidations'] += 1
+            self._versions[namespace] = version
+
+    def get(self, namespace, version, payload):
+        """Cached value, or None on a miss"""
+        key = canonical_key(namespace, version, payload)
+        now = time.time()
+
+        with self._lock:
+            self._check_version(namespace, version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return value
+                del self._entries[key]
+                self._stats['expired'] += 1
+
+        if self.sqlite_path:
+            value = self._shared_get(key, now)
+            if value is not None:
+                with self._lock:
+                    self._stats['shared_hits'] += 1
+                    self._store(key, value, now + self.ttl_seconds)
+                return value
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def _store(self, key, value, expires_at):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def set(self, namespace, version, payload, value):
+        key = canonical_key(namespace, version, payload)
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._check_version(namespace, version)
+            self._store(key, value, expires_at)
+        if self.sqlite_path:
+            self._shared_set(key, value, expires_at)
+
+    def clear(self, namespace=None):
+        """Drop cached entries (all, or one namespace)"""
+        with self._lock:
+            if namespace is None:
+                self._entries.clear()
+            else:
+                prefix = f'{namespace}:'
+                for key in [k for k in self._entries if k.startswith(prefix)]:
+                    del self._entries[key]
+        if self.sqlite_path:
+            try:
+                if namespace is None:
+                    self._db().execute('DELETE FROM prediction_cache')
+                else:
+                    self._db().execute('DELETE FROM prediction_cache WHERE key LIKE ?', (f'{namespace}:%',))
+            except sqlite3.Error as e:
+                print(f"Prediction cache sqlite clear failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['shared_hits'] + self._stats['misses']
+            return {
+                **self._stats,
+                'hit_rate': round((self._stats['hits'] + self._stats['shared_hits']) / lookups, 4) if lookups else None,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'shared_backend': self.sqlite_path,
+                'enabled': CACHE_ENABLED,
+                'model_versions': dict(self._versions)
+            }
+
+
+cache = PredictionCache()
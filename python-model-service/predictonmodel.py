@@ -3,7 +3,13 @@ import pandas as pd
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.preprocessing import StandardScaler
 import joblib
+import math
 import os
+import threading
+import time
+from model_registry import ModelRegistry, ModelHandle, LoadedModel
+from fast_forest import compile_forest
+from instrumentation import span
 
 # Carbon emission factors (kg CO2)
 EMISSION_FACTORS = {
@@ -14,18 +20,63 @@ EMISSION_FACTORS = {
     'shopping_item': 5.0  # per item (avg)
 }
 
-# Model paths
+# Model input features, in column order
+FEATURES = ['avg_daily_travel_km', 'avg_electricity_kwh', 'avg_lpg_kg',
+            'avg_nonveg_meals', 'avg_items_purchased', 'last_month_emission']
+FEATURE_LABELS = ['Travel', 'Electricity', 'LPG', 'Non-Veg Meals', 'Shopping', 'Last Month']
+
+# Monthly emission per unit of each feature, one row per breakdown category
+BREAKDOWN_CATEGORIES = ['transport', 'electricity', 'lpg', 'food', 'shopping']
+BREAKDOWN_FACTORS = np.array([
+    [30 * EMISSION_FACTORS['transport'], 0, 0, 0, 0, 0],
+    [0, EMISSION_FACTORS['electricity'], 0, 0, 0, 0],
+    [0, 0, EMISSION_FACTORS['lpg'], 0, 0, 0],
+    [0, 0, 0, 4 * EMISSION_FACTORS['nonveg_meal'], 0, 0],
+    [0, 0, 0, 0, 4 * EMISSION_FACTORS['shopping_item'], 0],
+])
+
+# Random Forest hyperparameters
+RF_PARAMS = {
+    'n_estimators': 100,
+    'max_depth': 15,
+    'min_samples_split': 5,
+    'min_samples_leaf': 2,
+    'random_state': 42,
+    'n_jobs': -1
+}
+
+# Legacy model paths (read once to seed the registry, never overwritten)
 MODEL_PATH = 'carbon_rf_model.pkl'
 SCALER_PATH = 'carbon_scaler.pkl'
 
-# Global variables
-model = None
-scaler = None
+# Inference engine: 'compiled' walks the flattened forest (fast_forest.py),
+# 'sklearn' calls scaler.transform + model.predict
+RF_ENGINE = os.environ.get('RF_ENGINE', 'compiled')
+
+# Above this many rows sklearn's C tree walk is faster than the compiled forest
+COMPILED_MAX_ROWS = int(os.environ.get('COMPILED_MAX_ROWS', '1024'))
+
+# Per-row error messages: INVALID_INPUT + the message predict_carbon_emission raises
+INVALID_INPUT = 'Invalid input: '
+NON_FINITE_ERROR = 'Feature values must be finite numbers'
 
-def create_sample_training_data():
+# Largest number of what-if scenarios evaluated in one request
+SCENARIO_MAX_GRID = int(os.environ.get('SCENARIO_MAX_GRID', '5000'))
+
+# Features a what-if scenario may reduce (last month's emission is history)
+SCENARIO_LEVERS = FEATURES[:-1]
+
+# Versioned model+scaler artifacts; every worker follows the registry's CURRENT version.
+# The compiled forest is memory-mapped so workers share one copy of its arrays.
+registry = ModelRegistry('carbon_rf', mmap_artifacts={'forest'})
+handle = ModelHandle(registry)
+_load_lock = threading.Lock()
+_compiled = {}
+_importances = {}
+
+def create_sample_training_data(n_samples=1000, seed=42):
     """Create synthetic training data for the RF model"""
-    np.random.seed(42)
-    n_samples = 1000
+    np.random.seed(seed)
     
     data = {
         'avg_daily_travel_km': np.random.uniform(5, 50, n_samples),
@@ -53,61 +104,150 @@ def create_sample_training_data():
     
     return df
 
-def train_model():
-    """Train the Random Forest model"""
-    global model, scaler
-    
+def train_model(n_jobs=None, progress=None, step=10):
+    """
+    Train the Random Forest model and publish it as a new registry version
+
+    Args:
+        n_jobs: cores to train on (default: RF_PARAMS['n_jobs'])
+        progress: optional callback(fraction, message); trees are grown in
+            batches of `step` with warm_start so progress can be reported
+    """
     print("Training Random Forest model...")
     df = create_sample_training_data()
     
-    features = ['avg_daily_travel_km', 'avg_electricity_kwh', 'avg_lpg_kg', 
-                'avg_nonveg_meals', 'avg_items_purchased', 'last_month_emission']
-    
-    X = df[features]
+    X = df[FEATURES]
     y = df['predicted_emission']
     
     # Scale features
     scaler = StandardScaler()
     X_scaled = scaler.fit_transform(X)
     
-    # Train Random Forest
-    model = RandomForestRegressor(
-        n_estimators=100,
-        max_depth=15,
-        min_samples_split=5,
-        min_samples_leaf=2,
-        random_state=42,
-        n_jobs=-1
-    )
+    # Train Random Forest, growing the forest `step` trees at a time
+    params = dict(RF_PARAMS)
+    n_estimators = params.pop('n_estimators')
+    model = RandomForestRegressor(**params, n_estimators=0, warm_start=True)
+    if n_jobs is not None:
+        model.set_params(n_jobs=n_jobs)
+    
+    while model.n_estimators < n_estimators:
+        model.set_params(n_estimators=min(model.n_estimators + step, n_estimators))
+        model.fit(X_scaled, y)
+        if progress:
+            progress(model.n_estimators / n_estimators, f"{model.n_estimators}/{n_estimators} trees")
+    model.set_params(warm_start=False, n_jobs=RF_PARAMS['n_jobs'])
     
-    model.fit(X_scaled, y)
+    score = model.score(X_scaled, y)
     
-    # Save model and scaler
-    joblib.dump(model, MODEL_PATH)
-    joblib.dump(scaler, SCALER_PATH)
+    # Publish model and scaler together as one new version
+    publish_model(model, scaler, {'source': 'synthetic', 'score': round(score, 4)})
     
-    print(f"Model trained! Score: {model.score(X_scaled, y):.4f}")
+    print(f"Model trained! Score: {score:.4f}")
     return model, scaler
 
+def publish_model(model, scaler, metadata=None):
+    """Publish a model+scaler pair as a new version and swap it in for this process"""
+    artifacts = {'model': model, 'scaler': scaler, 'forest': compile_forest(model, scaler)}
+    version = registry.publish(artifacts, metadata)
+    handle.set(LoadedModel(version, artifacts, registry.metadata(version)))
+    # old versions would otherwise pile up with every retrain
+    registry.prune()
+    return version
+
 def load_or_train_model():
     """Load existing model or train new one"""
-    global model, scaler
-    
-    if os.path.exists(MODEL_PATH) and os.path.exists(SCALER_PATH):
+    with _load_lock:
+        if handle.version is not None:
+            return
+        _load_or_train_model()
+
+def _load_or_train_model():
+    if registry.current_version() is not None:
+        print("Loading Random Forest model from registry...")
+        handle.refresh()
+        print(f"Model version {handle.version} loaded successfully!")
+    elif os.path.exists(MODEL_PATH) and os.path.exists(SCALER_PATH):
         print("Loading existing Random Forest model...")
-        model = joblib.load(MODEL_PATH)
-        scaler = joblib.load(SCALER_PATH)
+        publish_model(joblib.load(MODEL_PATH), joblib.load(SCALER_PATH), {'source': MODEL_PATH})
         print("Model loaded successfully!")
     else:
         print("No existing model found. Training new model...")
-        model, scaler = train_model()
+        train_model()
+
+def get_current():
+    """Return the current LoadedModel snapshot, loading it if needed"""
+    current = handle.get()
+    if current is None:
+        with span("rf.load_model"):
+            load_or_train_model()
+        current = handle.get()
+    return current
+
+def get_forest(current):
+    """Compiled forest for a snapshot (compiled in-process for versions published without one)"""
+    forest = current.artifacts.get('forest')
+    if forest is None:
+        forest = _compiled.get(current.version)
+        if forest is None:
+            forest = compile_forest(current.artifacts['model'], current.artifacts['scaler'])
+            _compiled.clear()
+            _compiled[current.version] = forest
+    return forest
 
-def generate_recommendations(breakdown, features):
-    """Generate personalized recommendations based on emissions"""
+def get_feature_importance(current):
+    """Rounded global feature importances for a snapshot, computed once per version"""
+    importance = _importances.get(current.version)
+    if importance is None:
+        # feature_importances_ walks every tree on each access
+        importances = current.artifacts['model'].feature_importances_
+        importance = {k: round(v, 4) for k, v in zip(FEATURE_LABELS, importances)}
+        _importances.clear()
+        _importances[current.version] = importance
+    return importance
+
+def predict_matrix(X, current=None):
+    """Predict raw (unscaled) feature rows, shape (n, 6), with one model version"""
+    current = current or get_current()
+    if RF_ENGINE == 'compiled' and len(X) <= COMPILED_MAX_ROWS:
+        with span("rf.predict_compiled"):
+            return get_forest(current).predict(X)
+    model, scaler = current.artifacts['model'], current.artifacts['scaler']
+    with span("rf.predict_sklearn"):
+        return model.predict(scaler.transform(X))
+
+def predict_contributions(X, current=None):
+    """
+    Predict raw feature rows with per-feature contributions
+
+    Returns (predictions, bias, contributions): contributions has shape
+    (n, 6) and bias + contributions.sum(axis=1) == predictions. Computed
+    in the compiled forest's walk whatever RF_ENGINE is.
+    """
+    current = current or get_current()
+    forest = get_forest(current)
+    with span("rf.predict_contributions"):
+        predictions, contributions = forest.predict_contributions(X)
+    return predictions, forest.bias, contributions
+
+def _contribution_dict(contributions):
+    return {label: round(v, 2) for label, v in zip(FEATURE_LABELS, contributions.tolist())}
+
+def generate_recommendations(breakdown, features, contributions=None):
+    """
+    Generate personalized recommendations based on emissions
+
+    contributions (optional): per-feature contributions of this prediction;
+    categories are then ranked by how much they raise the user's predicted
+    emission rather than by their share of the breakdown
+    """
     recs = []
     
     # Sort by highest impact
-    sorted_categories = sorted(breakdown.items(), key=lambda x: x[1], reverse=True)
+    if contributions is not None:
+        impact = dict(zip(BREAKDOWN_CATEGORIES, contributions))
+        sorted_categories = sorted(breakdown.items(), key=lambda x: impact[x[0]], reverse=True)
+    else:
+        sorted_categories = sorted(breakdown.items(), key=lambda x: x[1], reverse=True)
     
     for category, emission in sorted_categories[:3]:
         if category == 'transport' and emission > 40:
@@ -142,11 +282,8 @@ def predict_carbon_emission(payload):
     Returns:
         dict with prediction, breakdown, recommendations, etc.
     """
-    global model, scaler
-    
-    # Load model if not already loaded
-    if model is None or scaler is None:
-        load_or_train_model()
+    # Model and scaler always come from the same version
+    current = get_current()
     
     # Extract features
     features = {
@@ -167,15 +304,20 @@ def predict_carbon_emission(payload):
         features['avg_items_purchased'],
         features['last_month_emission']
     ]])
+    # the compiled forest would route NaN right at every split instead of failing
+    if not np.isfinite(X).all():
+        raise ValueError(NON_FINITE_ERROR)
     
-    # Scale and predict
-    X_scaled = scaler.transform(X)
-    prediction = model.predict(X_scaled)[0]
+    # Predict, with what each feature added to or took from this prediction;
+    # RF_ENGINE=sklearn keeps the sklearn model and leaves contributions out
+    if RF_ENGINE == 'compiled':
+        predictions, bias, contributions = predict_contributions(X, current)
+    else:
+        predictions, contributions = predict_matrix(X, current), None
+    prediction = predictions[0]
     
-    # Get feature importance
-    feature_names = ['Travel', 'Electricity', 'LPG', 'Non-Veg Meals', 'Shopping', 'Last Month']
-    importances = model.feature_importances_
-    feature_impact = dict(zip(feature_names, importances))
+    # Get feature importance (global, kept for existing clients)
+    feature_impact = get_feature_importance(current)
     
     # Calculate breakdown by category
     breakdown = {
@@ -187,19 +329,271 @@ def predict_carbon_emission(payload):
     }
     
     # Generate recommendations
-    recommendations = generate_recommendations(breakdown, features)
+    with span("rf.recommendations"):
+        recommendations = generate_recommendations(
+            breakdown, features, contributions[0].tolist() if contributions is not None else None)
     
-    return {
+    result = {
         'predicted_emission_kgCO2': round(prediction, 2),
         'breakdown': {k: round(v, 2) for k, v in breakdown.items()},
-        'feature_importance': {k: round(v, 4) for k, v in feature_impact.items()},
+        'feature_importance': dict(feature_impact),
         'recommendations': recommendations,
-        'comparison_to_last_month': round(prediction - features['last_month_emission'], 2)
+        'comparison_to_last_month': round(prediction - features['last_month_emission'], 2),
+        'model_version': current.version
+    }
+    if contributions is not None:
+        result['contribution_bias_kgCO2'] = round(bias, 2)
+        result['feature_contributions'] = _contribution_dict(contributions[0])
+    return result
+
+def _collect_rows(payloads, results):
+    """Validate payloads; fill results[i] with an error for bad rows, return the good ones"""
+    rows = []
+    valid_idx = []
+    
+    for i, payload in enumerate(payloads):
+        if not isinstance(payload, dict):
+            results[i] = {'index': i, 'error': 'Payload must be an object'}
+            continue
+        
+        missing_fields = [field for field in FEATURES if field not in payload]
+        if missing_fields:
+            results[i] = {'index': i, 'error': f"Missing required fields: {', '.join(missing_fields)}"}
+            continue
+        
+        try:
+            row = [float(payload[field]) for field in FEATURES]
+        except (TypeError, ValueError) as e:
+            results[i] = {'index': i, 'error': f"{INVALID_INPUT}{str(e)}"}
+            continue
+        if not np.isfinite(row).all():
+            results[i] = {'index': i, 'error': f"{INVALID_INPUT}{NON_FINITE_ERROR}"}
+            continue
+        rows.append(row)
+        valid_idx.append(i)
+    
+    return rows, valid_idx
+
+def predict_carbon_emission_batch(payloads, contributions=False):
+    """
+    Predict next month's carbon emission for many users at once
+
+    Args:
+        payloads: list of dicts with the same keys as predict_carbon_emission
+        contributions: also return contribution_bias_kgCO2 and per-row
+            feature_contributions (always walks the compiled forest, so
+            large batches lose the sklearn path of predict_matrix)
+
+    Returns:
+        list of result dicts in input order; rows that fail validation
+        contain {'index', 'error'} instead of a prediction
+    """
+    # Model and scaler always come from the same version
+    current = get_current()
+    
+    results = [None] * len(payloads)
+    with span("rf.validate"):
+        rows, valid_idx = _collect_rows(payloads, results)
+    
+    if not rows:
+        return results
+    
+    # Predict the whole matrix (with per-row contributions if asked) in one call
+    X = np.array(rows, dtype=float)
+    if contributions:
+        predictions, bias, parts = predict_contributions(X, current)
+    else:
+        predictions = predict_matrix(X, current)
+    
+    # Calculate breakdown by category for every row: (n, 6) @ (6, 5)
+    with span("rf.breakdown"):
+        breakdown = X @ BREAKDOWN_FACTORS.T
+    comparison = predictions - X[:, FEATURES.index('last_month_emission')]
+    
+    feature_impact = get_feature_importance(current)
+    
+    predictions = predictions.round(2)
+    breakdown_rounded = breakdown.round(2)
+    comparison = comparison.round(2)
+    
+    with span("rf.recommendations"):
+        for row, i in enumerate(valid_idx):
+            row_breakdown = dict(zip(BREAKDOWN_CATEGORIES, breakdown[row].tolist()))
+            row_features = dict(zip(FEATURES, X[row].tolist()))
+            row_parts = parts[row].tolist() if contributions else None
+            results[i] = {
+                'predicted_emission_kgCO2': float(predictions[row]),
+                'breakdown': dict(zip(BREAKDOWN_CATEGORIES, breakdown_rounded[row].tolist())),
+                'feature_importance': dict(feature_impact),
+                'recommendations': generate_recommendations(row_breakdown, row_features, row_parts),
+                'comparison_to_last_month': float(comparison[row]),
+                'model_version': current.version
+            }
+            if contributions:
+                results[i]['contribution_bias_kgCO2'] = round(bias, 2)
+                results[i]['feature_contributions'] = _contribution_dict(parts[row])
+    
+    return results
+
+def predict_carbon_emission_columns(columns, contributions=False):
+    """
+    Columnar form of predict_carbon_emission_batch
+
+    Args:
+        columns: {feature: 1-D array} for every feature in FEATURES; "_id" /
+            "userId" columns are passed through
+        contributions: also return a contribution_<feature> column per
+            feature (and contribution_bias_kgCO2 in meta)
+
+    Returns:
+        ({output column: array}, {'model_version', 'feature_importance'});
+        rows with a missing (NaN) input get NaN outputs and valid=False.
+        Per-row recommendation text is left out.
+    """
+    current = get_current()
+    
+    missing_fields = [field for field in FEATURES if field not in columns]
+    if missing_fields:
+        raise ValueError(f"Missing required columns: {', '.join(missing_fields)}")
+    X = np.column_stack([np.asarray(columns[field], dtype=float) for field in FEATURES])
+    valid = np.isfinite(X).all(axis=1)
+    
+    predictions = np.full(len(X), np.nan)
+    if contributions:
+        parts = np.full(X.shape, np.nan)
+        if valid.any():
+            predictions[valid], _, parts[valid] = predict_contributions(X[valid], current)
+    elif valid.any():
+        predictions[valid] = predict_matrix(X[valid], current)
+    
+    with span("rf.breakdown"):
+        breakdown = (X @ BREAKDOWN_FACTORS.T).round(2)
+    
+    result = {col: columns[col] for col in ('_id', 'userId') if col in columns}
+    result['predicted_emission_kgCO2'] = predictions.round(2)
+    for j, category in enumerate(BREAKDOWN_CATEGORIES):
+        result[f'breakdown_{category}'] = breakdown[:, j]
+    result['comparison_to_last_month'] = (predictions - X[:, FEATURES.index('last_month_emission')]).round(2)
+    result['valid'] = valid
+    
+    meta = {'model_version': current.version, 'feature_importance': dict(get_feature_importance(current))}
+    if contributions:
+        for j, field in enumerate(FEATURES):
+            result[f'contribution_{field}'] = parts[:, j].round(2)
+        meta['contribution_bias_kgCO2'] = round(get_forest(current).bias, 2)
+    return result, meta
+
+def _lever_steps(feature, spec):
+    """(mode, reductions) for one lever: a list of percents or {"percent"|"absolute": [...]}"""
+    if feature not in SCENARIO_LEVERS:
+        raise ValueError(f"Unknown lever: {feature} (use one of {', '.join(SCENARIO_LEVERS)})")
+    if isinstance(spec, dict):
+        if len(spec) != 1 or next(iter(spec)) not in ('percent', 'absolute'):
+            raise ValueError(f"Lever {feature} needs exactly one of 'percent' or 'absolute'")
+        mode, values = next(iter(spec.items()))
+    else:
+        mode, values = 'percent', spec
+    if not isinstance(values, list) or not values:
+        raise ValueError(f"Lever {feature} needs a non-empty list of reductions")
+    if len(values) > SCENARIO_MAX_GRID:
+        raise ValueError(f"Lever {feature} has {len(values)} reductions; the limit is {SCENARIO_MAX_GRID}")
+    steps = np.array(sorted(set(float(v) for v in values)))
+    if not np.isfinite(steps).all():
+        raise ValueError(f"Lever {feature} reductions must be finite numbers")
+    if steps[0] < 0:
+        raise ValueError(f"Lever {feature} reductions must not be negative")
+    if mode == 'percent' and steps[-1] > 100:
+        raise ValueError(f"Lever {feature} percent reductions must be at most 100")
+    return mode, steps
+
+def simulate_scenarios(profile, levers, top=10):
+    """
+    Evaluate a grid of what-if reductions of a profile in one batched prediction
+
+    Args:
+        profile: dict with the predict_carbon_emission fields
+        levers: {feature: reductions}; reductions are a list of percents
+            or {"percent": [...]} / {"absolute": [...]} (units of the feature)
+        top: number of ranked scenarios returned
+
+    Every combination of lever steps is one scenario (the cartesian product,
+    capped at SCENARIO_MAX_GRID). All scenarios plus the unchanged profile
+    are stacked into one feature matrix and predicted with a single model
+    call; scenarios are ranked by predicted savings against the baseline.
+    """
+    current = get_current()
+    timings = {}
+    start = time.perf_counter()
+
+    with span("rf.scenario_expand"):
+        missing_fields = [field for field in FEATURES if field not in profile]
+        if missing_fields:
+            raise ValueError(f"Missing required fields: {', '.join(missing_fields)}")
+        base = np.array([float(profile[field]) for field in FEATURES])
+        if not np.isfinite(base).all():
+            raise ValueError(NON_FINITE_ERROR)
+        if not isinstance(levers, dict) or not levers:
+            raise ValueError("No levers provided")
+
+        names = list(levers)
+        steps = [_lever_steps(name, levers[name]) for name in names]
+        # Python ints: an int64 product of long levers can wrap past the limit
+        grid_size = math.prod(len(values) for _, values in steps)
+        if grid_size > SCENARIO_MAX_GRID:
+            raise ValueError(f"Scenario grid has {grid_size} combinations; the limit is {SCENARIO_MAX_GRID}")
+
+        # (grid_size, n_levers) reduction per lever, one row per combination
+        mesh = np.meshgrid(*[values for _, values in steps], indexing='ij')
+        reductions = np.column_stack([m.ravel() for m in mesh])
+
+        X = np.tile(base, (grid_size + 1, 1))
+        for j, (name, (mode, _)) in enumerate(zip(names, steps)):
+            col = FEATURES.index(name)
+            if mode == 'percent':
+                X[1:, col] = base[col] * (1 - reductions[:, j] / 100.0)
+            else:
+                X[1:, col] = np.maximum(base[col] - reductions[:, j], 0.0)
+    timings['expand'] = time.perf_counter() - start
+
+    mark = time.perf_counter()
+    predictions = predict_matrix(X, current)
+    timings['predict'] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    with span("rf.scenario_rank"):
+        baseline = predictions[0]
+        savings = baseline - predictions[1:]
+        rule_savings = (X[0] - X[1:]) @ BREAKDOWN_FACTORS.sum(axis=0)
+        # most savings first; among equals, the smallest total change
+        effort = reductions.sum(axis=1)
+        order = np.lexsort((effort, -savings))[:max(0, int(top))]
+
+        scenarios = []
+        for row in order:
+            scenarios.append({
+                'levers': {name: {steps[j][0]: float(reductions[row, j])}
+                           for j, name in enumerate(names) if reductions[row, j] > 0},
+                'profile_changes': {name: round(float(X[row + 1, FEATURES.index(name)]), 4)
+                                    for j, name in enumerate(names) if reductions[row, j] > 0},
+                'predicted_emission_kgCO2': round(float(predictions[row + 1]), 2),
+                'savings_kgCO2': round(float(savings[row]), 2),
+                'savings_percent': round(float(savings[row] / baseline * 100), 2) if baseline else 0.0,
+                'rule_based_savings_kgCO2': round(float(rule_savings[row]), 2)
+            })
+    timings['rank'] = time.perf_counter() - mark
+    timings['total'] = time.perf_counter() - start
+
+    return {
+        'baseline_emission_kgCO2': round(float(baseline), 2),
+        'grid_size': grid_size,
+        'scenarios': scenarios,
+        'model_version': current.version,
+        'timing_ms': {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()}
     }
 
 def retrain_model():
     """Retrain the model (for admin use)"""
     return train_model()
 
-# Initialize model on module import
-load_or_train_model()
\ No newline at end of file
+# The model is loaded on first prediction or by the app's background
+# warm-up (see warmup.py); importing this module never loads or trains it.
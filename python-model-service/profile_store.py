@@ -0,0 +1,403 @@
+import calendar
+import fcntl
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+
+import model2
+
+# Directory holding the per-month sum columns and the user index
+PROFILE_STORE_DIR = os.environ.get('PROFILE_STORE_DIR', 'profile_store')
+
+# Rows allocated for a month file when it is created; grows by doubling
+INITIAL_CAPACITY = 1024
+
+# Running per-user sums kept for every month, one float64 column each
+COLUMNS = [
+    'events',
+    'travel_km',
+    'electricity_kwh',
+    'lpg_kg',
+    'nonveg_meals',
+    'items_purchased',
+    'waste_kg',
+    'waste_events',
+    'emission_kg'
+]
+_COL = {name: i for i, name in enumerate(COLUMNS)}
+
+# category (lower case) -> (column, detail fields tried in order); the
+# fields are the ones the dashboard and the model2 payloads use
+EVENT_FIELDS = {
+    'transport': ('travel_km', ('distance_km', 'distance_travelled_km')),
+    'electricity': ('electricity_kwh', ('kwh',)),
+    'lpg': ('lpg_kg', ('kg', 'lpg_kg')),
+    'food': ('nonveg_meals', ('nonveg_meals',)),
+    'shopping': ('items_purchased', ('items', 'item', 'quantity')),
+    'waste': ('waste_kg', ('daily_waste_generated_kg', 'weight_kg', 'weight', 'waste_kg'))
+}
+
+
+def month_key(value=None):
+    """'YYYY-MM' (UTC) for an ISO timestamp, epoch milliseconds, datetime or None (now)"""
+    if value is None:
+        when = datetime.now(timezone.utc)
+    elif isinstance(value, datetime):
+        when = value
+    elif isinstance(value, (int, float)):
+        when = datetime.fromtimestamp(value / 1000.0, timezone.utc)
+    else:
+        text = str(value)
+        if len(text) == 7:
+            # month keys become file names: only ever accept a real YYYY-MM
+            try:
+                when = datetime.strptime(text, '%Y-%m')
+            except ValueError:
+                raise ValueError(f"Invalid month: {text!r} (expected YYYY-MM)")
+        else:
+            try:
+                when = datetime.fromisoformat(text.replace('Z', '+00:00'))
+            except ValueError:
+                raise ValueError(f"Invalid month or timestamp: {text!r} (expected YYYY-MM or ISO 8601)")
+    if when.tzinfo is not None:
+        # 2024-01-31T23:30:00-05:00 is February in UTC, like the epoch path
+        when = when.astimezone(timezone.utc)
+    return f'{when.year:04d}-{when.month:02d}'
+
+
+def previous_month(month):
+    year, mon = int(month[:4]), int(month[5:7])
+    return f'{year - 1:04d}-12' if mon == 1 else f'{year:04d}-{mon - 1:02d}'
+
+
+_CATEGORY_NAMES = {name.lower(): name for name in model2.BATCH_CATEGORY_CODES}
+
+
+def _canonical(event):
+    # model2 matches category names case-sensitively; the dashboard lower-cases them
+    if isinstance(event, dict) and isinstance(event.get('category'), str):
+        name = _CATEGORY_NAMES.get(event['category'].lower())
+        if name and name != event['category']:
+            return dict(event, category=name)
+    return event
+
+
+def _event_amount(category, details):
+    """(column index, amount) an event adds to, or (None, 0.0)"""
+    spec = EVENT_FIELDS.get(category)
+    if spec is None:
+        return None, 0.0
+    column, fields = spec
+    for field in fields:
+        if details.get(field) is not None:
+            return _COL[column], float(details[field])
+    if category == 'electricity' and details.get('electricity_bill') is not None:
+        # same bill -> kWh conversion as model2
+        bill = float(details['electricity_bill'])
+        return _COL[column], max(0.0, bill - model2.FIXED_COST) / model2.COST_PER_KWH
+    return _COL[column], 0.0
+
+
+def derive_profiles(sums, last_month_emission, month):
+    """
+    Profile fields for a block of month sums (n_rows x len(COLUMNS)).
+
+    Matches the dashboard's calculate-profile: travel is a daily average
+    over the days in the month, the rest are monthly totals. Waste is the
+    mean per waste event (NaN when there were none, so the feature
+    pipeline fills it).
+    """
+    days = calendar.monthrange(int(month[:4]), int(month[5:7]))[1]
+    waste_events = sums[:, _COL['waste_events']]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        waste = np.where(waste_events > 0, sums[:, _COL['waste_kg']] / waste_events, np.nan)
+    return {
+        'avg_daily_travel_km': sums[:, _COL['travel_km']] / days,
+        'avg_electricity_kwh': sums[:, _COL['electricity_kwh']],
+        'avg_lpg_kg': sums[:, _COL['lpg_kg']],
+        'avg_nonveg_meals': sums[:, _COL['nonveg_meals']],
+        'avg_items_purchased': sums[:, _COL['items_purchased']],
+        'avg_waste_generated_kg': waste,
+        'last_month_emission': last_month_emission,
+        'month_emission': sums[:, _COL['emission_kg']],
+        'events': sums[:, _COL['events']]
+    }
+
+
+class ProfileStore:
+    """
+    Running per-user, per-month activity sums in memory-mapped columns.
+
+    Layout:
+        <root>/users.txt          one user id per line; line number = row
+        <root>/months/YYYY-MM.npy float64 (capacity x len(COLUMNS)) sums
+
+    Recording an event adds into one row of one month file, and reading a
+    profile reads one row, so neither ever rescans history. The month files
+    are shared memory maps: every worker process sees the same sums, and
+    writers serialize on an flock of <root>/.lock. A month file that runs
+    out of rows is copied into one twice the size and swapped in with
+    os.replace; other processes notice the new inode and remap.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or PROFILE_STORE_DIR
+        self._rows = {}
+        self._user_ids = []
+        self._users_offset = 0
+        self._maps = {}
+        self._lock = threading.RLock()
+        # callables(month, user_ids, month_totals, all_time_totals) told about every
+        # recorded batch: each user's emission total for the month and over all
+        # months after it (absolute, so a listener that re-read the store since
+        # the write cannot count the batch twice)
+        self.listeners = []
+
+    # -- files -----------------------------------------------------------
+
+    @property
+    def users_path(self):
+        return os.path.join(self.root, 'users.txt')
+
+    def _month_path(self, month):
+        return os.path.join(self.root, 'months', f'{month}.npy')
+
+    @contextmanager
+    def _write_lock(self):
+        os.makedirs(os.path.join(self.root, 'months'), exist_ok=True)
+        with self._lock, open(os.path.join(self.root, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def months(self):
+        """Months with recorded activity, oldest first"""
+        month_dir = os.path.join(self.root, 'months')
+        if not os.path.isdir(month_dir):
+            return []
+        return sorted(name[:-4] for name in os.listdir(month_dir) if name.endswith('.npy'))
+
+    def _sync_users(self):
+        # pick up ids appended by other processes (complete lines only)
+        try:
+            with open(self.users_path, 'rb') as f:
+                f.seek(self._users_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].decode('utf-8').splitlines():
+            self._rows.setdefault(line, len(self._user_ids))
+            self._user_ids.append(line)
+        self._users_offset += end
+
+    def _row(self, user_id, create=False):
+        key = str(user_id)
+        row = self._rows.get(key)
+        if row is None:
+            with self._lock:
+                self._sync_users()
+                row = self._rows.get(key)
+                if row is None and create:
+                    # caller holds the write lock, so appends are serialized
+                    with open(self.users_path, 'ab') as f:
+                        f.write(f'{key}\n'.encode('utf-8'))
+                    self._sync_users()
+                    row = self._rows[key]
+        return row
+
+    def _month_array(self, month, min_rows=0):
+        """The month's sums (memory-mapped), grown to min_rows if > 0; None if absent"""
+        path = self._month_path(month)
+        try:
+            inode = os.stat(path).st_ino
+        except FileNotFoundError:
+            inode = None
+
+        cached = self._maps.get(month)
+        if inode is not None and (cached is None or cached[0] != inode):
+            cached = (inode, np.load(path, mmap_mode='r+'))
+            self._maps[month] = cached
+        array = cached[1] if inode is not None else None
+
+        if min_rows and (array is None or len(array) < min_rows):
+            capacity = max(INITIAL_CAPACITY, len(array) if array is not None else 0)
+            while capacity < min_rows:
+                capacity *= 2
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            grown = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float64, shape=(capacity, len(COLUMNS)))
+            if array is not None:
+                grown[:len(array)] = array
+            grown.flush()
+            del grown
+            os.replace(tmp_path, path)
+            array = np.load(path, mmap_mode='r+')
+            self._maps[month] = (os.stat(path).st_ino, array)
+        return array
+
+    # -- writes ----------------------------------------------------------
+
+    def record(self, events):
+        """
+        Add activity events to the running sums.
+
+        Each event is a compute_daily_emission payload plus "userId" and
+        optionally "createdAt" (ISO string or epoch ms; default now) and
+        "co2_kg" (default: model2's emission for the payload). Returns a
+        list with one {"index", "error"} entry per rejected event.
+        """
+        emissions = model2.compute_daily_emissions_batch([_canonical(event) for event in events])
+        updates = {}
+        errors = []
+
+        for i, (event, emission) in enumerate(zip(events, emissions)):
+            try:
+                if not isinstance(event, dict) or event.get('userId') is None:
+                    raise ValueError('Event needs a userId')
+                user_id = str(event['userId'])
+                if user_id.splitlines() != [user_id]:
+                    raise ValueError('userId may not be empty or contain line breaks')
+                details = event.get('details') or {}
+                if not isinstance(details, dict):
+                    raise ValueError('details must be an object')
+                category = str(event.get('category') or '').lower()
+                column, amount = _event_amount(category, details)
+                if event.get('co2_kg') is not None:
+                    co2 = float(event['co2_kg'])
+                elif 'error' in emission:
+                    raise ValueError(emission['error'])
+                else:
+                    co2 = emission['total_emission_kgCO2']
+
+                row = np.zeros(len(COLUMNS))
+                row[_COL['events']] = 1
+                row[_COL['emission_kg']] = co2
+                if column is not None:
+                    row[column] += amount
+                    if column == _COL['waste_kg']:
+                        row[_COL['waste_events']] = 1
+                month = month_key(event.get('createdAt'))
+                updates.setdefault(month, []).append((user_id, row))
+            except (TypeError, ValueError) as e:
+                errors.append({'index': i, 'error': str(e)})
+
+        changes = []
+        if updates:
+            with self._write_lock():
+                touched = {}
+                for month, items in updates.items():
+                    rows = np.array([self._row(user_id, create=True) for user_id, _ in items])
+                    values = np.stack([row for _, row in items])
+                    array = self._month_array(month, min_rows=int(rows.max()) + 1)
+                    np.add.at(array, rows, values)
+                    touched[month] = np.unique(rows)
+                if self.listeners:
+                    for month, users in touched.items():
+                        user_ids = [self._user_ids[r] for r in users]
+                        month_totals = np.array(self._month_array(month)[users, _COL['emission_kg']])
+                        changes.append((month, user_ids, month_totals, self._all_time_totals(users)))
+        for change in changes:
+            for listener in self.listeners:
+                listener(*change)
+        return errors
+
+    # -- reads -----------------------------------------------------------
+
+    def _all_time_totals(self, rows):
+        """Emission totals over every month for the given user rows"""
+        totals = np.zeros(len(rows))
+        for m in self.months():
+            array = self._month_array(m)
+            if array is not None:
+                inside = rows < len(array)
+                totals[inside] += array[rows[inside], _COL['emission_kg']]
+        return totals
+
+    def _sums(self, row, month):
+        array = self._month_array(month)
+        if array is None or row is None or row >= len(array):
+            return np.zeros(len(COLUMNS))
+        return np.array(array[row])
+
+    def profile(self, user_id, month=None):
+        """A user's profile fields for a month (default: current), or None if no activity"""
+        month = month_key(month)
+        row = self._row(user_id)
+        if row is None:
+            return None
+        sums = self._sums(row, month)
+        if sums[_COL['events']] == 0:
+            return None
+        last_month = self._sums(row, previous_month(month))[_COL['emission_kg']]
+        fields = derive_profiles(sums[None, :], np.array([last_month]), month)
+        profile = {key: float(values[0]) for key, values in fields.items()}
+        if np.isnan(profile['avg_waste_generated_kg']):
+            del profile['avg_waste_generated_kg']
+        profile['userId'] = str(user_id)
+        profile['month'] = month
+        profile['events'] = int(profile['events'])
+        return profile
+
+    def profile_columns(self, month=None):
+        """(user ids, profile field arrays) for every user with activity in the month"""
+        month = month_key(month)
+        with self._lock:
+            self._sync_users()
+            user_ids = list(self._user_ids)
+        n = len(user_ids)
+
+        def block(m):
+            array = self._month_array(m)
+            out = np.zeros((n, len(COLUMNS)))
+            if array is not None:
+                rows = min(n, len(array))
+                out[:rows] = array[:rows]
+            return out
+
+        sums = block(month)
+        fields = derive_profiles(sums, block(previous_month(month))[:, _COL['emission_kg']], month)
+        active = np.flatnonzero(sums[:, _COL['events']] > 0)
+        return [user_ids[i] for i in active], {key: values[active] for key, values in fields.items()}
+
+    def emission_totals(self, month=None):
+        """(user ids, emission totals) of every user with activity in the month, or in any month if None"""
+        with self._lock:
+            self._sync_users()
+            user_ids = list(self._user_ids)
+        n = len(user_ids)
+        totals = np.zeros(n)
+        events = np.zeros(n)
+        for m in ([month_key(month)] if month is not None else self.months()):
+            array = self._month_array(m)
+            if array is not None:
+                rows = min(n, len(array))
+                totals[:rows] += array[:rows, _COL['emission_kg']]
+                events[:rows] += array[:rows, _COL['events']]
+        active = np.flatnonzero(events > 0)
+        return [user_ids[i] for i in active], totals[active]
+
+    def profile_frame(self, month=None):
+        """profile_columns as a DataFrame with a userId column, ready for model3 / the feature pipeline"""
+        import pandas as pd
+        user_ids, fields = self.profile_columns(month)
+        df = pd.DataFrame(fields)
+        df.insert(0, 'userId', user_ids)
+        return df
+
+    def stats(self):
+        with self._lock:
+            self._sync_users()
+            return {
+                'root': self.root,
+                'users': len(self._user_ids),
+                'months': self.months(),
+                'columns': COLUMNS
+            }
+
+
+store = ProfileStore()
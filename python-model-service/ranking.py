@@ -0,0 +1,259 @@
+import math
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+
+import numpy as np
+
+import profile_store
+import warmup
+
+model3 = warmup.LazyModule("model3")
+
+# Seconds a ranking index is trusted before it is rebuilt from the shared
+# profile store (picks up events recorded by other worker processes)
+RANKING_REFRESH_SECONDS = float(os.environ.get('RANKING_REFRESH_SECONDS', '10'))
+
+# Pending updates are merged into the sorted arrays once there are more than
+# max(this, sqrt(users)) of them
+COMPACT_MIN_UPDATES = 256
+
+# Period name for totals over every recorded month
+ALL_TIME = 'all'
+
+
+def _value(entry):
+    return entry[0]
+
+
+class RankingIndex:
+    """
+    Per-user emission totals, sorted, with O(log N) rank queries.
+
+    The totals live in one sorted NumPy array (with the user ids in the same
+    order). An update does not touch that array: the user's old
+    (value, user id) pair goes into a small sorted "removed" list and the new
+    one into a sorted "added" list, and counts are corrected by bisecting
+    both. Once the lists hold more than max(COMPACT_MIN_UPDATES, sqrt(N))
+    entries they are merged back into the arrays.
+    """
+
+    def __init__(self, user_ids, values):
+        values = np.asarray(values, dtype=np.float64)
+        self._current = dict(zip(user_ids, values.tolist()))
+        self._added = []
+        self._removed = []
+        self._build()
+
+    def _build(self):
+        user_ids = np.array(list(self._current), dtype=object)
+        values = np.fromiter(self._current.values(), dtype=np.float64, count=len(user_ids))
+        order = np.argsort(values, kind='stable')
+        self._values = values[order]
+        self._ids = user_ids[order]
+        self._added.clear()
+        self._removed.clear()
+
+    def __len__(self):
+        return len(self._current)
+
+    def __contains__(self, user_id):
+        return user_id in self._current
+
+    def get(self, user_id, default=None):
+        return self._current.get(user_id, default)
+
+    def update(self, user_id, value):
+        """Set a user's total (adding the user if new)"""
+        value = float(value)
+        old = self._current.get(user_id)
+        if old is not None:
+            pair = (old, user_id)
+            i = bisect_left(self._added, pair)
+            if i < len(self._added) and self._added[i] == pair:
+                del self._added[i]
+            else:
+                insort(self._removed, pair)
+        insort(self._added, (value, user_id))
+        self._current[user_id] = value
+        if len(self._added) + len(self._removed) > max(COMPACT_MIN_UPDATES, math.isqrt(len(self._current))):
+            self._build()
+
+    def count_below(self, value, inclusive=False):
+        """Users with a total below value (at or below with inclusive)"""
+        if inclusive:
+            return (int(np.searchsorted(self._values, value, 'right'))
+                    - bisect_right(self._removed, value, key=_value) + bisect_right(self._added, value, key=_value))
+        return (int(np.searchsorted(self._values, value, 'left'))
+                - bisect_left(self._removed, value, key=_value) + bisect_left(self._added, value, key=_value))
+
+    def position(self, value):
+        """Rank (1 = lowest emissions) and percentiles a total would have"""
+        n = len(self._current)
+        below = self.count_below(value)
+        at_or_below = self.count_below(value, inclusive=True)
+        return {
+            'emission_kg': round(float(value), 2),
+            'rank': below + 1,
+            'users': n,
+            'percentile': round(at_or_below / n * 100, 2) if n else 0.0,
+            'better_than_percent': round((n - at_or_below) / n * 100, 2) if n else 0.0
+        }
+
+    def rank(self, user_id):
+        """position() of a user's total, or None if the user is not ranked"""
+        value = self._current.get(user_id)
+        return None if value is None else self.position(value)
+
+    def top(self, n, highest=False):
+        """The n lowest (or highest) totals as [(user id, total)], best first"""
+        n = max(0, int(n))
+        removed = Counter(self._removed)
+        window = n + len(self._removed)
+        if highest:
+            candidates = zip(self._values[::-1][:window].tolist(), self._ids[::-1][:window])
+        else:
+            candidates = zip(self._values[:window].tolist(), self._ids[:window])
+        merged = []
+        for pair in candidates:
+            if removed[pair]:
+                removed[pair] -= 1
+            else:
+                merged.append(pair)
+        merged.extend(self._added)
+        merged.sort(key=_value, reverse=highest)
+        return [(user_id, value) for value, user_id in merged[:n]]
+
+
+class RankingService:
+    """
+    Emission ranking indexes per period ("YYYY-MM" or "all"), plus
+    per-cluster indexes (model3 labels) per month.
+
+    Indexes are built from the profile store on first use and rebuilt after
+    RANKING_REFRESH_SECONDS; in between, events recorded through this
+    process update them incrementally via the store's listener hook.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._indexes = {}
+        self._clusters = {}
+        self._lock = threading.RLock()
+        store.listeners.append(self._on_record)
+
+    @staticmethod
+    def period(value=None):
+        return ALL_TIME if value == ALL_TIME else profile_store.month_key(value)
+
+    def _fresh(self, built_at):
+        return time.monotonic() - built_at < RANKING_REFRESH_SECONDS
+
+    def index(self, period):
+        with self._lock:
+            cached = self._indexes.get(period)
+            if cached is None or not self._fresh(cached[0]):
+                user_ids, totals = self.store.emission_totals(None if period == ALL_TIME else period)
+                cached = (time.monotonic(), RankingIndex(user_ids, totals))
+                self._indexes[period] = cached
+            return cached[1]
+
+    def clusters(self, month):
+        """{'version', 'cluster_of', 'indexes', 'labels'} for a month's users under the stored model3 model"""
+        with self._lock:
+            cached = self._clusters.get(month)
+            state = model3.get_cluster_model()
+            if state is None:
+                raise LookupError("Cluster model has not been fitted yet")
+            if cached is None or not self._fresh(cached['built_at']) or cached['version'] != state['version']:
+                frame = self.store.profile_frame(month)
+                if len(frame) == 0:
+                    cached = {'cluster_of': {}, 'indexes': {}, 'labels': state['labels']}
+                else:
+                    assigned = model3.assign_cluster_labels(frame)
+                    cluster_of = dict(zip(frame['userId'], assigned.cluster_ids.tolist()))
+                    emission = frame['month_emission'].to_numpy()
+                    indexes = {}
+                    for cluster in np.unique(assigned.cluster_ids).tolist():
+                        members = np.flatnonzero(assigned.cluster_ids == cluster)
+                        indexes[cluster] = RankingIndex(frame['userId'].to_numpy()[members].tolist(), emission[members])
+                    cached = {'cluster_of': cluster_of, 'indexes': indexes, 'labels': assigned.labels}
+                cached.update(built_at=time.monotonic(), version=state['version'])
+                self._clusters[month] = cached
+            return cached
+
+    def _on_record(self, month, user_ids, totals, all_time_totals):
+        with self._lock:
+            month_index = self._indexes.get(month)
+            all_index = self._indexes.get(ALL_TIME)
+            clusters = self._clusters.get(month)
+            for user_id, total, all_time in zip(user_ids, totals.tolist(), all_time_totals.tolist()):
+                if month_index is not None:
+                    month_index[1].update(user_id, total)
+                if all_index is not None:
+                    all_index[1].update(user_id, all_time)
+                if clusters is not None and user_id in clusters['cluster_of']:
+                    clusters['indexes'][clusters['cluster_of'][user_id]].update(user_id, total)
+
+    # -- queries ---------------------------------------------------------
+
+    def user_rank(self, user_id, period=None):
+        period = self.period(period)
+        with self._lock:
+            result = self.index(period).rank(str(user_id))
+        if result is not None:
+            result.update(userId=str(user_id), period=period)
+        return result
+
+    def position(self, value, period=None):
+        period = self.period(period)
+        with self._lock:
+            result = self.index(period).position(float(value))
+        result['period'] = period
+        return result
+
+    def top(self, n=10, period=None, highest=False):
+        period = self.period(period)
+        with self._lock:
+            index = self.index(period)
+            entries = index.top(n, highest)
+            users = len(index)
+        return {
+            'period': period,
+            'order': 'highest' if highest else 'lowest',
+            'users': users,
+            'leaderboard': [{'rank': i + 1, 'userId': user_id, 'emission_kg': round(value, 2)}
+                            for i, (user_id, value) in enumerate(entries)]
+        }
+
+    def cluster_rank(self, user_id, month=None):
+        """A user's rank among the users of their model3 cluster for the month, or None"""
+        month = profile_store.month_key(month)
+        user_id = str(user_id)
+        with self._lock:
+            clusters = self.clusters(month)
+            cluster = clusters['cluster_of'].get(user_id)
+            if cluster is None:
+                return None
+            result = clusters['indexes'][cluster].rank(user_id)
+        result.update(
+            userId=user_id,
+            period=month,
+            cluster=cluster,
+            cluster_label_name=clusters['labels'][cluster],
+            model_version=clusters['version']
+        )
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'refresh_seconds': RANKING_REFRESH_SECONDS,
+                'periods': {period: len(index) for period, (_, index) in self._indexes.items()},
+                'cluster_months': sorted(self._clusters)
+            }
+
+
+rankings = RankingService(profile_store.store)
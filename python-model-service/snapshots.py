@@ -0,0 +1,242 @@
+import json
+import os
+import re
+import shutil
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from features import FEATURES, get_pipeline
+
+# Root directory for named profile snapshots
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', 'snapshots')
+
+# Snapshot built from the legacy CSV fallback of model1.run_cluster
+CSV_SNAPSHOT = 'user_profiles'
+
+ID_COLUMNS = ['_id', 'userId']
+META_FILE = 'meta.json'
+
+# Rows converted at a time when building a snapshot from a CSV file
+CSV_CHUNK_ROWS = 50000
+
+_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,127}$')
+_lock = threading.Lock()
+
+
+def _snapshot_dir(name):
+    if not _NAME.match(name or ''):
+        raise ValueError(f'Invalid snapshot name: {name!r}')
+    return os.path.join(SNAPSHOT_DIR, name)
+
+
+def _id_array(values):
+    # fixed-width unicode so the column can be memory-mapped like the others
+    return np.asarray(pd.Series(values, dtype=object).fillna('').astype(str).to_numpy(), dtype=str)
+
+
+def _source_array(values):
+    """A CSV column as an array loadable without pickle (missing text -> '')"""
+    if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+        return values.to_numpy()
+    return _id_array(values)
+
+
+def write_snapshot(name, columns, rows, metadata=None):
+    """
+    Write a snapshot from already-computed columns ({name: 1-D array}).
+
+    Every column is one .npy file. The snapshot is written under a
+    temporary name and renamed into place, replacing any previous snapshot
+    of that name, so readers never see a partial one.
+    """
+    target = _snapshot_dir(name)
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    tmp_dir = os.path.join(SNAPSHOT_DIR, f'.tmp-{name}-{os.getpid()}-{threading.get_ident()}')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    for column, values in columns.items():
+        np.save(os.path.join(tmp_dir, f'{column}.npy'), values)
+
+    meta = dict(metadata or {})
+    meta.update(
+        name=name,
+        rows=int(rows),
+        columns=list(columns),
+        created_at=datetime.now(timezone.utc).isoformat()
+    )
+    with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    with _lock:
+        old_dir = None
+        if os.path.isdir(target):
+            old_dir = os.path.join(SNAPSHOT_DIR, f'.old-{name}-{os.getpid()}-{threading.get_ident()}')
+            os.rename(target, old_dir)
+        os.rename(tmp_dir, target)
+    if old_dir:
+        shutil.rmtree(old_dir, ignore_errors=True)
+    return meta
+
+
+def write_columns(name, columns):
+    """Add or replace columns of an existing snapshot (e.g. stored cluster labels)"""
+    directory = _snapshot_dir(name)
+    meta = snapshot_info(name)
+    if meta is None:
+        raise LookupError(f'Unknown snapshot: {name}')
+
+    with _lock:
+        for column, values in columns.items():
+            if len(values) != meta['rows']:
+                raise ValueError(f'Column {column} has {len(values)} rows, snapshot {name} has {meta["rows"]}')
+            tmp_path = os.path.join(directory, f'.{column}.{os.getpid()}.tmp.npy')
+            np.save(tmp_path, values)
+            os.replace(tmp_path, os.path.join(directory, f'{column}.npy'))
+            if column not in meta['columns']:
+                meta['columns'].append(column)
+
+        tmp_meta = os.path.join(directory, f'.{META_FILE}.{os.getpid()}.tmp')
+        with open(tmp_meta, 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_meta, os.path.join(directory, META_FILE))
+    return meta
+
+
+def create_snapshot(name, profiles, pipeline=None, metadata=None):
+    """Snapshot the ids and feature columns of profiles (list of dicts or DataFrame)"""
+    df = profiles if isinstance(profiles, pd.DataFrame) else pd.DataFrame(profiles)
+    pipeline = pipeline or get_pipeline()
+    X = pipeline.transform(df)
+
+    columns = {col: _id_array(df[col]) for col in ID_COLUMNS if col in df.columns}
+    for i, feature in enumerate(FEATURES):
+        columns[feature] = np.ascontiguousarray(X[:, i])
+    meta = dict(metadata or {}, feature_pipeline=pipeline.fingerprint)
+    return write_snapshot(name, columns, len(df), meta)
+
+
+def create_snapshot_from_csv(name, path, chunksize=CSV_CHUNK_ROWS):
+    """
+    Convert a profiles CSV into a snapshot, parsing it once in bounded chunks.
+
+    Besides the ids and feature columns, every other CSV column is kept
+    as-is so csv_frame() can hand back the whole file.
+    """
+    pipeline = get_pipeline()
+    parts = {}
+    other = {}
+    source_columns = None
+    rows = 0
+    for chunk in pd.read_csv(path, chunksize=chunksize, dtype={col: str for col in ID_COLUMNS}):
+        if source_columns is None:
+            source_columns = list(chunk.columns)
+        X = pipeline.transform(chunk)
+        for col in ID_COLUMNS:
+            if col in chunk.columns:
+                parts.setdefault(col, []).append(_id_array(chunk[col]))
+        for i, feature in enumerate(FEATURES):
+            parts.setdefault(feature, []).append(X[:, i])
+        for col in chunk.columns:
+            if col not in ID_COLUMNS and col not in FEATURES:
+                other.setdefault(col, []).append(chunk[col])
+        rows += len(chunk)
+
+    columns = {col: np.concatenate(values) for col, values in parts.items()}
+    text_columns = [col for col in ID_COLUMNS if col in columns]
+    for col, values in other.items():
+        # concatenated as Series so a column's dtype is settled over the whole file
+        columns[col] = _source_array(pd.concat(values, ignore_index=True))
+        if columns[col].dtype.kind == 'U':
+            text_columns.append(col)
+    meta = {
+        'source': os.path.abspath(path),
+        'source_mtime': os.path.getmtime(path),
+        'source_columns': source_columns or [],
+        'text_columns': text_columns,
+        'feature_pipeline': pipeline.fingerprint
+    }
+    return write_snapshot(name, columns, rows, meta)
+
+
+def snapshot_info(name):
+    """A snapshot's meta.json, or None if it does not exist"""
+    try:
+        with open(os.path.join(_snapshot_dir(name), META_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def list_snapshots():
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+    infos = (snapshot_info(entry) for entry in sorted(os.listdir(SNAPSHOT_DIR)) if _NAME.match(entry))
+    return [info for info in infos if info is not None]
+
+
+def delete_snapshot(name):
+    """Remove a snapshot; returns False if it did not exist"""
+    target = _snapshot_dir(name)
+    if not os.path.isdir(target):
+        return False
+    shutil.rmtree(target)
+    return True
+
+
+def read_snapshot(name, columns=None):
+    """
+    Memory-map a snapshot's columns ({name: read-only array}).
+
+    Only the requested columns are opened (default: all); nothing is
+    parsed or copied until the arrays are used.
+    """
+    meta = snapshot_info(name)
+    if meta is None:
+        raise LookupError(f'Unknown snapshot: {name}')
+    wanted = meta['columns'] if columns is None else columns
+    missing = [col for col in wanted if col not in meta['columns']]
+    if missing:
+        raise KeyError(f'Snapshot {name} has no column(s): {", ".join(missing)}')
+    directory = _snapshot_dir(name)
+    return {col: np.load(os.path.join(directory, f'{col}.npy'), mmap_mode='r') for col in wanted}
+
+
+def feature_matrix(name):
+    """The snapshot's feature columns as one (rows x len(FEATURES)) float matrix"""
+    columns = read_snapshot(name, FEATURES)
+    return np.column_stack([columns[feature] for feature in FEATURES])
+
+
+def csv_snapshot(path='user_profiles.csv', name=CSV_SNAPSHOT):
+    """
+    Name of a snapshot mirroring a profiles CSV, rebuilt only when the CSV
+    (or the feature pipeline) changed since it was taken.
+    """
+    meta = snapshot_info(name)
+    if (meta is None
+            or meta.get('source_mtime') != os.path.getmtime(path)
+            or meta.get('feature_pipeline') != get_pipeline().fingerprint
+            or 'source_columns' not in meta):
+        create_snapshot_from_csv(name, path)
+    return name
+
+
+def csv_frame(name):
+    """
+    DataFrame of a CSV snapshot: the file's columns in file order (feature
+    columns as filled by the pipeline), then any other snapshot columns.
+    Missing text values come back as NaN, as read_csv gives them.
+    """
+    meta = snapshot_info(name)
+    if meta is None:
+        raise LookupError(f'Unknown snapshot: {name}')
+    columns = read_snapshot(name)
+    source = [col for col in meta.get('source_columns', []) if col in columns]
+    df = pd.DataFrame({col: columns[col] for col in source + [c for c in meta['columns'] if c not in source]})
+    for col in meta.get('text_columns', []):
+        df[col] = df[col].astype(object).where(df[col] != '', np.nan)
+    return df
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# Model/state directories for the test run, set before any service module is imported
+_state = tempfile.mkdtemp(prefix='model-service-tests-')
+for name, sub in [('MODEL_REGISTRY_DIR', 'model_registry'), ('PROFILE_STORE_DIR', 'profile_store'),
+                  ('SNAPSHOT_DIR', 'snapshots'), ('AUTO_K_CACHE_DIR', 'k_selection_cache'),
+                  ('MODEL3_CLUSTER_PATH', 'model3_cluster.pkl')]:
+    os.environ.setdefault(name, os.path.join(_state, sub))
+os.environ.setdefault('MODEL_WARMUP', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from flask import Response, request as flask_request, stream_with_context
+
+import asgi
+
+flask_app = asgi.flask_app
+_seen = {}
+
+
+def _thread_stream():
+    lane = asgi._lanes['cluster']
+
+    def generate():
+        for _ in range(20):
+            _seen.setdefault('threads', set()).add(threading.get_ident())
+            _seen.setdefault('admitted', []).append(lane.admitted)
+            yield 'x' * 1000 + '\n'
+    return Response(stream_with_context(generate()), mimetype='text/plain')
+
+
+def _slow():
+    time.sleep(0.5)
+    return 'done'
+
+
+def _echo():
+    data = flask_request.get_data()
+    return {'size': len(data), 'digest': sum(data) % 65521,
+            'on_disk': bool(getattr(flask_request.environ['wsgi.input'], '_rolled', False))}
+
+
+flask_app.add_url_rule('/_test/stream', '_test_stream', _thread_stream)
+flask_app.add_url_rule('/_test/slow', '_test_slow', _slow)
+flask_app.add_url_rule('/_test/echo', '_test_echo', _echo, methods=['POST'])
+
+
+def request(method, path, body=b'', headers=()):
+    """Minimal ASGI client: (status, headers, body) of one request to asgi.application"""
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'root_path': '',
+        'query_string': query.encode(),
+        'headers': [(k.lower().encode(), v.encode()) for k, v in headers],
+        'http_version': '1.1',
+        'scheme': 'http',
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 12345)
+    }
+    messages = []
+
+    async def run():
+        delivered = asyncio.Event()
+
+        async def receive():
+            if not delivered.is_set():
+                delivered.set()
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await asyncio.Event().wait()
+
+        async def send(message):
+            messages.append(message)
+
+        await asgi.application(scope, receive, send)
+        # let the lane's release callback run
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    start = messages[0]
+    content = b''.join(m.get('body', b'') for m in messages[1:])
+    return start['status'], dict((k.decode(), v.decode()) for k, v in start['headers']), content
+
+
+def test_inline_endpoint():
+    status, _, body = request('GET', '/health')
+    assert status == 200
+    assert json.loads(body) == {'status': 'ok'}
+
+
+def test_stream_runs_on_one_thread_holding_the_slot(monkeypatch):
+    monkeypatch.setitem(asgi.ENDPOINT_LANES, '_test_stream', 'cluster')
+    _seen.clear()
+    status, _, body = request('GET', '/_test/stream')
+    assert status == 200
+    assert body == ('x' * 1000 + '\n').encode() * 20
+    assert len(_seen['threads']) == 1
+    assert threading.get_ident() not in _seen['threads']
+    assert set(_seen['admitted']) == {1}
+    assert asgi._lanes['cluster'].admitted == 0
+
+
+def test_cluster_stream_endpoint():
+    profiles = [
+        {'userId': str(i), 'avg_daily_travel_km': i % 40, 'avg_electricity_kwh': 50 + 7 * i % 200,
+         'avg_lpg_kg': i % 20, 'avg_nonveg_meals': i % 15, 'avg_items_purchased': i % 10,
+         'month_emission': 100 + 11 * i % 600}
+        for i in range(60)
+    ]
+    body = '\n'.join(json.dumps(p) for p in profiles).encode()
+    status, headers, content = request('POST', '/model1/cluster/stream?k=2&chunksize=16', body,
+                                       [('Content-Type', 'application/x-ndjson')])
+    assert status == 200
+    assert headers['content-type'].startswith('application/x-ndjson')
+    lines = [json.loads(line) for line in content.decode().splitlines()]
+    assert len(lines) == len(profiles) + 1
+    assert 'error' not in lines[-1]
+    assert asgi._lanes['cluster'].admitted == 0
+
+
+@pytest.mark.parametrize('lane', ['default', 'inline'])
+def test_large_body_is_spooled(monkeypatch, lane):
+    monkeypatch.setitem(asgi.ENDPOINT_LANES, '_test_echo', lane)
+    monkeypatch.setattr(asgi, 'SPOOL_BODY_BYTES', 1024)
+    payload = bytes(range(256)) * 400
+    status, _, body = request('POST', '/_test/echo', payload)
+    assert status == 200
+    assert json.loads(body) == {'size': len(payload), 'digest': sum(payload) % 65521, 'on_disk': True}
+
+
+def test_body_too_large(monkeypatch):
+    monkeypatch.setattr(asgi, 'MAX_BODY_BYTES', 1024)
+    status, _, _ = request('POST', '/_test/echo', b'x' * 2048)
+    assert status == 413
+
+
+def test_ranking_reads_run_in_a_lane():
+    for endpoint in ('ranking_stats', 'ranking_top', 'user_ranking'):
+        assert asgi.ENDPOINT_LANES[endpoint] != asgi.INLINE
+
+
+def test_timeout(monkeypatch):
+    monkeypatch.setitem(asgi.ENDPOINT_LANES, '_test_slow', 'default')
+    monkeypatch.setattr(asgi._lanes['default'], 'timeout', 0.1)
+    status, _, body = request('GET', '/_test/slow')
+    assert status == 504
+    assert 'timed out' in json.loads(body)['error']
+
+
+def test_full_lane_rejected(monkeypatch):
+    lane = asgi._lanes['default']
+    monkeypatch.setattr(lane, 'admitted', lane.concurrency + lane.queue)
+    status, headers, _ = request('GET', '/_test/slow')
+    assert status == 429
+    assert headers['retry-after'] == '1'
+
+
+@pytest.mark.parametrize('path', ['/asgi/lanes'])
+def test_lane_stats(path):
+    status, _, body = request('GET', path)
+    assert status == 200
+    assert set(json.loads(body)) == set(asgi.LANES)
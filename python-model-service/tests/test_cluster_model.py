@@ -0,0 +1,48 @@
+import multiprocessing
+import os
+
+import pytest
+
+import model3
+
+PROFILES = [
+    {'userId': str(i), 'avg_daily_travel_km': i % 40, 'avg_electricity_kwh': 50 + 7 * i % 200,
+     'avg_lpg_kg': i % 20, 'avg_nonveg_meals': i % 15, 'avg_items_purchased': i % 10,
+     'month_emission': 100 + 11 * i % 600}
+    for i in range(30)
+]
+
+
+@pytest.fixture
+def model_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'model3_cluster.pkl')
+    monkeypatch.setattr(model3, 'CLUSTER_MODEL_PATH', path)
+    monkeypatch.setattr(model3, 'cluster_model', None)
+    return path
+
+
+def _update(n):
+    for i in range(n):
+        model3.partial_fit_cluster_model(PROFILES[i:i + 2])
+
+
+def test_workers_store_consecutive_versions(model_path):
+    model3.fit_cluster_model(PROFILES, k=2)
+    workers = [multiprocessing.get_context('fork').Process(target=_update, args=(3,)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    state = model3.get_cluster_model()
+    # no update was lost or stored under another worker's version
+    assert state['version'] == 1 + 4 * 3
+    assert state['n_samples'] == len(PROFILES) + 4 * 3 * 2
+
+
+def test_removed_model_file_keeps_the_loaded_model(model_path):
+    stored = model3.fit_cluster_model(PROFILES, k=2)
+    os.remove(model_path)
+    assert model3.get_cluster_model() is stored
+    assert model3.load_cluster_model() is None
@@ -0,0 +1,71 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+import model1
+
+PROFILES = [
+    {'userId': str(i), 'avg_daily_travel_km': i % 40, 'avg_electricity_kwh': 50 + 7 * i % 200,
+     'avg_lpg_kg': i % 20, 'avg_nonveg_meals': i % 15, 'avg_items_purchased': i % 10,
+     'month_emission': 100 + 11 * i % 600}
+    for i in range(45)
+]
+BODY = '\n'.join(json.dumps(p) for p in PROFILES).encode()
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def _lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_chunked_upload_is_clustered(client):
+    # no Content-Length: the body ends where the (de-chunked) stream ends
+    response = client.post('/model1/cluster/stream?k=2&chunksize=10', environ_overrides={
+        'CONTENT_TYPE': 'application/x-ndjson',
+        'HTTP_TRANSFER_ENCODING': 'chunked',
+        'wsgi.input': io.BytesIO(BODY),
+        'wsgi.input_terminated': True
+    })
+    lines = _lines(response)
+    response.close()
+    assert response.status_code == 200
+    assert [line['userId'] for line in lines[:-1]] == [p['userId'] for p in PROFILES]
+    assert 'cluster_summary' in lines[-1]
+
+
+@pytest.mark.parametrize('query', ['chunksize=0', 'chunksize=x', 'k=0', 'k=auto'])
+def test_bad_parameters(client, query):
+    response = client.post(f'/model1/cluster/stream?{query}', data=BODY, content_type='application/x-ndjson')
+    assert response.status_code == 400
+
+
+def test_empty_body_without_csv(client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    response = client.post('/model1/cluster/stream?k=2')
+    assert response.status_code == 404
+
+
+def test_short_tail_is_fitted(monkeypatch):
+    # 1-row chunks with k=2: the last row only ever completes a batch with the one before
+    fitted = []
+    original = model1.MiniBatchKMeans.partial_fit
+
+    def partial_fit(self, X, *args, **kwargs):
+        fitted.append(len(X))
+        return original(self, X, *args, **kwargs)
+
+    monkeypatch.setattr(model1.MiniBatchKMeans, 'partial_fit', partial_fit)
+    frame = pd.DataFrame(PROFILES[:5])
+    read_chunks = lambda: (frame.iloc[i:i + 1].copy() for i in range(len(frame)))
+    lines = list(model1.run_cluster_stream(read_chunks, k=2))
+    assert sum(fitted) == len(frame)
+    assert min(fitted) >= 2
+    assert len(lines) == len(frame) + 1
@@ -0,0 +1,29 @@
+import numpy as np
+
+import app
+import columnar
+
+PROFILES = [
+    {'_id': f'p{i}', 'userId': f'u{i}', 'avg_daily_travel_km': 10 + i, 'avg_electricity_kwh': 120,
+     'avg_lpg_kg': 18, 'avg_nonveg_meals': 12, 'avg_items_purchased': 6, 'last_month_emission': 200}
+    for i in range(5)
+]
+
+
+def test_json_request_columnar_response_keeps_ids():
+    profiles = PROFILES + [{'userId': 'bad', 'avg_daily_travel_km': 'x'}]
+    response = app.app.test_client().post('/predict_carbon_emission/batch', json={'profiles': profiles},
+                                          headers={'Accept': columnar.NPZ})
+    assert response.status_code == 200
+    columns, meta = columnar.decode(response.get_data(), columnar.NPZ)
+    assert columns['userId'].tolist() == [p['userId'] for p in profiles]
+    assert columns['_id'].tolist() == [p.get('_id', '') for p in profiles]
+    assert columns['valid'].tolist() == [True] * len(PROFILES) + [False]
+    assert np.isfinite(columns['predicted_emission_kgCO2'][:-1]).all()
+    assert meta['model_version']
+
+
+def test_records_to_columns_only_adds_present_text_columns():
+    columns = columnar.records_to_columns([{'a': 1}, {'a': 'x'}, None], ['a'], text_names=('userId',))
+    assert set(columns) == {'a'}
+    np.testing.assert_array_equal(columns['a'], [1.0, np.nan, np.nan])
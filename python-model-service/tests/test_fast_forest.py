@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import StandardScaler
+
+import predictonmodel
+from fast_forest import compile_forest
+
+
+@pytest.fixture(scope='module')
+def fitted():
+    df = predictonmodel.create_sample_training_data(n_samples=400, seed=7)
+    X, y = df[predictonmodel.FEATURES].to_numpy(), df['predicted_emission'].to_numpy()
+    scaler = StandardScaler().fit(X)
+    model = RandomForestRegressor(n_estimators=20, max_depth=8, min_samples_leaf=2,
+                                  random_state=0).fit(scaler.transform(X), y)
+    return model, scaler, compile_forest(model, scaler), X
+
+
+def _rows(X, n, seed):
+    rng = np.random.default_rng(seed)
+    lo, hi = X.min(axis=0), X.max(axis=0)
+    span = hi - lo
+    return rng.uniform(lo - 0.1 * span, hi + 0.1 * span, size=(n, X.shape[1]))
+
+
+def test_compiled_matches_sklearn(fitted):
+    model, scaler, forest, X = fitted
+    rows = np.vstack([X, _rows(X, 3000, seed=1)])
+    np.testing.assert_allclose(forest.predict(rows), model.predict(scaler.transform(rows)), rtol=0, atol=1e-9)
+
+
+def test_compiled_matches_sklearn_on_thresholds(fitted):
+    model, scaler, forest, X = fitted
+    rng = np.random.default_rng(2)
+    split_nodes = np.flatnonzero(forest.children[0::2] != np.arange(forest.n_nodes))
+    nodes = rng.choice(split_nodes, 1000)
+    base = _rows(X, 1000, seed=3)
+    on, past = base.copy(), base.copy()
+    on[np.arange(1000), forest.feature[nodes]] = forest.threshold[nodes]
+    past[np.arange(1000), forest.feature[nodes]] = np.nextafter(forest.threshold[nodes], np.inf)
+    rows = np.vstack([on, past])
+    np.testing.assert_allclose(forest.predict(rows), model.predict(scaler.transform(rows)), rtol=0, atol=1e-9)
+
+
+def test_contributions_add_up(fitted):
+    _, _, forest, X = fitted
+    rows = _rows(X, 700, seed=4)
+    predictions, contributions = forest.predict_contributions(rows)
+    np.testing.assert_allclose(predictions, forest.predict(rows), rtol=0, atol=1e-9)
+    np.testing.assert_allclose(forest.bias + contributions.sum(axis=1), predictions, rtol=0, atol=1e-9)
+
+
+PROFILE = {
+    'avg_daily_travel_km': 15.5,
+    'avg_electricity_kwh': 120,
+    'avg_lpg_kg': 18,
+    'avg_nonveg_meals': 12,
+    'avg_items_purchased': 6,
+    'last_month_emission': 200
+}
+
+
+@pytest.mark.parametrize('value', [float('nan'), float('inf'), 'nan'])
+def test_non_finite_features_rejected(value):
+    with pytest.raises(ValueError):
+        predictonmodel.predict_carbon_emission(dict(PROFILE, avg_lpg_kg=value))
+
+    results = predictonmodel.predict_carbon_emission_batch([PROFILE, dict(PROFILE, avg_lpg_kg=value)])
+    assert 'predicted_emission_kgCO2' in results[0]
+    assert results[1]['index'] == 1 and 'finite' in results[1]['error']
@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+
+from micro_batcher import MicroBatcher
+
+
+def _square_batch(calls):
+    def batch(payloads):
+        calls.append(len(payloads))
+        return [{'error': f'bad {p}'} if p % 5 == 0 else {'value': p * p} for p in payloads]
+    return batch
+
+
+def test_concurrent_submits_get_their_own_results():
+    calls = []
+    batcher = MicroBatcher(_square_batch(calls), max_batch=8, max_wait_ms=5,
+                           result_error=lambda r: r.get('error'))
+    results = {}
+    start = threading.Barrier(40)
+
+    def worker(n):
+        start.wait()
+        try:
+            results[n] = batcher.submit(n)
+        except ValueError as e:
+            results[n] = e
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(1, 41)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for n in range(1, 41):
+        if n % 5 == 0:
+            assert isinstance(results[n], ValueError) and str(results[n]) == f'bad {n}'
+        else:
+            assert results[n] == {'value': n * n}
+    assert sum(calls) == 40
+    assert max(calls) <= 8
+    stats = batcher.stats()
+    assert stats['requests'] == 40 and stats['errors'] == 8 and stats['queued'] == 0
+
+
+def test_batch_failure_reaches_every_caller():
+    def boom(payloads):
+        raise RuntimeError('model unavailable')
+
+    batcher = MicroBatcher(boom)
+    with pytest.raises(RuntimeError, match='model unavailable'):
+        batcher.submit(1)
+    # the batcher recovers for the next call
+    batcher.batch_fn = lambda payloads: payloads
+    assert batcher.submit(2) == 2
+
+
+def test_lone_request_is_not_delayed():
+    batcher = MicroBatcher(lambda payloads: payloads, max_wait_ms=10_000)
+    assert batcher.submit('a') == 'a'
+
+
+@pytest.mark.parametrize('value', [float('nan'), 'x'])
+def test_endpoint_errors_match_unbatched(monkeypatch, value):
+    import app
+    client = app.app.test_client()
+    payload = {
+        'avg_daily_travel_km': 15.5, 'avg_electricity_kwh': 120, 'avg_lpg_kg': value,
+        'avg_nonveg_meals': 12, 'avg_items_purchased': 6, 'last_month_emission': 200
+    }
+    monkeypatch.setattr(app, 'CACHE_ENABLED', False)
+    bodies = []
+    for enabled in (True, False):
+        monkeypatch.setattr(app, 'MICROBATCH_ENABLED', enabled)
+        response = client.post('/predict_carbon_emission', json=payload)
+        bodies.append((response.status_code, response.get_json()))
+    assert bodies[0] == bodies[1]
+    assert bodies[0][0] == 400
+
+
+@pytest.mark.parametrize('engine', ['compiled', 'sklearn'])
+def test_endpoint_honours_rf_engine(monkeypatch, engine):
+    import app
+    import predictonmodel
+    client = app.app.test_client()
+    payload = {
+        'avg_daily_travel_km': 15.5, 'avg_electricity_kwh': 120, 'avg_lpg_kg': 18,
+        'avg_nonveg_meals': 12, 'avg_items_purchased': 6, 'last_month_emission': 200
+    }
+    monkeypatch.setattr(app, 'CACHE_ENABLED', False)
+    monkeypatch.setattr(predictonmodel, 'RF_ENGINE', engine)
+    bodies = []
+    for enabled in (True, False):
+        monkeypatch.setattr(app, 'MICROBATCH_ENABLED', enabled)
+        response = client.post('/predict_carbon_emission', json=payload)
+        assert response.status_code == 200
+        bodies.append(response.get_json())
+    assert bodies[0].keys() == bodies[1].keys()
+    body = bodies[0]
+    if engine == 'compiled':
+        total = body['contribution_bias_kgCO2'] + sum(body['feature_contributions'].values())
+        assert total == pytest.approx(body['predicted_emission_kgCO2'], abs=0.05)
+    else:
+        assert 'feature_contributions' not in body and 'contribution_bias_kgCO2' not in body
@@ -0,0 +1,33 @@
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import StandardScaler
+
+import model_registry
+import predictonmodel
+from model_registry import ModelHandle, ModelRegistry
+
+
+def test_prune_keeps_the_newest_versions(tmp_path):
+    registry = ModelRegistry('test', root=str(tmp_path))
+    for i in range(6):
+        registry.publish({'value': i})
+    registry.prune(keep=3)
+    assert registry.versions() == [4, 5, 6]
+    assert registry.current_version() == 6
+    assert registry.load(6).artifacts['value'] == 5
+
+
+def test_publish_model_prunes_old_versions(tmp_path, monkeypatch):
+    registry = ModelRegistry('carbon_rf', root=str(tmp_path), mmap_artifacts={'forest'})
+    monkeypatch.setattr(predictonmodel, 'registry', registry)
+    monkeypatch.setattr(predictonmodel, 'handle', ModelHandle(registry))
+    monkeypatch.setattr(model_registry, 'KEEP_VERSIONS', 2)
+
+    rng = np.random.default_rng(0)
+    X, y = rng.random((40, 6)), rng.random(40)
+    scaler = StandardScaler().fit(X)
+    model = RandomForestRegressor(n_estimators=3, random_state=0).fit(scaler.transform(X), y)
+    versions = [predictonmodel.publish_model(model, scaler) for _ in range(4)]
+
+    assert registry.versions() == versions[-2:]
+    assert predictonmodel.handle.version == versions[-1]
@@ -0,0 +1,39 @@
+from prediction_cache import PredictionCache
+
+PAYLOAD = {'avg_lpg_kg': 18, 'avg_daily_travel_km': 15.5}
+
+
+def test_new_model_version_invalidates_the_namespace():
+    cache = PredictionCache(max_entries=100, ttl_seconds=60, sqlite_path=None)
+    cache.set('carbon_emission', 1, PAYLOAD, {'value': 'v1'})
+    cache.set('daily_emission', 'd1', PAYLOAD, {'value': 'daily'})
+    # key order does not matter
+    assert cache.get('carbon_emission', 1, dict(reversed(PAYLOAD.items()))) == {'value': 'v1'}
+
+    assert cache.get('carbon_emission', 2, PAYLOAD) is None
+    # the old version's entry is gone, not just unreachable
+    assert cache.get('carbon_emission', 1, PAYLOAD) is None
+    assert cache.get('daily_emission', 'd1', PAYLOAD) == {'value': 'daily'}
+
+    stats = cache.stats()
+    assert stats['invalidations'] == 2
+    assert stats['model_versions'] == {'carbon_emission': 1, 'daily_emission': 'd1'}
+    assert stats['entries'] == 1
+
+
+def test_shared_sqlite_entries_follow_the_version(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    writer = PredictionCache(ttl_seconds=60, sqlite_path=path)
+    reader = PredictionCache(ttl_seconds=60, sqlite_path=path)
+    writer.set('carbon_emission', 1, PAYLOAD, {'value': 'v1'})
+
+    assert reader.get('carbon_emission', 1, PAYLOAD) == {'value': 'v1'}
+    assert reader.stats()['shared_hits'] == 1
+    assert reader.get('carbon_emission', 2, PAYLOAD) is None
+
+
+def test_expired_entries_miss():
+    cache = PredictionCache(ttl_seconds=-1, sqlite_path=None)
+    cache.set('carbon_emission', 1, PAYLOAD, {'value': 'v1'})
+    assert cache.get('carbon_emission', 1, PAYLOAD) is None
+    assert cache.stats()['expired'] == 1
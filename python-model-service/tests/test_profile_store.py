@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import profile_store
+from profile_store import ProfileStore, month_key
+
+
+def _event(user, travel=10.0, co2=2.0, when='2024-03-15T12:00:00Z'):
+    return {'userId': user, 'category': 'transport', 'details': {'distance_km': travel},
+            'co2_kg': co2, 'createdAt': when}
+
+
+def test_record_sums_events_per_user_and_month(tmp_path):
+    store = ProfileStore(str(tmp_path))
+    errors = store.record([_event('a'), _event('a', travel=5, co2=1), _event('b'),
+                           _event('a', when='2024-02-10T00:00:00Z', co2=7),
+                           {'category': 'transport'}, _event('c') | {'details': [1]}])
+    assert [e['index'] for e in errors] == [4, 5]
+
+    profile = store.profile('a', '2024-03')
+    assert profile['events'] == 2
+    assert profile['avg_daily_travel_km'] == pytest.approx(15 / 31)
+    assert profile['last_month_emission'] == 7
+    assert store.profile('c', '2024-03') is None
+    assert store.months() == ['2024-02', '2024-03']
+
+
+def test_month_file_grows_and_other_instances_remap(tmp_path):
+    writer, reader = ProfileStore(str(tmp_path)), ProfileStore(str(tmp_path))
+    writer.record([_event('u0')])
+    assert reader.profile('u0', '2024-03')['events'] == 1
+    assert len(reader._month_array('2024-03')) == profile_store.INITIAL_CAPACITY
+
+    n = profile_store.INITIAL_CAPACITY + 10
+    writer.record([_event(f'u{i}', co2=float(i)) for i in range(1, n)])
+    assert len(writer._month_array('2024-03')) == 2 * profile_store.INITIAL_CAPACITY
+
+    # the reader still maps the replaced file until it sees the new inode
+    assert reader.profile(f'u{n - 1}', '2024-03')['events'] == 1
+    user_ids, totals = reader.emission_totals('2024-03')
+    assert len(user_ids) == n
+    np.testing.assert_allclose(totals, [2.0] + [float(i) for i in range(1, n)])
+
+
+def test_month_key_uses_utc():
+    assert month_key('2024-01-31T23:30:00-05:00') == '2024-02'
+    assert month_key('2024-02-01T00:30:00+02:00') == '2024-01'
+    assert month_key(1706745600000) == '2024-02'
+    with pytest.raises(ValueError):
+        month_key('2024-13')
+    with pytest.raises(ValueError):
+        month_key('not a date')
@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+import ranking
+from profile_store import ProfileStore
+from ranking import RankingIndex, RankingService
+
+
+def _assert_matches_rebuild(index, current):
+    rebuilt = RankingIndex(list(current), list(current.values()))
+    assert len(index) == len(rebuilt)
+    for value in sorted(set(current.values())) + [-1.0, 0.5, 1e9]:
+        assert index.count_below(value) == rebuilt.count_below(value)
+        assert index.count_below(value, inclusive=True) == rebuilt.count_below(value, inclusive=True)
+        assert index.position(value) == rebuilt.position(value)
+    for user_id in current:
+        assert index.rank(user_id) == rebuilt.rank(user_id)
+    for highest in (False, True):
+        for n in (0, 1, 5, len(current) + 3):
+            entries = index.top(n, highest)
+            # ties may come back in either order; the totals may not
+            assert [v for _, v in entries] == [v for _, v in rebuilt.top(n, highest)]
+            assert all(current[user_id] == value for user_id, value in entries)
+
+
+@pytest.mark.parametrize('compact_after', [4, 10_000])
+def test_updates_match_a_full_rebuild(monkeypatch, compact_after):
+    # a small threshold merges the pending lists often; a large one never does
+    monkeypatch.setattr(ranking, 'COMPACT_MIN_UPDATES', compact_after)
+    rng = random.Random(7)
+    current = {f'u{i}': float(rng.randint(0, 20)) for i in range(50)}
+    index = RankingIndex(list(current), list(current.values()))
+
+    for step in range(300):
+        user_id = f'u{rng.randint(0, 70)}'
+        value = float(rng.randint(0, 20))
+        index.update(user_id, value)
+        current[user_id] = value
+        if step % 25 == 0:
+            _assert_matches_rebuild(index, current)
+    _assert_matches_rebuild(index, current)
+
+
+def test_service_follows_recorded_events(tmp_path):
+    store = ProfileStore(str(tmp_path))
+    service = RankingService(store)
+
+    def record(user_id, co2, when):
+        store.record([{'userId': user_id, 'category': 'shopping', 'details': {'items': 1},
+                       'co2_kg': co2, 'createdAt': when}])
+
+    record('a', 5, '2024-03-01T00:00:00Z')
+    record('b', 3, '2024-02-01T00:00:00Z')
+    for period in ('2024-03', 'all'):
+        service.index(period)
+
+    record('a', 4, '2024-03-02T00:00:00Z')
+    record('b', 1, '2024-03-02T00:00:00Z')
+    record('c', 2, '2024-03-03T00:00:00Z')
+
+    for period in ('2024-03', 'all'):
+        user_ids, totals = store.emission_totals(None if period == 'all' else period)
+        _assert_matches_rebuild(service.index(period), dict(zip(user_ids, totals.tolist())))
+    assert service.top(3, 'all')['leaderboard'][0] == {'rank': 1, 'userId': 'c', 'emission_kg': 2.0}
+    assert service.user_rank('a', 'all')['rank'] == 3
@@ -0,0 +1,33 @@
+import pytest
+
+import app
+import model3
+
+PROFILES = [
+    {'userId': str(i), 'avg_daily_travel_km': i % 40, 'avg_electricity_kwh': 50 + 7 * i % 200,
+     'avg_lpg_kg': i % 20, 'avg_nonveg_meals': i % 15, 'avg_items_purchased': i % 10,
+     'month_emission': 100 + 11 * i % 600}
+    for i in range(30)
+]
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(model3, 'CLUSTER_MODEL_PATH', str(tmp_path / 'model3_cluster.pkl'))
+    monkeypatch.setattr(model3, 'cluster_model', None)
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize('path, body', [
+    ('/model3/recommend', {'userId': '3', 'profiles': PROFILES}),
+    ('/model3/recommend/batch', {'userIds': ['3', '4'], 'profiles': PROFILES})
+])
+def test_profiles_path_needs_a_fitted_model(client, path, body):
+    response = client.post(path, json=body)
+    assert response.status_code == 409
+    assert model3.get_cluster_model() is None
+
+    assert client.post('/model3/refit', json={'profiles': PROFILES, 'k': 2}).status_code == 200
+    response = client.post(path, json=body)
+    assert response.status_code == 200
+    assert response.get_json()['model_version'] == 1
@@ -0,0 +1,122 @@
+import gc
+import importlib
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+
+# Modules that pull in pandas / sklearn or load fitted models
+HEAVY_MODULES = ['model1', 'model3', 'predictonmodel']
+
+_ready = threading.Event()
+_state = {
+    'status': 'idle',   # idle | disabled | warming | ready | failed
+    'started_at': None,
+    'finished_at': None,
+    'loaded': [],
+    'error': None
+}
+_lock = threading.Lock()
+# Serializes heavy imports: sklearn fails with a partially initialized module
+# if a request thread and the warm-up thread import it at the same time
+_import_lock = threading.RLock()
+
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            with _import_lock:
+                self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+def warm_up():
+    """Import the heavy modules and load (or, if missing, train) the models"""
+    with _lock:
+        if _state['status'] in ('warming', 'ready'):
+            return
+        _state.update(status='warming', started_at=time.time(), error=None)
+
+    try:
+        for name in HEAVY_MODULES:
+            with _import_lock:
+                importlib.import_module(name)
+            _state['loaded'].append(name)
+
+        import predictonmodel
+        import model3
+        predictonmodel.load_or_train_model()
+        model3.get_cluster_model()
+
+        _state.update(status='ready', finished_at=time.time())
+        _ready.set()
+        print(f"✓ Models warmed up in {_state['finished_at'] - _state['started_at']:.2f}s")
+    except Exception as e:
+        _state.update(status='failed', finished_at=time.time(), error=str(e))
+        print(f"✗ ERROR warming up models: {e}")
+        traceback.print_exc()
+
+
+def preload():
+    """
+    Load every model synchronously, before a pre-fork server forks workers.
+
+    Workers then inherit the loaded models copy-on-write, and gc.freeze()
+    keeps the garbage collector from touching (and so copying) those pages.
+    The compiled forest is memory-mapped from the registry, so its arrays
+    are shared through the page cache in any case.
+    """
+    warm_up()
+    gc.freeze()
+
+
+def start_warm_up():
+    """
+    Warm up in a daemon thread unless MODEL_WARMUP=0.
+
+    With PRELOAD_MODELS=1 (set by gunicorn.conf.py) models are loaded
+    synchronously instead, since threads do not survive fork. With warm-up
+    disabled the process reports ready at once: models load on first use.
+    """
+    if os.environ.get('MODEL_WARMUP', '1') == '0':
+        with _lock:
+            if _state['status'] == 'idle':
+                _state['status'] = 'disabled'
+                _ready.set()
+        return None
+    # spawned job workers re-import the main module; they load what they need
+    if multiprocessing.parent_process() is not None:
+        return None
+    if os.environ.get('PRELOAD_MODELS') == '1':
+        preload()
+        return None
+    thread = threading.Thread(target=warm_up, name='model-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def status():
+    return {
+        'ready': _ready.is_set(),
+        'status': _state['status'],
+        'loaded': list(_state['loaded']),
+        'error': _state['error'],
+        'warmup_seconds': (
+            round(_state['finished_at'] - _state['started_at'], 3)
+            if _state['finished_at'] and _state['started_at'] else None
+        )
+    }